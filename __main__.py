@@ -13,7 +13,17 @@
 #   limitations under the License.
 
 import sys
-from cli import main
 
 if __name__ == "__main__":
-  main(sys.argv[1:])
\ No newline at end of file
+  args = sys.argv[1:]
+  if len(args) > 2 and args[0] == '--connect':
+    # Forwards the command to a server started with `serve`, without loading anything else
+    import remote
+    sys.exit(remote.run(args[1], args[2:]))
+  import logger
+  from cli import main
+  try:
+    main(args)
+  finally:
+    # Written before any traceback
+    logger.flush()
\ No newline at end of file
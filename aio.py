@@ -0,0 +1,374 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Coroutine equivalents of the blocking calls of `api` and `ossrh`, such that a single event loop can drive many
+uploads and status polls at once, without a thread per operation. Requires Python 3 and aiohttp, and is therefore
+not imported by the command line interface.
+
+  async with aio.AsyncClient(client.Client(group='com.example')) as aclient:
+    await aio.upload_project(aclient, planner.plan_project(project_dir, name, version))
+    await aio.close_repositories(aclient, [ name ])
+"""
+
+import os
+import time
+import asyncio
+import api
+import cache
+import logger
+import metrics
+import ossrh
+import session
+import uploader
+from utils import HashingReader, HASH_CHUNK_SIZE
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+class AsyncClient:
+  """Sends requests on behalf of a `client.Client` or `client.JobClient`, whose settings, credentials and policies it
+  follows. Each attempt is reported to `hooks`, which default to those of the job wrapped (a plain client has none).
+  Must be used from a single event loop, preferably with `async with` such that connections are closed once done."""
+
+  def __init__(self, client, hooks=None):
+    if aiohttp == None:
+      raise ImportError("The asyncio API requires aiohttp: pip install aiohttp")
+    self.client = client
+    self.hooks = tuple(hooks) if hooks != None else client.hooks
+    self._session = None
+    self._retryStats = { 'retries': 0, 'seconds': 0.0 }
+
+  def __getattr__(self, name):
+    # Settings are those of the client
+    if name == 'client':
+      raise AttributeError(name)
+    return getattr(self.client, name)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  def _get_session(self):
+    if self._session == None:
+      connector = aiohttp.TCPConnector(limit=self.client.poolHosts * self.client.poolMaxPerHost,
+        limit_per_host=self.client.poolMaxPerHost)
+      headers = { }
+      if self.client.agent != None:
+        headers['User-Agent'] = self.client.agent
+      auth = aiohttp.BasicAuth(*self.client.creds) if self.client.creds != None else None
+      self._session = aiohttp.ClientSession(connector=connector, auth=auth, headers=headers)
+    return self._session
+
+  async def close(self):
+    if self._session != None:
+      await self._session.close()
+      self._session = None
+
+  def retry_stats(self):
+    return dict(self._retryStats)
+
+  async def request(self, method, url, data=None, read=True, endpoint=None, **kwargs):
+    """Sends a request with the same retry policy as `session.HTTPSession.request`. `data` is bytes, or a function
+    opening a file, called again for each attempt. Unless `read` is False, the body is read before returning, such
+    that the connection can go back to the pool; the response is then available as `status` and `body`.
+    Each attempt is reported to the hooks under `endpoint`, or else the url."""
+    idempotent = method in session.IDEMPOTENT_METHODS
+    declaredBytes = (kwargs.get('headers') or { }).get('Content-Length')
+    attempt = 0
+    while True:
+      body = data() if callable(data) else data
+      sent = time.time()
+      try:
+        response = await self._get_session().request(method, url, data=body, **kwargs)
+        if read:
+          response.body = await response.read()
+          response.release()
+      except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        self._report(method, endpoint or url, None, e, body, declaredBytes, sent)
+        safe = idempotent or isinstance(e, aiohttp.ClientConnectorError)
+        if not safe or attempt >= self.client.retryAttempts:
+          raise
+        delay = session.backoff_delay(self.client, attempt)
+      else:
+        self._report(method, endpoint or url, response, None, body, declaredBytes, sent)
+        retryable = idempotent and response.status in session.RETRYABLE_STATUSES
+        if not retryable or attempt >= self.client.retryAttempts:
+          return response
+        delay = session.retry_after_delay(self.client, response.headers)
+        if delay == None:
+          delay = session.backoff_delay(self.client, attempt)
+        response.release()
+      finally:
+        if hasattr(body, 'close'):
+          body.close()
+      await asyncio.sleep(delay)
+      self._retryStats['retries'] += 1
+      self._retryStats['seconds'] += delay
+      attempt += 1
+
+  def _report(self, method, endpoint, response, error, body, declaredBytes, sent):
+    if len(self.hooks) == 0:
+      return
+    requestBytes = len(body) if isinstance(body, bytes) else None
+    if requestBytes == None and hasattr(body, 'name'):
+      # aiohttp closes files once sent
+      requestBytes = os.path.getsize(body.name)
+    if requestBytes == None and declaredBytes != None:
+      requestBytes = int(declaredBytes)
+    if response == None:
+      record = metrics.RequestRecord(method, endpoint, None, error.__class__.__name__, requestBytes, None,
+        time.time() - sent, sent)
+    else:
+      responseBytes = len(response.body) if hasattr(response, 'body') else response.content_length
+      record = metrics.RequestRecord(method, endpoint, response.status, None, requestBytes, responseBytes,
+        time.time() - sent, sent)
+    for hook in self.hooks:
+      hook(record)
+
+def _raise_for_status(response):
+  if response.status >= 400:
+    raise IOError("Error: " + str(response.status) + "\n" + response.body.decode('utf-8', 'replace'))
+
+async def get_staging_repository_descriptors(aclient, filter):
+  """Same as `api.get_staging_repository_descriptors`, parsing the listing as it arrives"""
+  response = await aclient.request('GET', aclient.baseURL + api.STAGING_REPOS_PATH, read=False,
+    endpoint=api.STAGING_REPOS_PATH)
+  try:
+    if response.status >= 400:
+      response.body = await response.read()
+      _raise_for_status(response)
+    parser = api.DescriptorParser(filter)
+    async for chunk in response.content.iter_chunked(api.LISTING_CHUNK_SIZE):
+      parser.feed(chunk)
+    return parser.close()
+  finally:
+    response.release()
+
+async def find_all_staging_repositories(aclient):
+  agentFilter = ("userAgent='" + aclient.agent + "'") if aclient.agent != None else ""
+  profileFilter = ("profileName='" + aclient.group + "'") if aclient.group != None else ""
+  filters = list(filter(None, [agentFilter, profileFilter]))
+  if len(filters) == 0:
+    raise ValueError("Not enough parameters: please specify at least one of 'agent' or 'group'")
+  return await get_staging_repository_descriptors(aclient, ' and '.join(filters))
+
+async def list_directory(aclient, url, listingCache=None, sealed=False):
+  """Same as `api.list_directory`. The cache is written off the loop, since it may evict files."""
+  entry = listingCache.get(url) if listingCache != None else None
+  if entry != None and sealed and entry.sealed:
+    return api.parse_listing(entry.body)
+  headers = entry.validators() if entry != None else { }
+  response = await aclient.request('GET', url, endpoint=api.CONTENT_ENDPOINT, headers=headers)
+  if response.status == 304 and entry != None:
+    if sealed:
+      entry.sealed = True
+      await asyncio.get_event_loop().run_in_executor(None, listingCache.put, url, entry)
+    return api.parse_listing(entry.body)
+  _raise_for_status(response)
+  if listingCache != None:
+    entry = cache.CacheEntry(response.body, response.headers.get('ETag'), response.headers.get('Last-Modified'), sealed)
+    await asyncio.get_event_loop().run_in_executor(None, listingCache.put, url, entry)
+  return api.parse_listing(response.body)
+
+async def crawl(aclient, url, max_depth=None, workers=None, listingCache=None, sealed=False):
+  """Same as `api.crawl`: lists up to `workers` directories at once"""
+  if workers == None:
+    workers = aclient.crawlWorkers
+  semaphore = asyncio.Semaphore(max(1, workers))
+  result = api.CrawlResult()
+
+  async def explore(url, depth):
+    async with semaphore:
+      items = await list_directory(aclient, url, listingCache, sealed)
+    children = [ ]
+    for item in items:
+      if item.isLeaf:
+        result.leaves.append(item)
+        continue
+      result.directories += 1
+      if max_depth != None and depth >= max_depth:
+        result.unexplored.append(item)
+      else:
+        children.append(explore(item.uri, depth + 1))
+    await asyncio.gather(*children)
+
+  await explore(url, 0)
+  result.leaves.sort(key=lambda item: item.uri)
+  result.unexplored.sort(key=lambda item: item.uri)
+  return result
+
+async def _is_sealed(aclient, name, listingCache):
+  if listingCache == None:
+    return False
+  repoNodes = await get_staging_repository_descriptors(aclient, "repositoryId='" + name + "'")
+  return api.update_seal(listingCache, name, repoNodes)
+
+async def inspect(aclient, name, max_depth=None):
+  """Same as `api.inspect`"""
+  url = aclient.baseURL + api.INSPECT_PATH + name + "/content/"
+  listingCache = cache.get_listing_cache(aclient.client)
+  sealed = await _is_sealed(aclient, name, listingCache)
+  api.log_crawl_result(await crawl(aclient, url, max_depth, listingCache=listingCache, sealed=sealed))
+
+async def put_file(aclient, local_path, remote_path, data=None, **kwargs):
+  """Same as `api.put_file`. Files are streamed from disk, and reopened if the upload has to be retried. Other
+  arguments go to `AsyncClient.request`."""
+  url = api.deploy_url(aclient.client) + remote_path
+  endpoint = api.DEPLOY_BY_REPOSITORY_ID_ENDPOINT if aclient.repositoryId != None else api.UPLOADS_PATH
+  response = await aclient.request('PUT', url, endpoint=endpoint, data=data if data != None else (lambda: open(local_path, 'rb')),
+    **kwargs)
+  _raise_for_status(response)
+
+async def _read_chunks(reader):
+  """Yields the content of a `HashingReader` from its start, reading it off the loop"""
+  loop = asyncio.get_event_loop()
+  await loop.run_in_executor(None, reader.seek, 0)
+  while True:
+    chunk = await loop.run_in_executor(None, reader.read, HASH_CHUNK_SIZE)
+    if not chunk:
+      return
+    yield chunk
+
+async def _run_job(aclient, job):
+  """Uploads a job and returns the jobs which must follow it. Files are hashed while they are sent, off the loop,
+  such that they are read only once."""
+  if not job.checksums:
+    await put_file(aclient, job.local_path, job.remote_path, job.data)
+    return [ ]
+  with open(job.local_path, 'rb') as f:
+    reader = HashingReader(f)
+    # The length is given, or else the body would be sent chunked
+    await put_file(aclient, job.local_path, job.remote_path, lambda: _read_chunks(reader),
+      headers={ 'Content-Length': str(len(reader)) })
+  return uploader.checksum_jobs(job.local_path, job.remote_path, reader.hexdigests(), job.tag)
+
+class _Scheduled:
+  def __init__(self, job):
+    self.job = job
+    self.error = None
+    self.cancelled = False
+    self.followups = [ ]
+
+async def run_uploads(aclient, jobs, workers=None):
+  """Same as `uploader.run_uploads`: uploads up to `workers` jobs at once, stops starting new ones after the first
+  failure, logs results in the order of `jobs` and raises the first failure. Returns the completed jobs."""
+  if workers == None:
+    workers = aclient.uploadWorkers
+  semaphore = asyncio.Semaphore(max(1, workers))
+  failed = [ ]
+
+  async def run(entry):
+    async with semaphore:
+      if len(failed) > 0:
+        entry.cancelled = True
+        return
+      try:
+        followups = await _run_job(aclient, entry.job)
+      except Exception as e:
+        entry.error = e
+        failed.append(entry)
+        return
+    entry.followups = [ _Scheduled(followup) for followup in followups ]
+    await asyncio.gather(*(run(child) for child in entry.followups))
+
+  scheduled = [ _Scheduled(job) for job in jobs ]
+  await asyncio.gather(*(run(entry) for entry in scheduled))
+  errors = [ ]
+  completed = [ ]
+  _log_results(scheduled, errors, completed)
+  if len(errors) > 0:
+    raise errors[0]
+  return completed
+
+def _log_results(scheduled, errors, completed):
+  for entry in scheduled:
+    if entry.cancelled:
+      continue
+    logger.log("Uploading " + entry.job.local_path + " -> " + entry.job.remote_path + "...", no_NL=True)
+    if entry.error != None:
+      logger.log(" [failed]")
+      errors.append(entry.error)
+    else:
+      logger.log(" [done]")
+      completed.append(entry.job)
+      _log_results(entry.followups, errors, completed)
+
+async def upload_project(aclient, plan):
+  """Same as `ossrh.upload_project`, without resuming. Artifacts are hashed by their jobs while they are sent."""
+  return await run_uploads(aclient, ossrh.project_upload_jobs(aclient.client, plan, hashLater=True))
+
+async def upload_batch(aclient, plans):
+  """Uploads several planned projects at once, sharing the same workers and connections"""
+  jobs = [ ]
+  for plan in plans:
+    jobs += ossrh.project_upload_jobs(aclient.client, plan, hashLater=True)
+  return await run_uploads(aclient, jobs)
+
+async def wait_not_transitioning(aclient, names):
+  """Waits until none of the given repositories are transitioning, fetching the status of all of them at once on
+  each poll and pacing polls like `ossrh.Poller`. Returns a dict of name -> descriptor, where the descriptor is None
+  if the repository is gone. Many waits may run concurrently on the same loop."""
+  poller = ossrh.Poller(aclient.client, str(len(names)) + " repos" if len(names) != 1 else "repo '" + names[0] + "'")
+  repoFilter = ' or '.join("repositoryId='" + name + "'" for name in names)
+  while True:
+    repoNodes = await get_staging_repository_descriptors(aclient, repoFilter)
+    poller.polled()
+    if not any(node.isTransitioning for node in repoNodes):
+      byName = dict((node.name, node) for node in repoNodes)
+      return dict((name, byName.get(name)) for name in names)
+    delay = poller.next_delay()
+    await asyncio.sleep(delay)
+    aclient.client.count_poll(delay)
+
+async def _post_no_error(aclient, path, payload):
+  response = await aclient.request('POST', aclient.baseURL + path, endpoint=path, json=payload)
+  if response.status >= 400:
+    logger.error("Error: " + str(response.status))
+    logger.error(response.body.decode('utf-8', 'replace'))
+    raise IOError("Server responded with an error.")
+
+async def _bulk_action(aclient, names, path, description, verb, succeeded, extra=None):
+  payload = { "data": { "description": description, "stagedRepositoryIds": list(names) } }
+  payload["data"].update(extra or { })
+  await _post_no_error(aclient, path, payload)
+  repoNodes = await wait_not_transitioning(aclient, names)
+  failed = [ ]
+  for name in names:
+    if succeeded(repoNodes[name]):
+      logger.log("  " + name + ": success")
+    else:
+      logger.log("  " + name + ": failed, node=" + str(repoNodes[name]))
+      failed.append(name)
+  if len(failed) > 0:
+    raise ValueError("Error: Failed to " + verb + " repositories " + ', '.join(failed) +
+      ". For more details, log into oss.sonatype.org and look at these repositories.")
+
+async def close_repositories(aclient, names):
+  """Same as `ossrh.close_repositories`"""
+  await _bulk_action(aclient, names, api.ACTION_CLOSE_PATH, "closed from cli", "close",
+    lambda node: node != None and node.isClosed)
+
+async def drop_repositories(aclient, names):
+  """Same as `ossrh.drop_repositories`"""
+  await _bulk_action(aclient, names, api.ACTION_DROP_PATH, "dropped from cli", "drop", lambda node: node == None)
+
+async def release_repositories(aclient, names):
+  """Same as `ossrh.release_repositories`"""
+  await _bulk_action(aclient, names, api.ACTION_PROMOTE_PATH, "released from cli", "release",
+    lambda node: node == None, { "autoDropAfterRelease": True })
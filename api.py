@@ -13,13 +13,15 @@
 #   limitations under the License.
 
 """
-This file shall gather all the network calls into ossrh.
+This file shall gather all the network calls into ossrh. Each of them is sent through the `client.Client` given as
+first parameter.
 """
 
 import lxml.etree
-import requests,sys
-import config
+import concurrent.futures
 import logger
+import cache
+import bundle
 
 UPLOADS_PATH="/staging/deploy/maven2/"
 STAGING_REPOS_PATH="/staging/profile_repositories"
@@ -27,106 +29,382 @@ ACTION_CLOSE_PATH="/staging/bulk/close"
 ACTION_DROP_PATH="/staging/bulk/drop"
 ACTION_PROMOTE_PATH="/staging/bulk/promote"
 INSPECT_PATH="/repositories/"
+BUNDLE_UPLOAD_PATH="/staging/bundle_upload"
+PROFILES_PATH="/staging/profiles"
+DEPLOY_BY_REPOSITORY_ID_PATH="/staging/deployByRepositoryId/"
 
-def _get_base_headers():
-  if config.agent != None:
-    return { 'User-Agent': config.agent }
-  else:
-    return { }
+# Endpoints requests are reported under to the client's hooks, when their path holds parameters
+CONTENT_ENDPOINT=INSPECT_PATH + "{repositoryId}/content/"
+START_ENDPOINT=PROFILES_PATH + "/{profileId}/start"
+DEPLOY_BY_REPOSITORY_ID_ENDPOINT=DEPLOY_BY_REPOSITORY_ID_PATH + "{repositoryId}/"
+
+# Size of the blocks in which the repositories listing is fed to the parser
+LISTING_CHUNK_SIZE=64 * 1024
 
-def get_staging_repository_descriptors(filter):
+def get_staging_repository_descriptors(client, filter, fresh=False):
+  """Returns the descriptors of the staging repositories matching the xpath predicate `filter`. They may come from the
+  client's short-lived cache, unless `fresh` is set, which also drops the cached ones since they may be about to
+  change."""
+  descriptorCache = cache.get_descriptor_cache(client)
+  if descriptorCache == None:
+    return _fetch_descriptors(client, filter)
+  if fresh:
+    descriptorCache.invalidate()
+    return _fetch_descriptors(client, filter)
+  fetch = lambda: [ descriptor.to_dict() for descriptor in _fetch_descriptors(client, None) ]
+  return filter_descriptors([ RepositoryDescriptor.from_dict(d) for d in descriptorCache.get(fetch) ], filter)
+
+def filter_descriptors(descriptors, filter):
+  """Applies the xpath predicate `filter` to already parsed descriptors"""
   if filter == None:
-    filter = ""
+    return descriptors
+  predicate = lxml.etree.XPath("self::stagingProfileRepository[" + filter + "]")
+  return [ descriptor for descriptor in descriptors if predicate(descriptor.to_element()) ]
+
+def _fetch_descriptors(client, filter):
+  url = client.baseURL + STAGING_REPOS_PATH
+  response = client.request('GET', url, endpoint=STAGING_REPOS_PATH, stream=True)
+  try:
+    if response.status_code >= 400:
+      raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
+    return parse_repository_descriptors(response.iter_content(LISTING_CHUNK_SIZE), filter)
+  finally:
+    response.close()
+
+def parse_repository_descriptors(chunks, filter=None):
+  """Parses a repositories listing as its chunks arrive. Repositories not matching the xpath predicate `filter`
+  are discarded right away, such that only the matching ones are ever held in memory."""
+  parser = DescriptorParser(filter)
+  for chunk in chunks:
+    parser.feed(chunk)
+  return parser.close()
+
+class DescriptorParser:
+  """Incremental parser behind `parse_repository_descriptors`, for callers which receive chunks on their own"""
+
+  def __init__(self, filter=None):
+    self.predicate = None
+    if filter != None:
+      self.predicate = lxml.etree.XPath("self::stagingProfileRepository[" + filter + "]")
+    self.parser = lxml.etree.XMLPullParser(events=('end',), tag='stagingProfileRepository')
+    self.descriptors = [ ]
+
+  def feed(self, chunk):
+    self.parser.feed(chunk)
+    self._collect()
+
+  def close(self):
+    """Returns the descriptors of all matching repositories"""
+    self.parser.close()
+    self._collect()
+    return self.descriptors
+
+  def _collect(self):
+    for _, node in self.parser.read_events():
+      if self.predicate == None or self.predicate(node):
+        self.descriptors.append(RepositoryDescriptor(node))
+      # Free the parsed repository along with everything parsed before it
+      node.clear()
+      parent = node.getparent()
+      if parent != None:
+        del parent[:-1]
+
+class ContentItem(object):
+  """An entry of a repository's content listing: either a file (leaf) or a directory"""
+
+  __slots__ = ('uri', 'relativePath', 'isLeaf', 'size', 'lastModified')
+
+  def __init__(self, node):
+    self.uri = _child_text(node, "resourceURI")
+    self.relativePath = _child_text(node, "relativePath")
+    self.isLeaf = _child_text(node, "leaf") == 'true'
+    size = _child_text(node, "sizeOnDisk")
+    self.size = int(size) if size != None else -1
+    self.lastModified = _child_text(node, "lastModified")
+
+  def __repr__(self):
+    return "(uri={}, leaf={}, size={})".format(self.uri, self.isLeaf, self.size)
+
+class CrawlResult:
+  """What was found while exploring a repository's content"""
+
+  def __init__(self):
+    self.leaves = [ ]
+    # Directories which were not explored because they are deeper than the maximum depth
+    self.unexplored = [ ]
+    self.directories = 0
+
+  def total_size(self):
+    return sum(leaf.size for leaf in self.leaves if leaf.size > 0)
+
+def list_directory(client, url, listingCache=None, sealed=False):
+  """Fetches the listing of a single directory of a repository's content.
+  With a cache, sealed listings are served from disk, and other ones are revalidated with a conditional request."""
+  entry = listingCache.get(url) if listingCache != None else None
+  if entry != None and sealed and entry.sealed:
+    return parse_listing(entry.body)
+  headers = entry.validators() if entry != None else { }
+  response = client.request('GET', url, endpoint=CONTENT_ENDPOINT, headers=headers)
+  if response.status_code == 304 and entry != None:
+    if sealed:
+      entry.sealed = True
+      listingCache.put(url, entry)
+    return parse_listing(entry.body)
+  if response.status_code >= 400:
+    raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
+  if listingCache != None:
+    listingCache.put(url, cache.CacheEntry(response.content, response.headers.get('ETag'),
+      response.headers.get('Last-Modified'), sealed))
+  return parse_listing(response.content)
+
+def parse_listing(body):
+  root = lxml.etree.XML( body )
+  return [ ContentItem(node) for node in root.xpath("./data/content-item") ]
+
+def crawl(client, url, max_depth=None, workers=None, listingCache=None, sealed=False):
+  """Explores a repository's content breadth first, without recursion, listing up to `workers` directories at once.
+  Directories more than `max_depth` levels below url are not explored."""
+  if workers == None:
+    workers = client.crawlWorkers
+  result = CrawlResult()
+  listDirectory = logger.carry(list_directory)
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+  try:
+    inFlight = { executor.submit(listDirectory, client, url, listingCache, sealed): 0 }
+    while len(inFlight) > 0:
+      done, _ = concurrent.futures.wait(list(inFlight), return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        depth = inFlight.pop(future)
+        if future.exception() != None:
+          for pending in inFlight:
+            pending.cancel()
+          raise future.exception()
+        for item in future.result():
+          if item.isLeaf:
+            result.leaves.append(item)
+            continue
+          result.directories += 1
+          if max_depth != None and depth >= max_depth:
+            result.unexplored.append(item)
+          else:
+            inFlight[executor.submit(listDirectory, client, item.uri, listingCache, sealed)] = depth + 1
+  finally:
+    executor.shutdown(wait=True)
+  result.leaves.sort(key=lambda item: item.uri)
+  result.unexplored.sort(key=lambda item: item.uri)
+  return result
+
+def _get_content(client, repoId, path):
+  """Fetches a path of a repository's content. Returns None if it does not exist."""
+  url = client.baseURL + INSPECT_PATH + repoId + "/content" + path
+  response = client.request('GET', url, endpoint=CONTENT_ENDPOINT)
+  if response.status_code == 404:
+    return None
+  if response.status_code >= 400:
+    raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
+  return response.content
+
+def list_repository_directory(client, repoId, path):
+  """Lists a directory of a repository's content, without going through the cache. Returns an empty list if the
+  directory does not exist."""
+  body = _get_content(client, repoId, path)
+  return parse_listing(body) if body != None else [ ]
+
+def read_repository_file(client, repoId, path):
+  """Returns the content of a file of a repository, or None if there is no such file"""
+  return _get_content(client, repoId, path)
+
+def _is_sealed(client, name, listingCache):
+  """Whether the repository is closed, in which case its content won't change anymore. The repository is looked up
+  each time, since a seal only holds while it is listed as closed: once released or dropped, its listings are
+  revalidated again."""
+  if listingCache == None:
+    return False
+  repoNodes = get_staging_repository_descriptors(client, "repositoryId='" + name + "'")
+  return update_seal(listingCache, name, repoNodes)
+
+def update_seal(listingCache, name, repoNodes):
+  """Seals or unseals a repository in the cache according to its freshly fetched descriptors. Returns whether it is
+  sealed."""
+  if len(repoNodes) > 0 and repoNodes[0].isClosed and not repoNodes[0].isTransitioning:
+    if not listingCache.is_sealed(name):
+      listingCache.seal(name)
+    return True
+  listingCache.unseal(name)
+  return False
+
+def inspect(client, name, max_depth=None):
+  """Logs every file of a repository in a sorted order, followed by a summary"""
+  url = client.baseURL + INSPECT_PATH + name + "/content/"
+  listingCache = cache.get_listing_cache(client)
+  result = crawl(client, url, max_depth, listingCache=listingCache, sealed=_is_sealed(client, name, listingCache))
+  log_crawl_result(result)
+
+def log_crawl_result(result):
+  """Logs every file found while crawling in a sorted order, followed by a summary"""
+  for item in sorted(result.leaves + result.unexplored, key=lambda item: item.uri):
+    logger.log(item.uri)
+  logger.log("{} directories, {} files, {} bytes".format(result.directories, len(result.leaves), result.total_size()) +
+    (", {} directories not explored".format(len(result.unexplored)) if len(result.unexplored) > 0 else ""))
+
+def put_file(client, local_path, remote_path, data=None):
+  """Uploads a file at local_path to remote_path on ossrh. Safe to call from several threads at once.
+  If `data` (bytes or a readable stream) is provided, it is uploaded instead and local_path is only used for display."""
+  if data != None:
+    _put(client, remote_path, data)
   else:
-    filter = "[" + filter + "]"
+    with open(local_path, 'rb') as f:
+      _put(client, remote_path, f)
+
+def deploy_url(client):
+  """Uploads go to the repository given by the client's `repositoryId`, or to whichever repository Nexus picks if there
+  is none"""
+  if client.repositoryId != None:
+    return client.baseURL + DEPLOY_BY_REPOSITORY_ID_PATH + client.repositoryId
+  return client.baseURL + UPLOADS_PATH
 
-  url = config.baseURL + STAGING_REPOS_PATH
-  response = requests.get(url, auth=config.creds, headers=_get_base_headers())
+def _put(client, remote_path, body):
+  url = deploy_url(client) + remote_path
+  endpoint = DEPLOY_BY_REPOSITORY_ID_ENDPOINT if client.repositoryId != None else UPLOADS_PATH
+  response = client.request('PUT', url, endpoint=endpoint, data=body)
   if response.status_code >= 400:
     raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
 
-  xmlNodes = lxml.etree.XML( response.text ).xpath("./data/stagingProfileRepository" + filter)
-  return list(map(lambda node: RepositoryDescriptor(node), xmlNodes))
 
-def _inspect_url(url):
-  """Recursively explore a repository's content and logs each leaf found this way."""
-  response = requests.get(url, auth=config.creds, headers=_get_base_headers())
+def upload_bundle(client, name, chunks):
+  """Uploads a bundle, given as a stream of chunks, in a single streamed request. Returns the URIs of the repositories
+  the bundle was staged into."""
+  url = client.baseURL + BUNDLE_UPLOAD_PATH
+  boundary = bundle.new_boundary()
+  body = bundle.stream_multipart("file", name, "application/java-archive", chunks, boundary)
+  response = client.request('POST', url, endpoint=BUNDLE_UPLOAD_PATH, data=body, headers={ 'Content-Type': 'multipart/form-data; boundary=' + boundary })
   if response.status_code >= 400:
     raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
+  try:
+    return response.json().get('repositoryUris', [ ])
+  except ValueError:
+    return [ ]
 
-  root = lxml.etree.XML( response.text )
-  for item in root.xpath("./data/content-item"):
-    uri=item.find("resourceURI").text
-    if item.find("leaf").text == 'true':
-      logger.log(uri)
-    else:
-      _inspect_url(uri)
-
-def inspect(name):
-  url = config.baseURL + INSPECT_PATH + name + "/content/"
-  _inspect_url(url)
-
-def upload_file(local_path, remote_path):
-  """Uploads a file at local_path to remote_path on ossrh"""
-  url = config.baseURL + UPLOADS_PATH + remote_path
-  logger.log("Uploading " + local_path + " -> " + remote_path + "...", no_NL=True)
-  with open(local_path, 'rb') as f:
-    response = requests.put(url, data=f, auth=config.creds, headers=_get_base_headers())
-    if response.status_code >= 400:
-      raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
-  logger.log(" [done]")
+class StagingProfile(object):
+  __slots__ = ('id', 'name')
 
+  def __init__(self, id, name):
+    self.id = id
+    self.name = name
+
+def get_staging_profiles(client):
+  response = client.request('GET', client.baseURL + PROFILES_PATH, endpoint=PROFILES_PATH)
+  if response.status_code >= 400:
+    raise IOError("Error: " + str(response.status_code) + "\n" + response.text)
+  root = lxml.etree.fromstring(response.content)
+  return [ StagingProfile(_child_text(node, 'id'), _child_text(node, 'name')) for node in root.iter('stagingProfile') ]
 
-def _post_no_error(url, payload):
-  response = requests.post(url, json=payload, auth=config.creds, headers=_get_base_headers())
+def start_staging_repository(client, profileId, description):
+  """Creates a new open staging repository in a profile, and returns its id. Returns None if the profile does not exist."""
+  url = client.baseURL + PROFILES_PATH + "/" + profileId + "/start"
+  response = client.request('POST', url, endpoint=START_ENDPOINT, json={ 'data': { 'description': description } }, headers={ 'Accept': 'application/json' })
+  if response.status_code == 404:
+    return None
   if response.status_code >= 400:
-    logger.log("Error: " + str(response.status_code))
-    logger.log(response.text)
+    logger.error("Error: " + str(response.status_code))
+    logger.error(response.text)
     raise IOError("Server responded with an error.")
+  return response.json()['data']['stagedRepositoryId']
 
-def close_repository(repoId):
-  url = config.baseURL + ACTION_CLOSE_PATH
+def _post_no_error(client, path, payload):
+  response = client.request('POST', client.baseURL + path, endpoint=path, json=payload)
+  if response.status_code >= 400:
+    logger.error("Error: " + str(response.status_code))
+    logger.error(response.text)
+    raise IOError("Server responded with an error.")
+
+def close_repository(client, repoId):
+  close_repositories(client, [ repoId ])
+
+def close_repositories(client, repoIds):
+  """Closes several repositories with a single request"""
   payload = {
     "data": {
       "description": "closed from cli",
-      "stagedRepositoryIds": [ repoId ]
+      "stagedRepositoryIds": list(repoIds)
     }
   }
-  _post_no_error(url, payload)
+  _post_no_error(client, ACTION_CLOSE_PATH, payload)
 
-def drop_repository(repoId):
-  url = config.baseURL + ACTION_DROP_PATH
+def drop_repository(client, repoId):
+  drop_repositories(client, [ repoId ])
+
+def drop_repositories(client, repoIds):
+  """Drops several repositories with a single request"""
   payload = {
     "data": {
       "description": "dropped from cli",
-      "stagedRepositoryIds": [ repoId ]
+      "stagedRepositoryIds": list(repoIds)
     }
   }
-  _post_no_error(url, payload)
+  _post_no_error(client, ACTION_DROP_PATH, payload)
+
+def release_repository(client, repoId):
+  release_repositories(client, [ repoId ])
 
-def release_repository(repoId):
-  url = config.baseURL + ACTION_PROMOTE_PATH
+def release_repositories(client, repoIds):
+  """Releases several repositories with a single request"""
   payload = {
     "data": {
       "autoDropAfterRelease": True,
       "description": "released from cli",
-      "stagedRepositoryIds": [ repoId ]
+      "stagedRepositoryIds": list(repoIds)
     }
   }
-  _post_no_error(url, payload)
+  _post_no_error(client, ACTION_PROMOTE_PATH, payload)
+
+def _child_text(node, tag):
+  child = node.find(tag)
+  return child.text if child != None else None
 
-class RepositoryDescriptor:
-  """Wrapper around the xml repository node returned by the ossrh api. Makes using that node less awkward"""
+class RepositoryDescriptor(object):
+  """Compact summary of the xml repository node returned by the ossrh api. Makes using that node less awkward"""
+
+  __slots__ = ('name', 'agent', 'profileId', 'profileName', 'type', 'isClosed', 'isTransitioning',
+    'created', 'updated', 'description')
 
   def __init__(self, node):
-    self.name = node.find("repositoryId").text
-    self.agent = node.find("userAgent").text
-    self.isClosed = node.find("type").text == "closed"
-    self.isTransitioning = node.find("transitioning").text == "true"
+    self.name = _child_text(node, "repositoryId")
+    self.agent = _child_text(node, "userAgent")
+    self.profileId = _child_text(node, "profileId")
+    self.profileName = _child_text(node, "profileName")
+    self.type = _child_text(node, "type")
+    self.isClosed = self.type == "closed"
+    self.isTransitioning = _child_text(node, "transitioning") == "true"
+    self.created = _child_text(node, "created")
+    self.updated = _child_text(node, "updated")
+    self.description = _child_text(node, "description")
 
   def __repr__(self):
     return "(name={}, agent={}, attrs={})".format(self.name, self.agent, self.get_attrs())
 
+  def to_dict(self):
+    """The text of the xml children this descriptor was built from"""
+    return {
+      "repositoryId": self.name,
+      "userAgent": self.agent,
+      "profileId": self.profileId,
+      "profileName": self.profileName,
+      "type": self.type,
+      "transitioning": "true" if self.isTransitioning else "false",
+      "created": self.created,
+      "updated": self.updated,
+      "description": self.description
+    }
+
+  def to_element(self):
+    """Rebuilds an xml node equivalent to the one this descriptor was built from"""
+    return _descriptor_element(self.to_dict())
+
+  @staticmethod
+  def from_dict(d):
+    return RepositoryDescriptor(_descriptor_element(d))
+
   def get_attrs(self):
     attrs = [ ]
     if self.isClosed:
@@ -134,3 +412,10 @@ class RepositoryDescriptor:
     if self.isTransitioning:
       attrs.append("transitioning")
     return attrs
+
+def _descriptor_element(d):
+  node = lxml.etree.Element("stagingProfileRepository")
+  for (tag, text) in sorted(d.items()):
+    if text != None:
+      lxml.etree.SubElement(node, tag).text = text
+  return node
@@ -0,0 +1,245 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Runs `upload`, `upload-batch`, `inspect`, `publish` and `list` against fakenexus on synthetic projects and listings.
+Reports wall time, request count, bytes sent and received, peak RSS of the command and hashing throughput, and saves
+or compares baselines such that regressions can be caught.
+
+Each measured command runs in a fresh process, the fake server and the setup steps (e.g. uploading what `inspect`
+lists) run in this one.
+
+Usage: python benchmarks/bench_e2e.py [--latency <seconds>] [--transition-seconds <seconds>] [--save <file>]
+  [--compare <file>] [--tolerance <ratio>] [scenario...]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import cli
+import utils
+import config
+import logger
+import fakenexus
+
+VERSION = '1.0.0'
+GROUP = 'com.example'
+AGENT = 'bench-agent'
+SUFFIXES = [ '.pom', '.jar', '-sources.jar', '-javadoc.jar' ]
+
+# name: (command, modules, size in bytes of each jar, number of repositories of other profiles in the listing)
+SCENARIOS = [
+  ('upload-small', 'upload', 1, 64 * 1024, 0),
+  ('upload-large', 'upload', 1, 32 * 1024 * 1024, 0),
+  ('upload-many', 'upload-batch', 25, 16 * 1024, 0),
+  ('inspect', 'inspect', 10, 16 * 1024, 0),
+  ('publish', 'publish', 1, 64 * 1024, 0),
+  ('list-large', 'list', 0, 0, 20000),
+]
+
+# Metrics compared against baselines, and whether a higher value is worse
+METRICS = [
+  ('wall', True),
+  ('requests', True),
+  ('bytesSent', True),
+  ('peakRSSKB', True),
+  ('hashMBps', False),
+]
+
+def max_rss_kb():
+  # On Linux ru_maxrss survives fork and exec, such that children would report the peak of this process
+  if os.path.exists('/proc/self/status'):
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss / 1024 if sys.platform == 'darwin' else rss
+
+def make_modules(root, modules, size):
+  """Writes `modules` projects of a signed pom and three signed jars of `size` bytes, returns all their files"""
+  files = [ ]
+  block = os.urandom(min(size, 1024 * 1024))
+  for index in range(modules):
+    name = 'module' + str(index)
+    directory = os.path.join(root, name)
+    os.makedirs(directory)
+    for suffix in SUFFIXES:
+      path = os.path.join(directory, name + '-' + VERSION + suffix)
+      with open(path, 'wb') as f:
+        if suffix == '.pom':
+          f.write(("<project><groupId>" + GROUP + "</groupId><artifactId>" + name + "</artifactId><version>" + VERSION +
+            "</version></project>").encode('utf-8'))
+        else:
+          written = 0
+          while written < size:
+            f.write(block[:size - written])
+            written += len(block)
+      with open(path + '.asc', 'wb') as f:
+        f.write(b"-----BEGIN PGP SIGNATURE-----")
+      files += [ path, path + '.asc' ]
+  return files
+
+def add_repositories(nexus, count):
+  """Fills the listing with repositories of 97 other profiles, as on oss.sonatype.org"""
+  for index in range(count):
+    profileId = "7edbe3150638" + str(index % 97)
+    nexus.add_profile(profileId, "org.other" + str(index % 97))
+    nexus.create_repository(profileId, 'agent-' + str(index), "Implicitly created (auto staging).")
+
+def hash_throughput(files):
+  """MB/s of utils.hash_file over the files of a scenario"""
+  size = sum(os.path.getsize(path) for path in files)
+  start = time.time()
+  for path in files:
+    utils.hash_file(path)
+  return size / (1024.0 * 1024.0) / max(time.time() - start, 1e-9)
+
+def run_cli(baseURL, cacheDir, args):
+  config.baseURL = baseURL
+  config.cacheDir = cacheDir
+  config.pollInitialInterval = 0.05
+  cli.main([ '--agent', AGENT, '--group', GROUP ] + args)
+
+def run_child(baseURL, cacheDir, args):
+  """Runs one command in this process and prints its wall time and peak RSS"""
+  logger.log = lambda txt, no_NL=False: None
+  start = time.time()
+  run_cli(baseURL, cacheDir, args)
+  print(json.dumps({ 'wall': time.time() - start, 'peakRSSKB': max_rss_kb() }))
+
+def run_scenario(scenario, options):
+  name, command, modules, size, repositories = scenario
+  workdir = tempfile.mkdtemp()
+  cacheDir = os.path.join(workdir, 'cache')
+  nexus = fakenexus.FakeNexus(latency=options.latency, transitionSeconds=options.transition_seconds)
+  nexus.start()
+  try:
+    files = make_modules(os.path.join(workdir, 'projects'), modules, size)
+    add_repositories(nexus, repositories)
+    if command == 'upload':
+      args = [ 'upload', os.path.join(workdir, 'projects', 'module0'), 'module0', VERSION ]
+    elif command == 'upload-batch':
+      args = [ 'upload-batch', '--tree', os.path.join(workdir, 'projects'), VERSION ]
+    else:
+      if modules > 0:
+        run_cli(nexus.url, cacheDir, [ 'upload-batch', '--tree', os.path.join(workdir, 'projects'), VERSION ])
+      repoIds = [ repo.id for repo in nexus.repositories.values() if repo.fields.get('userAgent') == AGENT ]
+      args = [ 'inspect', repoIds[0] ] if command == 'inspect' else [ command ]
+    nexus.reset_stats()
+    out = subprocess.check_output([ sys.executable, os.path.realpath(__file__), '--child', nexus.url, cacheDir ] + args)
+    result = json.loads(out.decode('utf-8').strip().split('\n')[-1])
+    result['requests'] = len(nexus.requests)
+    result['bytesSent'] = nexus.bytesIn
+    result['bytesReceived'] = nexus.bytesOut
+    result['connections'] = nexus.connections
+    result['polls'] = command == 'publish'
+    result['hashMBps'] = hash_throughput(files) if len(files) > 0 else None
+    return result
+  finally:
+    nexus.stop()
+    shutil.rmtree(workdir)
+
+def format_value(metric, value):
+  if value == None:
+    return "n/a"
+  if metric == 'wall':
+    return "{:.3f} s".format(value)
+  if metric == 'peakRSSKB':
+    return "{:.1f} MB".format(value / 1024.0)
+  if metric == 'hashMBps':
+    return "{:.1f} MB/s".format(value)
+  if metric.startswith('bytes'):
+    return "{:.2f} MB".format(value / (1024.0 * 1024.0))
+  return str(value)
+
+def compare(results, baseline, tolerance):
+  """Prints how results differ from the baseline, returns the list of regressions"""
+  regressions = [ ]
+  print("{:>14s} | {:>10s} | {:>14s} | {:>14s} | {:>8s}".format("scenario", "metric", "baseline", "now", "change"))
+  for name in sorted(results):
+    if name not in baseline['scenarios']:
+      continue
+    for (metric, higherIsWorse) in METRICS:
+      old = baseline['scenarios'][name].get(metric)
+      new = results[name].get(metric)
+      if old == None or new == None or old == 0:
+        continue
+      change = (new - old) / float(old)
+      # Request counts and bytes are deterministic unless the scenario polls, any increase is then a regression
+      deterministic = metric in ('requests', 'bytesSent') and not results[name]['polls']
+      allowed = 0 if deterministic else tolerance
+      regressed = change > allowed if higherIsWorse else change < -allowed
+      if regressed:
+        regressions.append(name + " " + metric)
+      print("{:>14s} | {:>10s} | {:>14s} | {:>14s} | {:>+7.1f}%{}".format(name, metric, format_value(metric, old),
+        format_value(metric, new), change * 100, "  REGRESSION" if regressed else ""))
+  return regressions
+
+def main(args):
+  if len(args) > 0 and args[0] == '--child':
+    run_child(args[1], args[2], args[3:])
+    return 0
+  parser = argparse.ArgumentParser(description="End-to-end benchmarks against a fake OSSRH")
+  parser.add_argument('--latency', type=float, default=0.01, help="seconds added to every request (default: 0.01)")
+  parser.add_argument('--transition-seconds', type=float, default=0.5, help="duration of close and release (default: 0.5)")
+  parser.add_argument('--save', help="writes the results to this baseline file")
+  parser.add_argument('--compare', help="compares the results with this baseline file, exits with 1 on regressions")
+  parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative change of timings and memory (default: 0.2)")
+  parser.add_argument('scenarios', nargs='*', help="scenarios to run among " + ", ".join(s[0] for s in SCENARIOS))
+  options = parser.parse_args(args)
+  os.environ.setdefault('OSSRH_USERNAME', 'bench')
+  os.environ.setdefault('OSSRH_PASSWORD', 'bench')
+  logger.log = lambda txt, no_NL=False: None
+
+  results = { }
+  print("{:>14s} | {:>9s} | {:>8s} | {:>10s} | {:>10s} | {:>10s} | {:>12s}".format(
+    "scenario", "wall", "requests", "sent", "received", "peak RSS", "hashing"))
+  for scenario in SCENARIOS:
+    if len(options.scenarios) > 0 and scenario[0] not in options.scenarios:
+      continue
+    result = results[scenario[0]] = run_scenario(scenario, options)
+    print("{:>14s} | {:>9s} | {:>8d} | {:>10s} | {:>10s} | {:>10s} | {:>12s}".format(scenario[0],
+      format_value('wall', result['wall']), result['requests'], format_value('bytesSent', result['bytesSent']),
+      format_value('bytesReceived', result['bytesReceived']), format_value('peakRSSKB', result['peakRSSKB']),
+      format_value('hashMBps', result['hashMBps'])))
+
+  report = { 'python': sys.version.split()[0], 'latency': options.latency,
+    'transitionSeconds': options.transition_seconds, 'scenarios': results }
+  if options.save != None:
+    with open(options.save, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  if options.compare != None:
+    with open(options.compare) as f:
+      baseline = json.load(f)
+    if baseline.get('latency') != options.latency or baseline.get('python') != report['python']:
+      print("Warning: the baseline was taken with Python " + str(baseline.get('python')) + " and a latency of " +
+        str(baseline.get('latency')) + "s")
+    print("")
+    regressions = compare(results, baseline, options.tolerance)
+    if len(regressions) > 0:
+      print("\nRegressions: " + ", ".join(regressions))
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
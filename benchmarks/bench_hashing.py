@@ -0,0 +1,95 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compares the single-pass chunked hashing of utils.hash_file against the former approach of reading the whole
+file once per digest.
+
+Usage: python benchmarks/bench_hashing.py [sizeInMB...]
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import utils
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+def legacy_hash(local_file):
+  """The former implementation: each digest reads the whole file into memory."""
+  digests = { }
+  for algorithm in utils.CHECKSUM_ALGORITHMS:
+    hasher = hashlib.new(algorithm)
+    with open(local_file, "rb") as inFile:
+      buf = inFile.read()
+      hasher.update(buf)
+    digests[algorithm] = hasher.hexdigest()
+  return digests
+
+def chunked_hash(local_file):
+  return utils.hash_file(local_file)
+
+def measure(fn, local_file, repeat):
+  best = None
+  peak = None
+  for _ in range(repeat):
+    if tracemalloc != None:
+      tracemalloc.start()
+    start = time.time()
+    result = fn(local_file)
+    elapsed = time.time() - start
+    if tracemalloc != None:
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    best = elapsed if best == None else min(best, elapsed)
+  return result, best, peak
+
+def make_file(size):
+  fd, path = tempfile.mkstemp()
+  block = os.urandom(1024 * 1024)
+  with os.fdopen(fd, 'wb') as f:
+    written = 0
+    while written < size:
+      f.write(block[:min(len(block), size - written)])
+      written += len(block)
+  return path
+
+def format_peak(peak):
+  return "n/a" if peak == None else "{:.1f} MB".format(peak / (1024.0 * 1024.0))
+
+def main(args):
+  sizes = [ int(arg) for arg in args ] if len(args) > 0 else [ 1, 16, 128 ]
+  print("{:>8s} | {:>10s} | {:>12s} | {:>10s} | {:>12s} | {:>12s}".format(
+    "size", "legacy", "legacy peak", "chunked", "chunked peak", "throughput"))
+  for sizeMB in sizes:
+    path = make_file(sizeMB * 1024 * 1024)
+    try:
+      legacyResult, legacyTime, legacyPeak = measure(legacy_hash, path, 3)
+      chunkedResult, chunkedTime, chunkedPeak = measure(chunked_hash, path, 3)
+      if legacyResult != chunkedResult:
+        raise AssertionError("Digests differ: " + str(legacyResult) + " != " + str(chunkedResult))
+      print("{:>5d} MB | {:>8.3f} s | {:>12s} | {:>8.3f} s | {:>12s} | {:>7.1f} MB/s".format(
+        sizeMB, legacyTime, format_peak(legacyPeak), chunkedTime, format_peak(chunkedPeak), sizeMB / max(chunkedTime, 1e-9)))
+    finally:
+      os.remove(path)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,119 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compares the streaming parse of /staging/profile_repositories against building the whole xml tree before filtering it,
+on a synthetic listing where most repositories belong to other profiles.
+
+Usage: python benchmarks/bench_listing.py [repositoryCount]
+"""
+
+import os
+import sys
+import time
+import resource
+import subprocess
+import lxml.etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import api
+
+REPOSITORY_TEMPLATE = """    <stagingProfileRepository>
+      <profileId>{profileId}</profileId>
+      <profileName>{profileName}</profileName>
+      <profileType>repository</profileType>
+      <repositoryId>{repositoryId}</repositoryId>
+      <type>{type}</type>
+      <policy>release</policy>
+      <userId>someone</userId>
+      <userAgent>agent-{index}</userAgent>
+      <ipAddress>10.0.0.1</ipAddress>
+      <repositoryURI>https://oss.sonatype.org/content/repositories/{repositoryId}</repositoryURI>
+      <created>2018-08-24T11:34:38.031Z</created>
+      <createdDate>Fri Aug 24 11:34:38 UTC 2018</createdDate>
+      <createdTimestamp>1535110478031</createdTimestamp>
+      <updated>2018-08-27T17:49:52.700Z</updated>
+      <updatedDate>Mon Aug 27 17:49:52 UTC 2018</updatedDate>
+      <updatedTimestamp>1535392192700</updatedTimestamp>
+      <description>Implicitly created (auto staging).</description>
+      <provider>maven2</provider>
+      <releaseRepositoryId>releases</releaseRepositoryId>
+      <releaseRepositoryName>Releases</releaseRepositoryName>
+      <notifications>6</notifications>
+      <transitioning>false</transitioning>
+    </stagingProfileRepository>
+"""
+
+def make_listing(count, ownShare=20):
+  """Builds a listing of `count` repositories, one in `ownShare` of which belongs to the 'com.example' profile"""
+  parts = [ "<stagingRepositories>\n  <data>\n" ]
+  for index in range(count):
+    own = index % ownShare == 0
+    parts.append(REPOSITORY_TEMPLATE.format(
+      index=index,
+      profileId="123d30a6798c66" if own else "7edbe3150638" + str(index % 97),
+      profileName="com.example" if own else "Central Bundles",
+      repositoryId=("comexample-" if own else "central_bundles-") + str(index),
+      type="closed" if index % 3 == 0 else "open"))
+  parts.append("  </data>\n</stagingRepositories>\n")
+  return "".join(parts).encode('utf-8')
+
+def tree_parse(payload, filter):
+  """The former implementation: decodes the whole response, builds the whole tree, then filters it"""
+  nodes = lxml.etree.XML(payload.decode('utf-8').encode('utf-8')).xpath("./data/stagingProfileRepository[" + filter + "]")
+  return [ api.RepositoryDescriptor(node) for node in nodes ]
+
+def streaming_parse(payload, filter):
+  chunks = (payload[i:i + api.LISTING_CHUNK_SIZE] for i in range(0, len(payload), api.LISTING_CHUNK_SIZE))
+  return api.parse_repository_descriptors(chunks, filter)
+
+PARSERS = { 'tree': tree_parse, 'streaming': streaming_parse }
+FILTER = "profileName='com.example'"
+
+def max_rss_kb():
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss / 1024 if sys.platform == 'darwin' else rss
+
+def run_child(parser, count):
+  """Runs one parser in this process and prints 'matches seconds extraKB'"""
+  payload = make_listing(count)
+  baseline = max_rss_kb()
+  start = time.time()
+  result = PARSERS[parser](payload, FILTER)
+  elapsed = time.time() - start
+  print("{} {} {}".format(len(result), elapsed, max_rss_kb() - baseline))
+
+def measure(parser, count):
+  """Each parser runs in a fresh process such that peak memory usage can be attributed to it"""
+  out = subprocess.check_output([ sys.executable, os.path.realpath(__file__), '--child', parser, str(count) ])
+  matches, elapsed, extraKB = out.decode('utf-8').split()
+  return int(matches), float(elapsed), int(float(extraKB))
+
+def main(args):
+  if len(args) > 0 and args[0] == '--child':
+    run_child(args[1], int(args[2]))
+    return
+  count = int(args[0]) if len(args) > 0 else 10000
+  size = len(make_listing(count))
+  results = dict((parser, measure(parser, count)) for parser in sorted(PARSERS))
+  if results['tree'][0] != results['streaming'][0]:
+    raise AssertionError("Parsers disagree")
+  print("{} repositories ({:.1f} MB), {} matching".format(count, size / (1024.0 * 1024.0), results['tree'][0]))
+  print("{:>10s} | {:>9s} | {:>14s}".format("parser", "time", "extra peak RSS"))
+  for parser in sorted(PARSERS):
+    _, elapsed, extraKB = results[parser]
+    print("{:>10s} | {:>7.3f} s | {:>11.1f} MB".format(parser, elapsed, extraKB / 1024.0))
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,117 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Builds a staging bundle (a zip archive holding all artifacts of a project) as a stream of chunks, such that it can be
+uploaded while it is being built, without any temporary file and with bounded memory usage.
+
+Entries are deflated and followed by a data descriptor, since their crc is only known once they were fully read.
+"""
+
+import os
+import time
+import zlib
+import struct
+import binascii
+
+READ_CHUNK_SIZE = 1024 * 1024
+# Above this size, entries would need zip64 extensions
+MAX_ENTRY_SIZE = 0xFFFFFFFF
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+
+# General purpose flags: sizes and crc are in the data descriptor, file names are utf-8
+_FLAGS = 0x0008 | 0x0800
+_VERSION = 20
+_DEFLATED = 8
+
+def _dos_time(timestamp):
+  t = time.localtime(timestamp)
+  if t.tm_year < 1980:
+    return (0, (1 << 5) | 1)
+  dosTime = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+  dosDate = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+  return (dosTime, dosDate)
+
+class _Entry:
+  def __init__(self, name, offset, dosTime, dosDate):
+    self.name = name
+    self.offset = offset
+    self.dosTime = dosTime
+    self.dosDate = dosDate
+    self.crc = 0
+    self.compressedSize = 0
+    self.size = 0
+
+def stream_zip(files, level=zlib.Z_DEFAULT_COMPRESSION):
+  """Yields the bytes of a zip archive holding `files`, a list of (archive name, local path) tuples"""
+  entries = [ ]
+  offset = 0
+  for (name, path) in files:
+    if os.path.getsize(path) > MAX_ENTRY_SIZE:
+      raise ValueError("Error: " + path + " is too large to be bundled, upload it without --bundle")
+    encodedName = name.encode('utf-8')
+    dosTime, dosDate = _dos_time(os.path.getmtime(path))
+    entry = _Entry(encodedName, offset, dosTime, dosDate)
+    header = _LOCAL_HEADER.pack(0x04034b50, _VERSION, _FLAGS, _DEFLATED, dosTime, dosDate, 0, 0, 0, len(encodedName), 0) + encodedName
+    offset += len(header)
+    yield header
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+      while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+          break
+        entry.size += len(chunk)
+        entry.crc = binascii.crc32(chunk, entry.crc)
+        compressed = compressor.compress(chunk)
+        if compressed:
+          entry.compressedSize += len(compressed)
+          yield compressed
+    compressed = compressor.flush()
+    entry.compressedSize += len(compressed)
+    if compressed:
+      yield compressed
+    entry.crc &= 0xFFFFFFFF
+    if entry.compressedSize > MAX_ENTRY_SIZE or offset + entry.compressedSize > MAX_ENTRY_SIZE:
+      raise ValueError("Error: the bundle is too large, upload without --bundle")
+
+    descriptor = _DATA_DESCRIPTOR.pack(0x08074b50, entry.crc, entry.compressedSize, entry.size)
+    offset += entry.compressedSize + len(descriptor)
+    yield descriptor
+    entries.append(entry)
+
+  centralDirectory = [ ]
+  for entry in entries:
+    centralDirectory.append(_CENTRAL_HEADER.pack(0x02014b50, _VERSION, _VERSION, _FLAGS, _DEFLATED, entry.dosTime, entry.dosDate,
+      entry.crc, entry.compressedSize, entry.size, len(entry.name), 0, 0, 0, 0, 0, entry.offset) + entry.name)
+  centralDirectory = b"".join(centralDirectory)
+  yield centralDirectory
+  yield _END_OF_CENTRAL_DIRECTORY.pack(0x06054b50, 0, 0, len(entries), len(entries), len(centralDirectory), offset, 0)
+
+def stream_multipart(field, filename, contentType, chunks, boundary):
+  """Wraps a stream of chunks into a multipart/form-data body holding a single file"""
+  yield ("--" + boundary + "\r\n" +
+    "Content-Disposition: form-data; name=\"" + field + "\"; filename=\"" + filename + "\"\r\n" +
+    "Content-Type: " + contentType + "\r\n\r\n").encode('utf-8')
+  for chunk in chunks:
+    yield chunk
+  yield ("\r\n--" + boundary + "--\r\n").encode('utf-8')
+
+def new_boundary():
+  return "ossrh-tool-" + binascii.hexlify(os.urandom(16)).decode('ascii')
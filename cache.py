@@ -0,0 +1,294 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+On-disk cache of repository content listings, keyed by resource URI.
+
+Listings of closed repositories never change, so they are kept for good ("sealed") and served without any network
+call. Listings of open repositories are revalidated with a conditional request each time they are used.
+The cache is bounded in size: least recently used listings are evicted first.
+
+The staging profile of each group is cached as well, since it has to be known to start a repository.
+
+Finally, the list of staging repositories may be kept for a few seconds, such that processes of a host asking for
+it at the same time share a single request.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import time
+import contextlib
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+# Fraction of the size limit eviction brings the listing cache down to
+EVICT_TO = 0.9
+
+class CacheEntry:
+  def __init__(self, body, etag=None, lastModified=None, sealed=False):
+    self.body = body
+    self.etag = etag
+    self.lastModified = lastModified
+    self.sealed = sealed
+
+  def validators(self):
+    """Headers for a conditional request revalidating this entry"""
+    headers = { }
+    if self.etag != None:
+      headers['If-None-Match'] = self.etag
+    if self.lastModified != None:
+      headers['If-Modified-Since'] = self.lastModified
+    return headers
+
+class ListingCache:
+  """Files are named after a hash of the URI. Each file holds one line of json metadata followed by the raw listing.
+  Repositories are marked sealed per `key`, the server and user they were seen closed by."""
+
+  def __init__(self, directory, maxBytes, key):
+    self.directory = directory
+    self.maxBytes = maxBytes
+    self.key = key
+    self._lock = threading.Lock()
+    self._total = None # Bytes in the cache, counted on the first put and kept up to date by the following ones
+    for sub in ('listings', 'sealed'):
+      path = os.path.join(directory, sub)
+      if not os.path.isdir(path):
+        try:
+          os.makedirs(path)
+        except OSError:
+          if not os.path.isdir(path):
+            raise
+
+  def _path(self, uri):
+    return os.path.join(self.directory, 'listings', hashlib.sha1(uri.encode('utf-8')).hexdigest())
+
+  def _sealed_marker(self, repository):
+    name = self.key + " " + repository
+    return os.path.join(self.directory, 'sealed', hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+  def is_sealed(self, repository):
+    """Whether the repository was seen closed, in which case its sealed listings can be trusted without revalidation"""
+    return os.path.exists(self._sealed_marker(repository))
+
+  def seal(self, repository):
+    with open(self._sealed_marker(repository), 'w') as f:
+      f.write(repository)
+
+  def unseal(self, repository):
+    """Forgets that the repository was seen closed, once it was released or dropped, or transitions again"""
+    try:
+      os.remove(self._sealed_marker(repository))
+    except OSError:
+      pass
+
+  def get(self, uri):
+    path = self._path(uri)
+    try:
+      with open(path, 'rb') as f:
+        meta = json.loads(f.readline().decode('utf-8'))
+        body = f.read()
+    except (IOError, OSError, ValueError):
+      return None
+    if meta.get('uri') != uri:
+      return None
+    try:
+      os.utime(path, None) # Marks the entry as recently used
+    except OSError:
+      pass
+    return CacheEntry(body, meta.get('etag'), meta.get('lastModified'), meta.get('sealed', False))
+
+  def put(self, uri, entry):
+    meta = { 'uri': uri, 'etag': entry.etag, 'lastModified': entry.lastModified, 'sealed': entry.sealed }
+    directory = os.path.join(self.directory, 'listings')
+    path = self._path(uri)
+    fd, tmpPath = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(json.dumps(meta).encode('utf-8') + b'\n')
+      f.write(entry.body)
+      size = f.tell()
+    try:
+      replaced = os.stat(path).st_size
+    except OSError:
+      replaced = 0
+    # Renaming is atomic, such that concurrent readers never see a partially written entry
+    os.rename(tmpPath, path)
+    with self._lock:
+      if self._total == None:
+        self._total = sum(entrySize for (_, entrySize, _) in self._entries())
+      else:
+        self._total += size - replaced
+      full = self._total > self.maxBytes
+    if full:
+      self.evict()
+
+  def _entries(self):
+    directory = os.path.join(self.directory, 'listings')
+    entries = [ ]
+    for name in os.listdir(directory):
+      if name.startswith('.tmp'):
+        continue
+      try:
+        stat = os.stat(os.path.join(directory, name))
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, name))
+    return entries
+
+  def evict(self):
+    """Removes least recently used entries until the cache fits in EVICT_TO times maxBytes, such that the following puts
+    do not each have to evict again"""
+    with self._lock:
+      directory = os.path.join(self.directory, 'listings')
+      entries = sorted(self._entries())
+      total = sum(size for (_, size, _) in entries)
+      for (_, size, name) in entries:
+        if total <= self.maxBytes * EVICT_TO:
+          break
+        try:
+          os.remove(os.path.join(directory, name))
+        except OSError:
+          pass
+        total -= size
+      self._total = total
+
+class ProfileCache:
+  """Staging profile ids by group, in a json file per `key`, the server and user they were looked up with. Profiles are
+  virtually never changed, so entries are kept until they are found to be stale."""
+
+  def __init__(self, directory, key):
+    self.key = key
+    self.directory = os.path.join(directory, 'profiles')
+    self.path = os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError:
+        if not os.path.isdir(self.directory):
+          raise
+
+  def _read(self):
+    try:
+      with open(self.path, 'rb') as f:
+        content = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+      return { }
+    if content.get('key') != self.key:
+      return { }
+    return content['profiles']
+
+  def _write(self, profiles):
+    fd, tmpPath = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(json.dumps({ 'key': self.key, 'profiles': profiles }).encode('utf-8'))
+    os.rename(tmpPath, self.path)
+
+  def get(self, group):
+    return self._read().get(group)
+
+  def put(self, group, profileId):
+    profiles = self._read()
+    profiles[group] = profileId
+    self._write(profiles)
+
+  def forget(self, group):
+    profiles = self._read()
+    if profiles.pop(group, None) != None:
+      self._write(profiles)
+
+class DescriptorCache:
+  """The list of staging repositories, as json dicts, shared by all processes of the host for `ttl` seconds.
+  Fetching happens under an exclusive file lock, so that concurrent processes wait for a single fetch and reuse it."""
+
+  def __init__(self, directory, key, ttl):
+    self.ttl = ttl
+    self.key = key
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    self.directory = os.path.join(directory, 'descriptors')
+    self.path = os.path.join(self.directory, name + '.json')
+    self.lockPath = os.path.join(self.directory, name + '.lock')
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError:
+        if not os.path.isdir(self.directory):
+          raise
+
+  @contextlib.contextmanager
+  def _locked(self):
+    with open(self.lockPath, 'a') as lockFile:
+      if fcntl != None:
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        if fcntl != None:
+          fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+  def _read(self):
+    try:
+      with open(self.path, 'rb') as f:
+        content = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+      return None
+    age = time.time() - content.get('fetched', 0)
+    if content.get('key') != self.key or age < 0 or age >= self.ttl:
+      return None
+    return content['descriptors']
+
+  def get(self, fetch):
+    """Returns the cached dicts if they are recent enough, or else the result of `fetch`, which is then cached"""
+    with self._locked():
+      descriptors = self._read()
+      if descriptors == None:
+        descriptors = fetch()
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+          f.write(json.dumps({ 'key': self.key, 'fetched': time.time(), 'descriptors': descriptors }).encode('utf-8'))
+        os.rename(tmpPath, self.path)
+      return descriptors
+
+  def invalidate(self):
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
+
+def _client_key(client):
+  """What cached entries which depend on who asks are keyed by: the server and user of a client"""
+  user = client.creds[0] if client.creds != None else ""
+  return client.baseURL + " " + user
+
+def get_descriptor_cache(client):
+  """Returns the repositories list cache of a client, or None if it is disabled"""
+  if not client.useCache or client.cacheDir == None or not client.listingTTL > 0:
+    return None
+  return DescriptorCache(client.cacheDir, _client_key(client), client.listingTTL)
+
+def get_profile_cache(client):
+  """Returns the profile cache configured for a client, or None if caching is disabled"""
+  if not client.useCache or client.cacheDir == None:
+    return None
+  return ProfileCache(client.cacheDir, _client_key(client))
+
+def get_listing_cache(client):
+  """Returns the listing cache configured for a client, or None if caching is disabled"""
+  if not client.useCache or client.cacheDir == None:
+    return None
+  return ListingCache(client.cacheDir, client.cacheMaxBytes, _client_key(client))
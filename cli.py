@@ -19,8 +19,13 @@ A commnand line interface to interact with Sonatype's ossrh programmatically!
 import os
 import sys
 import ossrh
+import planner
 import config
 import logger
+import client
+import server
+import metrics
+import tracing
 
 def help():
   logger.log("Usage: ossrh_tool.py [--agent <agent>] [--group <group>] <command>")
@@ -34,6 +39,25 @@ def help():
   logger.log("    --agent   : unique id to isolate yourself from other users. Artifacts you upload will be tied to this agent and")
   logger.log("                the working set of repositories will be scoped to this specific agent.")
   logger.log("    --group   : artifact group in reverse-dns notation. For instance: 'com.example.department'")
+  logger.log("    --pool-size : maximum number of concurrent connections kept open to oss.sonatype.org (default: " + str(config.poolMaxPerHost) + ")")
+  logger.log("    --jobs    : maximum number of files uploaded at the same time (default: " + str(config.uploadWorkers) + ")")
+  logger.log("    --hash-while-uploading : hashes artifacts as they are sent, reading them from disk only once. Checksums are uploaded")
+  logger.log("                once their artifact is done.")
+  logger.log("    --timeout : maximum time in seconds to wait for a repository to close, drop or release (default: " + str(config.pollTimeout) + ")")
+  logger.log("    --retries : maximum number of retries of a request failing with a transient error (default: " + str(config.retryAttempts) + ")")
+  logger.log("    --repository : id of the staging repository to upload to, as printed by 'start'. Also the default repository of")
+  logger.log("                'publish' and 'close'.")
+  logger.log("    --no-cache : does not use nor update the on-disk cache of repository listings and staging profiles.")
+  logger.log("    --listing-ttl : seconds during which the list of staging repositories is shared by all processes of the host.")
+  logger.log("                Commands changing repositories always fetch it anew. (default: " + str(config.listingTTL) + ", disabled)")
+  logger.log("    --stats   : prints connection statistics and per-endpoint request latencies once the command completes.")
+  logger.log("    --metrics-jsonl <file> : appends every request sent (method, endpoint, status, bytes, latency) as a line of JSON.")
+  logger.log("    --metrics-prom <file> : writes request counts, bytes and latency histograms per endpoint in the Prometheus")
+  logger.log("                textfile format once the command completes.")
+  logger.log("    --trace <file> : writes spans of lookups, hashing, uploads, requests and polls in the Chrome trace format, to be")
+  logger.log("                opened with chrome://tracing or ui.perfetto.dev.")
+  logger.log("    --log-level <level> : minimum level of the messages printed: debug, info, warning or error (default: " + config.logLevel + ")")
+  logger.log("    --log-json : prints messages as JSON lines with their time, level and thread.")
   logger.log("Available commands:")
   logger.log("    publish [options]")
   logger.log("        close and publish the staging repo. The command fails if there is not exacly one staging repo available.")
@@ -42,19 +66,36 @@ def help():
   logger.log("            --interactive : Pauses between each step such that the user can manually test the release to be.")
   logger.log("    list")
   logger.log("        Lists available staging repositories.")
-  logger.log("    close <repo>")
-  logger.log("        Closes the given staging repository.")
-  logger.log("    drop <repo|--all>")
-  logger.log("        Drops the staging repository, or all repositories if --all is provided.")
-  logger.log("    upload <sourceDir> <projectName> <projectVersion>")
+  logger.log("    close <repo...>")
+  logger.log("        Closes the given staging repositories.")
+  logger.log("    drop <repo...|--all>")
+  logger.log("        Drops the given staging repositories, or all repositories if --all is provided.")
+  logger.log("    upload [--resume] [--plan] [--bundle] <sourceDir> <projectName> <projectVersion>")
   logger.log("        Uploads project artifacts to the staging repository. This automatically creates a new repository if none currently exist.")
-  logger.log("    inspect <repository>")
+  logger.log("        Every file of sourceDir named '{projectName}-{projectVersion}{-classifier?}.{ext}' is uploaded, along with its")
+  logger.log("        signature '.asc'.")
+  logger.log("        options:")
+  logger.log("            --resume : Skips artifacts already present with the same size and sha1 in the open staging repository.")
+  logger.log("            --plan : Prints the files which would be uploaded, the number of bytes and requests, without uploading anything.")
+  logger.log("            --bundle : Uploads all artifacts in a single request, as a bundle archive built while it is being sent.")
+  logger.log("    upload-batch [--resume] [--plan] <manifest|--tree <rootDir> <projectVersion>>")
+  logger.log("        Uploads many projects at once, sharing connections and upload workers, and prints a consolidated report.")
+  logger.log("        The manifest lists one project per line as '<sourceDir> <projectName> <projectVersion>'. With --tree, every")
+  logger.log("        sub-directory of rootDir holding a '<name>-<projectVersion>.pom' is uploaded as project <name>.")
+  logger.log("    start [--description <text>]")
+  logger.log("        Starts a new staging repository for the group and prints its id. Pass it to '--repository' such that uploads")
+  logger.log("        from several hosts land in this repository, then close and publish it once.")
+  logger.log("    inspect [--max-depth <n>] <repository>")
   logger.log("        Prints the contents of a given repository. Useful for checking that everything is there before shipping.")
+  logger.log("        Directories are listed concurrently; the output is sorted and ends with a summary.")
+  logger.log("    serve [--socket <path>]")
+  logger.log("        Runs commands sent with 'ossrh_tool.py --connect <path> <command>' from a Unix socket (default: " + config.socketPath + "),")
+  logger.log("        reusing connections and caches across them. Jobs use the credentials of the process sending them.")
   logger.log("    help")
   logger.log("        Prints this help message")
 
 def bad_usage_error(message):
-  logger.log("Error: " + message + "\n")
+  logger.error("Error: " + message + "\n")
   help()
   raise ValueError(message)
 
@@ -65,24 +106,26 @@ def get_ossrh_credentials():
 def log_list_line(agent, name, state):
   logger.log("{:40.40s}| {:30.30s}| {}".format(agent, name, state))
 
-def get_single_repo(maybeName):
+def get_single_repo(client, maybeName):
+  if maybeName == None:
+    maybeName = client.repositoryId
   if maybeName != None:
-    return ossrh.StagingRepository(maybeName)
+    return ossrh.StagingRepository(client, maybeName)
   # Else, try to find a single repo. Fail if there is not exactly one repo available.
-  repos = ossrh.find_all_staging_repositories()
+  repos = ossrh.find_all_staging_repositories(client, fresh=True)
   if len(repos) == 0:
     raise ValueError("Error: No staging repository found!")
   elif len(repos) > 1:
     raise ValueError("Error: There are more than one repos currently open. Use `python ossrh_tool.py drop --all` to erase previous repos.")
 
-  return ossrh.StagingRepository(repos[0].name)
+  return ossrh.StagingRepository(client, repos[0].name)
 
 
-def do_list(args):
+def do_list(client, args):
   if len(args) > 0:
     bad_usage_error("Too many parameters. Expected no parameter.")
 
-  repos = ossrh.find_all_staging_repositories()
+  repos = ossrh.find_all_staging_repositories(client)
   if len(repos) > 0:
     log_list_line("  agent", "  repository ID", "  state")
     log_list_line("--------------------", "--------------------", "--------------------")
@@ -91,33 +134,40 @@ def do_list(args):
   else:
     logger.log("No repository found")
 
-def do_drop(args):
+def do_drop(client, args):
   arg0=None
   if len(args) > 0:
     arg0 = args[0]
 
   if arg0 == '--all':
     logger.log("Dropping all repos")
-    for repoNode in ossrh.find_all_staging_repositories():
-      repo = ossrh.StagingRepository(repoNode.name)
-      logger.log("Dropping '" + repo.name + "'")
-      repo.drop()
+    names = [ repoNode.name for repoNode in ossrh.find_all_staging_repositories(client, fresh=True) ]
+    if len(names) > 0:
+      logger.log("Dropping " + ', '.join("'" + name + "'" for name in names))
+      ossrh.drop_repositories(client, names)
+  elif len(args) > 1:
+    logger.log("Dropping " + ', '.join("'" + name + "'" for name in args))
+    ossrh.drop_repositories(client, args)
   else:
-    repo = get_single_repo(arg0)
+    repo = get_single_repo(client, arg0)
     logger.log("Dropping '" + repo.name + "'")
     repo.drop()
 
-def do_close(args):
+def do_close(client, args):
+  if len(args) > 1:
+    logger.log("Closing " + ', '.join("'" + name + "'" for name in args))
+    ossrh.close_repositories(client, args)
+    return
+
   arg0=None
   if len(args) > 0:
     arg0 = args[0]
-  repo = get_single_repo(arg0)
+  repo = get_single_repo(client, arg0)
 
   logger.log("Closing '" + repo.name + "'")
-  repo = ossrh.StagingRepository(repo.name)
   repo.close()
 
-def do_publish(args):
+def do_publish(client, args):
   dryrun = False
   interactive = False
   repoName = None
@@ -135,7 +185,7 @@ def do_publish(args):
   logger.log("=== Releasing ossrh staging repo ===")
 
   logger.log("Looking for staging repositories...")
-  repo = get_single_repo(repoName)
+  repo = get_single_repo(client, repoName)
   
   logger.log("Closing repo '" + repo.name + "'...")
   repo.close()
@@ -147,67 +197,221 @@ def do_publish(args):
     logger.log("Releasing the repo '" + repo.name + "'...")
     repo.release()
 
-def do_upload(args):
+def _parse_upload_options(args):
+  options = { 'resume': False, 'plan': False, 'bundle': False }
+  while len(args) > 0 and args[0] in ('--resume', '--plan', '--bundle'):
+    options[args[0][2:]] = True
+    args = args[1:]
+  return options, args
+
+def do_upload(client, args):
+  options, args = _parse_upload_options(args)
   if len(args) != 3:
     bad_usage_error("Invalid number of parameters. Expected 3 but got " + str(len(args)))
-  
+
   project_dir = args[0]
   project_name = args[1]
   project_version = args[2]
 
-  ossrh.upload_artifact(project_dir, project_name, project_version, '.pom', hash=True)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '.pom.asc', hash=False)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '.jar', hash=True)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '.jar.asc', hash=False)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '-sources.jar', hash=True)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '-sources.jar.asc', hash=False)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '-javadoc.jar', hash=True)
-  ossrh.upload_artifact(project_dir, project_name, project_version, '-javadoc.jar.asc', hash=False)
-  
-  ossrh.upload_metadata(project_dir, project_name, project_version)
+  plan = planner.plan_project(project_dir, project_name, project_version)
+  if options['plan']:
+    planner.log_plan(client, [ plan ])
+  elif options['bundle']:
+    if options['resume']:
+      bad_usage_error("--resume can't be used along with --bundle")
+    if client.repositoryId != None:
+      bad_usage_error("--repository can't be used along with --bundle, the server creates a repository for each bundle")
+    ossrh.upload_bundle(client, plan)
+  else:
+    ossrh.upload_project(client, plan, resume=options['resume'])
 
+def do_upload_batch(client, args):
+  options, args = _parse_upload_options(args)
+  if len(args) == 3 and args[0] == '--tree':
+    modules = ossrh.scan_batch_tree(args[1], args[2])
+  elif len(args) == 1:
+    modules = ossrh.read_batch_manifest(args[0])
+  else:
+    bad_usage_error("Expected either <manifest> or --tree <rootDir> <projectVersion>")
+  if len(modules) == 0:
+    raise ValueError("Error: No module to upload")
+
+  if options['plan']:
+    planner.log_plan(client, ossrh.plan_batch(modules))
+  else:
+    ossrh.upload_batch(client, modules, resume=options['resume'])
 
-def do_inspect(args):
+
+def do_start(client, args):
+  description = None
+  if len(args) == 2 and args[0] == '--description':
+    description = args[1]
+  elif len(args) != 0:
+    bad_usage_error("Invalid parameters. Expected [--description <text>]")
+  repo = ossrh.start_repository(client, description)
+  logger.log(repo.name)
+
+def do_serve(args):
+  socketPath = config.socketPath
+  if len(args) == 2 and args[0] == '--socket':
+    socketPath = args[1]
+  elif len(args) != 0:
+    bad_usage_error("Invalid parameters. Expected [--socket <path>]")
+  server.serve(socketPath)
+
+def do_inspect(client, args):
+  max_depth = None
+  if len(args) > 1 and args[0] == '--max-depth':
+    max_depth = int(args[1])
+    args = args[2:]
   if len(args) != 1:
     bad_usage_error("Invalid number of parameters. Expected 1 but got " + str(len(args)))
-  repo = ossrh.StagingRepository(args[0])
-  repo.inspect()
-
-def main(args):
-  if len(args) < 1:
-    bad_usage_error("Not enough arguments")
+  repo = ossrh.StagingRepository(client, args[0])
+  repo.inspect(max_depth)
 
+def parse_options(args):
+  """Parses the global options in front of the command. Returns the client settings they set, the reporting options
+  (`stats`, `metricsJSONL`, `metricsProm`, `trace`, `logLevel` and `logJSON`, defaulting to `config`), and the
+  remaining arguments."""
+  settings = { }
+  report = { 'stats': config.stats, 'metricsJSONL': config.metricsJSONL, 'metricsProm': config.metricsProm,
+    'trace': config.trace, 'logLevel': config.logLevel, 'logJSON': config.logJSON }
   while len(args) > 1:
     if args[0] == "--agent":
-      config.agent = args[1]
+      settings['agent'] = args[1]
       args = args[2:]
     elif args[0] == "--group":
-      config.group = args[1]
+      settings['group'] = args[1]
+      args = args[2:]
+    elif args[0] == "--pool-size":
+      settings['poolMaxPerHost'] = int(args[1])
+      args = args[2:]
+    elif args[0] == "--jobs":
+      settings['uploadWorkers'] = int(args[1])
+      args = args[2:]
+    elif args[0] == "--hash-while-uploading":
+      settings['hashWhileUploading'] = True
+      args = args[1:]
+    elif args[0] == "--timeout":
+      settings['pollTimeout'] = float(args[1])
       args = args[2:]
+    elif args[0] == "--retries":
+      settings['retryAttempts'] = int(args[1])
+      args = args[2:]
+    elif args[0] == "--repository":
+      settings['repositoryId'] = args[1]
+      args = args[2:]
+    elif args[0] == "--listing-ttl":
+      settings['listingTTL'] = float(args[1])
+      args = args[2:]
+    elif args[0] == "--no-cache":
+      settings['useCache'] = False
+      args = args[1:]
+    elif args[0] == "--stats":
+      report['stats'] = True
+      args = args[1:]
+    elif args[0] == "--metrics-jsonl":
+      report['metricsJSONL'] = args[1]
+      args = args[2:]
+    elif args[0] == "--metrics-prom":
+      report['metricsProm'] = args[1]
+      args = args[2:]
+    elif args[0] == "--trace":
+      report['trace'] = args[1]
+      args = args[2:]
+    elif args[0] == "--log-level":
+      report['logLevel'] = args[1]
+      args = args[2:]
+    elif args[0] == "--log-json":
+      report['logJSON'] = True
+      args = args[1:]
     else:
       break
+  return settings, report, args
+
+def main(args):
+  if len(args) < 1:
+    bad_usage_error("Not enough arguments")
+
+  settings, report, args = parse_options(args)
+  logger.configure(level=logger.parse_level(report['logLevel']), json=report['logJSON'])
 
   cmd=args[0]
   cmd_args=args[1:]
 
-  # Loads credentials globally, we will need them no matter what
+  if cmd == 'serve':
+    do_serve(cmd_args)
+    return
+
+  # Loads credentials, we will need them no matter what
   try:
-    config.creds = get_ossrh_credentials()
+    creds = get_ossrh_credentials()
   except:
     bad_usage_error("OSSRH credentials not set!")
 
+  ossrhClient = client.Client(creds=creds, **settings)
+  try:
+    run_command(ossrhClient, cmd, cmd_args, report)
+  finally:
+    ossrhClient.close()
+
+def run_command(ossrhClient, cmd, cmd_args, report=None):
+  """Runs a command as a job of the given client, see `client.JobClient`. The requests it sends are recorded to the
+  sinks given by `report`, as returned by `parse_options`, and the job's statistics are printed afterwards if
+  `report['stats']` is set. With `report['trace']`, the spans of the command are written to that file once done."""
+  report = report or { }
+  recorder = open_recorder(report)
+  tracer = tracing.Tracer() if report.get('trace') != None else None
+  job = client.JobClient(ossrhClient, [ hook for hook in (recorder, tracer) if hook != None ], tracer)
+  try:
+    with job.tracer.span(cmd, 'command'):
+      _dispatch(job, cmd, cmd_args)
+  finally:
+    if tracer != None:
+      tracer.write(report['trace'])
+    if report.get('stats'):
+      log_stats(job)
+    if recorder != None:
+      recorder.close()
+
+def _dispatch(ossrhClient, cmd, cmd_args):
   if cmd == 'publish':
-    do_publish(cmd_args)
+    do_publish(ossrhClient, cmd_args)
   elif cmd == 'list':
-    do_list(cmd_args)
+    do_list(ossrhClient, cmd_args)
   elif cmd == 'drop':
-    do_drop(cmd_args)
+    do_drop(ossrhClient, cmd_args)
   elif cmd == 'close':
-    do_close(cmd_args)
+    do_close(ossrhClient, cmd_args)
   elif cmd == 'upload':
-    do_upload(cmd_args)
+    do_upload(ossrhClient, cmd_args)
+  elif cmd == 'upload-batch':
+    do_upload_batch(ossrhClient, cmd_args)
   elif cmd == 'inspect':
-    do_inspect(cmd_args)
+    do_inspect(ossrhClient, cmd_args)
+  elif cmd == 'start':
+    do_start(ossrhClient, cmd_args)
   else:
     help()
     sys.exit(1)
+
+def open_recorder(report):
+  """Returns a `metrics.Recorder` writing to the sinks asked for by `report`, or None if there is none"""
+  sinks = [ ]
+  if report.get('metricsJSONL') != None:
+    sinks.append(metrics.JSONLinesSink(report['metricsJSONL']))
+  if report.get('metricsProm') != None:
+    sinks.append(metrics.PrometheusSink(report['metricsProm']))
+  if report.get('stats'):
+    sinks.append(metrics.SummarySink())
+  return metrics.Recorder(sinks) if len(sinks) > 0 else None
+
+def log_stats(client):
+  stats = client.connection_stats()
+  logger.log("Connections opened: {}, requests sent: {}, connections reused: {}".format(
+    stats['connections'], stats['requests'], stats['reused']))
+  retries = client.retry_stats()
+  logger.log("Retries: {}, time spent before retrying: {:.1f}s".format(retries['retries'], retries['seconds']))
+  polls = client.poll_stats()
+  logger.log("Status polls: {}, time spent waiting: {:.1f}s".format(polls['polls'], polls['seconds']))
+
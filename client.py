@@ -0,0 +1,137 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A client holds everything needed to talk to ossrh: credentials, agent, group, base URL, HTTP session and policies.
+It is passed explicitly to every API call, such that several clients (for instance publishing different groups) can
+be used concurrently in one process. A command runs with a `JobClient`, a view of a client which sees only its own
+requests, such that jobs sharing a client (for instance in `serve` mode) don't report each other's.
+"""
+
+import threading
+import config
+import logger
+import session
+import tracing
+
+# Settings of a client, defaulting to the globals of the same name in `config`
+SETTINGS = (
+  'creds', 'agent', 'group', 'baseURL', 'repositoryId',
+  'poolHosts', 'poolMaxPerHost', 'uploadWorkers', 'crawlWorkers',
+  'cacheDir', 'cacheMaxBytes', 'useCache', 'listingTTL', 'hashWhileUploading',
+  'pollInitialInterval', 'pollBackoff', 'pollMaxInterval', 'pollJitter', 'pollTimeout',
+  'retryAttempts', 'retryInitialDelay', 'retryMaxDelay', 'retryJitter')
+
+class Client(object):
+  """Settings are given as keyword arguments, or else read from `config` when the client is created, and must not be
+  changed afterwards. A client is safe to share across threads."""
+
+  def __init__(self, **settings):
+    unknown = [ name for name in settings if name not in SETTINGS ]
+    if len(unknown) > 0:
+      raise ValueError("Unknown client settings: " + ", ".join(sorted(unknown)))
+    for name in SETTINGS:
+      setattr(self, name, settings[name] if name in settings else getattr(config, name))
+    self.http = session.HTTPSession(self)
+    # Spans of the operations run with this client, see `tracing`. Jobs have their own tracer.
+    self.tracer = tracing.DISABLED
+    # Called with a `metrics.RequestRecord` after each request, retries included. Jobs have their own hooks.
+    self.hooks = ()
+    self._lock = threading.Lock()
+    # Number of status polls and time spent waiting on repositories to stop transitioning
+    self._pollStats = { 'polls': 0, 'seconds': 0.0 }
+
+  def settings(self):
+    return dict((name, getattr(self, name)) for name in SETTINGS)
+
+  def getGroupOrFail(self):
+    if self.group == None:
+      logger.log("Parameter 'group' is required by this command")
+      raise ValueError("Parameter 'group' is required by this command")
+    return self.group
+
+  def request(self, method, url, **kwargs):
+    """Sends a request with the retry policy of this client, see `session.HTTPSession.request`"""
+    return self.http.request(method, url, hooks=self.hooks, **kwargs)
+
+  def report(self, record):
+    """Passes a `metrics.RequestRecord` of a request sent on behalf of this client to its hooks"""
+    for hook in self.hooks:
+      hook(record)
+
+  def close(self):
+    self.http.close()
+
+  def connection_stats(self):
+    return self.http.connection_stats()
+
+  def retry_stats(self):
+    return self.http.retry_stats()
+
+  def count_poll(self, delay=None):
+    """Records a status poll, or time spent waiting before the next one"""
+    with self._lock:
+      if delay == None:
+        self._pollStats['polls'] += 1
+      else:
+        self._pollStats['seconds'] += delay
+
+  def poll_stats(self):
+    """Returns how many status polls were sent, and how much time was spent waiting between them"""
+    with self._lock:
+      return dict(self._pollStats)
+
+class JobClient(object):
+  """A view of a client for the duration of one job: settings, session and pooled connections are those of the client,
+  but requests are reported to the hooks of the job only, and counted in statistics of its own. Spans go to the job's
+  `tracer`, if any. Jobs may share a client concurrently."""
+
+  def __init__(self, client, hooks=(), tracer=None):
+    self.client = client
+    self.hooks = tuple(hooks)
+    self.tracer = tracer if tracer != None else tracing.DISABLED
+    self._stats = session.RequestStats()
+    self._lock = threading.Lock()
+    self._pollStats = { 'polls': 0, 'seconds': 0.0 }
+
+  def __getattr__(self, name):
+    # Settings are those of the client
+    if name == 'client':
+      raise AttributeError(name)
+    return getattr(self.client, name)
+
+  def request(self, method, url, **kwargs):
+    return self.client.http.request(method, url, hooks=self.hooks, stats=self._stats, **kwargs)
+
+  def report(self, record):
+    for hook in self.hooks:
+      hook(record)
+
+  def connection_stats(self):
+    return self._stats.connection_stats()
+
+  def retry_stats(self):
+    return self._stats.retry_stats()
+
+  def count_poll(self, delay=None):
+    self.client.count_poll(delay)
+    with self._lock:
+      if delay == None:
+        self._pollStats['polls'] += 1
+      else:
+        self._pollStats['seconds'] += delay
+
+  def poll_stats(self):
+    with self._lock:
+      return dict(self._pollStats)
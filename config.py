@@ -12,7 +12,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import logger
+import os
 
 # OSSRH credentials
 creds = None
@@ -22,9 +22,52 @@ agent = None
 group = None
 # OSSRH base URL
 baseURL = "https://oss.sonatype.org/service/local"
-
-def getGroupOrFail():
-  if group == None:
-    logger.log("Parameter 'group' is required by this command")
-    raise ValueError("Parameter 'group' is required by this command")
-  return group
\ No newline at end of file
+# Number of distinct hosts for which a connection pool is kept
+poolHosts = 4
+# Maximum number of concurrent connections to a single host
+poolMaxPerHost = 8
+# Maximum number of files uploaded at the same time
+uploadWorkers = 8
+# Maximum number of directories listed at the same time while inspecting a repository
+crawlWorkers = 8
+# Where listings of repositories' content are cached, how large that cache may grow in bytes, and whether to use it
+cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'ossrh_tool')
+cacheMaxBytes = 64 * 1024 * 1024
+useCache = True
+# Staging repository uploads are deployed to, as returned by the `start` command. When None, Nexus picks or creates a
+# repository based on the user agent.
+repositoryId = None
+# How long, in seconds, the list of staging repositories may be served from a cache shared by all processes of the
+# host. 0 disables it. Commands changing repositories and their waits always fetch the current list.
+listingTTL = 0
+# Hash artifacts while they are being uploaded instead of beforehand, so that they are read from disk only once.
+# Their checksums are then uploaded once the artifact itself is done.
+hashWhileUploading = False
+# Polling of repositories while they transition: the first interval in seconds, the factor applied after each poll,
+# the maximum interval, the random variation applied to each interval, and the overall deadline in seconds.
+pollInitialInterval = 0.5
+pollBackoff = 2
+pollMaxInterval = 10
+pollJitter = 0.2
+pollTimeout = 900
+# Retries of transient failures: maximum number of retries per request, first delay in seconds (doubled on each retry),
+# maximum delay in seconds, and the random variation applied to each delay
+retryAttempts = 4
+retryInitialDelay = 1
+retryMaxDelay = 30
+retryJitter = 0.2
+# Unix socket on which `serve` listens for jobs, and the number of distinct clients (credentials and settings) it keeps
+# warm at once
+socketPath = os.path.join(os.path.expanduser('~'), '.cache', 'ossrh_tool', 'daemon.sock')
+serverClients = 16
+# Print connection statistics, and a summary of requests per endpoint, once the command completes
+stats = False
+# Files to which per-request metrics are written: every request as a line of JSON, and request counts, bytes and
+# latency histograms per endpoint for the Prometheus node exporter's textfile collector. None disables them.
+metricsJSONL = None
+metricsProm = None
+# File to which the spans of the command are written in the Chrome trace event format. None disables tracing.
+trace = None
+# Minimum level of the messages printed (debug, info, warning or error), and whether they are printed as JSON lines
+logLevel = 'info'
+logJSON = False
@@ -0,0 +1,505 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A stand-in for the staging API of oss.sonatype.org, listening on localhost, to exercise the tool end to end without
+any network: concurrency, retries and polling can be measured against it.
+
+Repositories start from the `test-fixtures` layout and then live in memory: uploads create them, bulk actions make
+them transition for a while before they end up closed, dropped or released. Latency, bandwidth caps and error rates
+can be injected.
+
+  with fakenexus.FakeNexus(latency=0.05, transitionSeconds=1) as nexus:
+    ossrhClient = client.Client(baseURL=nexus.url, creds=('user', 'password'), group='com.example')
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import zipfile
+import threading
+import lxml.etree
+from io import BytesIO
+
+try:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+except ImportError:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test-fixtures')
+# Base URL of the fixtures, replaced by the one of the server in what it serves
+FIXTURES_BASE_URL = "https://oss.sonatype.org/service/local"
+SERVICE_PATH = "/service/local"
+
+class Repository:
+  """A staging repository: the fields of its descriptor, the files uploaded to it, and the transition it is going
+  through if any"""
+
+  def __init__(self, fields):
+    self.fields = fields
+    self.files = { }
+    self.pendingAction = None
+    self.transitionEnds = None
+    self.autoDrop = False
+
+  @property
+  def id(self):
+    return self.fields['repositoryId']
+
+  def is_open(self):
+    return self.fields.get('type') == 'open' and self.pendingAction == None
+
+class FakeNexus:
+  """Serves the staging API on an ephemeral port of localhost, from a background thread.
+
+  - latency: seconds added to every request
+  - bandwidth: maximum bytes per second sent or received by each request, None for unlimited
+  - errorRate: fraction of requests failing with a 500, 502 or 503 before being processed
+  - throttleRate: fraction of requests rejected with a 429 and a `Retry-After: retryAfter` header
+  - transitionSeconds: how long repositories transition after being closed, dropped or released
+  """
+
+  def __init__(self, fixtures=FIXTURES_DIR, latency=0, bandwidth=None, errorRate=0, throttleRate=0, retryAfter=0,
+      transitionSeconds=0, seed=0):
+    self.fixtures = fixtures
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.errorRate = errorRate
+    self.throttleRate = throttleRate
+    self.retryAfter = retryAfter
+    self.transitionSeconds = transitionSeconds
+    self.random = random.Random(seed)
+    self.lock = threading.RLock()
+    self.repositories = { }
+    self.profiles = { }
+    self.nextRepositoryNr = 2000
+    # Statistics: requests as (method, path, status) tuples, bytes received and sent, connections opened, and the
+    # highest number of requests processed at once
+    self.requests = [ ]
+    self.bytesIn = 0
+    self.bytesOut = 0
+    self.connections = 0
+    self.maxConcurrent = 0
+    self._concurrent = 0
+    self.httpd = None
+    self.url = None
+    self._load_fixtures()
+
+  def _load_fixtures(self):
+    path = os.path.join(self.fixtures, 'staging', 'profile_repositories.xml')
+    if not os.path.exists(path):
+      return
+    root = lxml.etree.parse(path).getroot()
+    for node in root.iter('stagingProfileRepository'):
+      fields = dict((child.tag, child.text) for child in node)
+      self.repositories[fields['repositoryId']] = Repository(fields)
+      self.profiles[fields['profileId']] = fields['profileName']
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def start(self):
+    self.httpd = _Server(('127.0.0.1', 0), _Handler)
+    self.httpd.nexus = self
+    thread = threading.Thread(target=self.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = "http://127.0.0.1:" + str(self.httpd.server_address[1]) + SERVICE_PATH
+    return self.url
+
+  def stop(self):
+    if self.httpd != None:
+      self.httpd.shutdown()
+      self.httpd.server_close()
+      self.httpd = None
+
+  def add_profile(self, profileId, name):
+    with self.lock:
+      self.profiles[profileId] = name
+
+  def reset_stats(self):
+    with self.lock:
+      self.requests = [ ]
+      self.bytesIn = 0
+      self.bytesOut = 0
+      self.connections = 0
+      self.maxConcurrent = 0
+
+  def request_count(self, method=None, pattern=None):
+    """Number of requests received, optionally only those of a method and whose path matches a regular expression"""
+    with self.lock:
+      return len([ r for r in self.requests if (method == None or r[0] == method) and
+        (pattern == None or re.search(pattern, r[1]) != None) ])
+
+  # State
+
+  def settle(self):
+    """Completes the transitions which are due"""
+    now = time.time()
+    with self.lock:
+      for repo in list(self.repositories.values()):
+        if repo.pendingAction == None or repo.transitionEnds > now:
+          continue
+        action = repo.pendingAction
+        repo.pendingAction = None
+        repo.fields['transitioning'] = 'false'
+        if action == 'close':
+          repo.fields['type'] = 'closed'
+        elif action == 'drop' or (action == 'promote' and repo.autoDrop):
+          del self.repositories[repo.id]
+        else:
+          repo.fields['type'] = 'released'
+
+  def create_repository(self, profileId, userAgent, description=None):
+    with self.lock:
+      self.nextRepositoryNr += 1
+      profileName = self.profiles[profileId]
+      repoId = re.sub(r'[^a-z0-9]', '', profileName.lower()) + "-" + str(self.nextRepositoryNr)
+      now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+      repo = Repository({
+        'profileId': profileId,
+        'profileName': profileName,
+        'profileType': 'repository',
+        'repositoryId': repoId,
+        'type': 'open',
+        'policy': 'release',
+        'userAgent': userAgent,
+        'repositoryURI': self.url.replace(SERVICE_PATH, "/content/repositories/") + repoId,
+        'created': now,
+        'updated': now,
+        'description': description,
+        'transitioning': 'false'
+      })
+      self.repositories[repoId] = repo
+      return repo
+
+  def _profile_for_path(self, path):
+    """The profile whose name, as a path, is the longest prefix of path"""
+    best = None
+    for (profileId, name) in self.profiles.items():
+      if path.startswith("/" + name.replace('.', '/') + "/"):
+        if best == None or len(name) > len(self.profiles[best]):
+          best = profileId
+    return best
+
+  def implicit_repository(self, path, userAgent):
+    """The open repository an upload to `/staging/deploy/maven2` lands in, created if needed, as Nexus does"""
+    with self.lock:
+      profileId = self._profile_for_path(path)
+      if profileId == None:
+        return None
+      for repo in sorted(self.repositories.values(), key=lambda repo: repo.id):
+        if repo.fields['profileId'] == profileId and repo.fields.get('userAgent') == userAgent and repo.is_open():
+          return repo
+      return self.create_repository(profileId, userAgent, "Implicitly created")
+
+  def bulk_action(self, action, repoIds, autoDrop):
+    with self.lock:
+      for repoId in repoIds:
+        repo = self.repositories.get(repoId)
+        if repo == None:
+          return "No such repository: " + repoId
+        if repo.pendingAction != None:
+          return "Repository is transitioning: " + repoId
+        if action == 'close' and repo.fields['type'] != 'open':
+          return "Repository is not open: " + repoId
+        if action == 'promote' and repo.fields['type'] != 'closed':
+          return "Repository is not closed: " + repoId
+      for repoId in repoIds:
+        repo = self.repositories[repoId]
+        repo.pendingAction = action
+        repo.autoDrop = autoDrop
+        repo.transitionEnds = time.time() + self.transitionSeconds
+        repo.fields['transitioning'] = 'true'
+    return None
+
+  # Rendering
+
+  def repositories_xml(self):
+    with self.lock:
+      root = lxml.etree.Element('stagingRepositories')
+      data = lxml.etree.SubElement(root, 'data')
+      for repo in sorted(self.repositories.values(), key=lambda repo: repo.id):
+        node = lxml.etree.SubElement(data, 'stagingProfileRepository')
+        for (tag, text) in repo.fields.items():
+          if text != None:
+            lxml.etree.SubElement(node, tag).text = text
+    return lxml.etree.tostring(root)
+
+  def profiles_xml(self):
+    with self.lock:
+      root = lxml.etree.Element('stagingProfiles')
+      data = lxml.etree.SubElement(root, 'data')
+      for (profileId, name) in sorted(self.profiles.items()):
+        node = lxml.etree.SubElement(data, 'stagingProfile')
+        lxml.etree.SubElement(node, 'id').text = profileId
+        lxml.etree.SubElement(node, 'name').text = name
+    return lxml.etree.tostring(root)
+
+  def content(self, repoId, path):
+    """Returns the content type and body of a file or directory listing of a repository, or None if there is none"""
+    with self.lock:
+      repo = self.repositories.get(repoId)
+      if repo != None and path in repo.files:
+        return ('application/octet-stream', repo.files[path])
+      if repo != None and len(repo.files) > 0:
+        return self._listing(repo, path)
+    # Repositories without uploads serve their fixtures
+    fixture = os.path.join(self.fixtures, 'repositories', repoId, 'content' + path.rstrip('/') + '.xml')
+    if not os.path.isfile(fixture):
+      return None
+    with open(fixture, 'rb') as f:
+      return ('application/xml', f.read().replace(FIXTURES_BASE_URL.encode('utf-8'), self.url.encode('utf-8')))
+
+  def _listing(self, repo, path):
+    if not path.endswith('/'):
+      path += '/'
+    children = { }
+    for (filePath, body) in repo.files.items():
+      if not filePath.startswith(path):
+        continue
+      name = filePath[len(path):].split('/')[0]
+      isLeaf = name == filePath[len(path):]
+      children[name] = (isLeaf, len(body) if isLeaf else -1)
+    if len(children) == 0:
+      return None
+    root = lxml.etree.Element('content')
+    data = lxml.etree.SubElement(root, 'data')
+    base = self.url + "/repositories/" + repo.id + "/content"
+    for name in sorted(children):
+      isLeaf, size = children[name]
+      relativePath = path + name + ('' if isLeaf else '/')
+      node = lxml.etree.SubElement(data, 'content-item')
+      lxml.etree.SubElement(node, 'resourceURI').text = base + relativePath
+      lxml.etree.SubElement(node, 'relativePath').text = relativePath
+      lxml.etree.SubElement(node, 'text').text = name
+      lxml.etree.SubElement(node, 'leaf').text = 'true' if isLeaf else 'false'
+      lxml.etree.SubElement(node, 'sizeOnDisk').text = str(size)
+    return ('application/xml', lxml.etree.tostring(root))
+
+class _Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.nexus.lock:
+      self.server.nexus.connections += 1
+
+  def do_GET(self):
+    self._handle('GET')
+
+  def do_PUT(self):
+    self._handle('PUT')
+
+  def do_POST(self):
+    self._handle('POST')
+
+  def _throttle(self, size):
+    bandwidth = self.server.nexus.bandwidth
+    if bandwidth != None and size > 0:
+      time.sleep(float(size) / bandwidth)
+
+  def _read_body(self):
+    if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      chunks = [ ]
+      while True:
+        size = int(self.rfile.readline().strip().split(b';')[0], 16)
+        if size == 0:
+          self.rfile.readline()
+          break
+        chunks.append(self.rfile.read(size))
+        self.rfile.readline()
+      body = b"".join(chunks)
+    else:
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    self._throttle(len(body))
+    return body
+
+  def _reply(self, status, body=b"", contentType='application/xml', headers=None):
+    if not isinstance(body, bytes):
+      body = body.encode('utf-8')
+    # Recorded before replying, such that the client sees its request counted as soon as it gets the response
+    nexus = self.server.nexus
+    with nexus.lock:
+      nexus.bytesOut += len(body)
+      nexus.requests.append((self.command, self.path, status))
+    self.send_response(status)
+    self.send_header('Content-Type', contentType)
+    self.send_header('Content-Length', str(len(body)))
+    for (name, value) in (headers or { }).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self._throttle(len(body))
+    self.wfile.write(body)
+    return status
+
+  def _handle(self, method):
+    nexus = self.server.nexus
+    with nexus.lock:
+      nexus._concurrent += 1
+      nexus.maxConcurrent = max(nexus.maxConcurrent, nexus._concurrent)
+    try:
+      body = self._read_body()
+      with nexus.lock:
+        nexus.bytesIn += len(body)
+        draw = nexus.random.random()
+        status = nexus.random.choice([ 500, 502, 503 ])
+      if nexus.latency > 0:
+        time.sleep(nexus.latency)
+      if self.headers.get('Authorization') == None:
+        return self._reply(401, "Unauthorized", 'text/plain')
+      if draw < nexus.errorRate:
+        return self._reply(status, "Injected failure", 'text/plain')
+      if draw < nexus.errorRate + nexus.throttleRate:
+        return self._reply(429, "Too many requests", 'text/plain', { 'Retry-After': str(nexus.retryAfter) })
+      nexus.settle()
+      self._route(method, self.path, body)
+    finally:
+      with nexus.lock:
+        nexus._concurrent -= 1
+
+  def _route(self, method, path, body):
+    nexus = self.server.nexus
+    if not path.startswith(SERVICE_PATH + "/"):
+      return self._reply(404)
+    path = path[len(SERVICE_PATH):]
+    userAgent = self.headers.get('User-Agent')
+    if method == 'GET' and path == "/staging/profile_repositories":
+      return self._reply(200, nexus.repositories_xml())
+    if method == 'GET' and path == "/staging/profiles":
+      return self._reply(200, nexus.profiles_xml())
+    match = re.match(r'^/staging/profiles/([^/]+)/start$', path)
+    if method == 'POST' and match != None:
+      if match.group(1) not in nexus.profiles:
+        return self._reply(404, "No such profile", 'text/plain')
+      description = json.loads(body.decode('utf-8')).get('data', { }).get('description')
+      repo = nexus.create_repository(match.group(1), userAgent, description)
+      return self._reply(201, json.dumps({ 'data': { 'stagedRepositoryId': repo.id, 'description': description } }),
+        'application/json')
+    match = re.match(r'^/staging/bulk/(close|drop|promote)$', path)
+    if method == 'POST' and match != None:
+      data = json.loads(body.decode('utf-8')).get('data', { })
+      error = nexus.bulk_action(match.group(1), data.get('stagedRepositoryIds', [ ]), data.get('autoDropAfterRelease', False))
+      if error != None:
+        return self._reply(400, json.dumps({ 'errors': [ { 'msg': error } ] }), 'application/json')
+      return self._reply(201)
+    if method == 'PUT' and path.startswith("/staging/deploy/maven2/"):
+      filePath = "/" + path[len("/staging/deploy/maven2/"):].lstrip('/')
+      repo = nexus.implicit_repository(filePath, userAgent)
+      if repo == None:
+        return self._reply(400, "No staging profile matches " + filePath, 'text/plain')
+      return self._store(repo, filePath, body)
+    match = re.match(r'^/staging/deployByRepositoryId/([^/]+)(/.+)$', path)
+    if method == 'PUT' and match != None:
+      with nexus.lock:
+        repo = nexus.repositories.get(match.group(1))
+        if repo == None or not repo.is_open():
+          return self._reply(400, "Repository is not open: " + match.group(1), 'text/plain')
+      return self._store(repo, match.group(2), body)
+    if method == 'POST' and path == "/staging/bundle_upload":
+      return self._bundle_upload(body, userAgent)
+    match = re.match(r'^/repositories/([^/]+)/content(/.*)$', path)
+    if method == 'GET' and match != None:
+      content = nexus.content(match.group(1), match.group(2))
+      if content == None:
+        return self._reply(404, "Not found", 'text/plain')
+      etag = '"' + hashlib.sha1(content[1]).hexdigest() + '"'
+      if self.headers.get('If-None-Match') == etag:
+        return self._reply(304, headers={ 'ETag': etag })
+      return self._reply(200, content[1], content[0], { 'ETag': etag })
+    return self._reply(404, "Not found", 'text/plain')
+
+  def _store(self, repo, filePath, body):
+    with self.server.nexus.lock:
+      repo.files[filePath] = body
+    return self._reply(201)
+
+  def _bundle_upload(self, body, userAgent):
+    """Stages the files of a bundle, at the location given by the groupId, artifactId and version of its pom"""
+    nexus = self.server.nexus
+    match = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', ''))
+    if match == None:
+      return self._reply(400, "Expected a multipart body", 'text/plain')
+    boundary = match.group(1).strip('"').encode('utf-8')
+    start = body.index(b"\r\n\r\n") + 4
+    end = body.rindex(b"\r\n--" + boundary)
+    try:
+      archive = zipfile.ZipFile(BytesIO(body[start:end]))
+      files = dict((name, archive.read(name)) for name in archive.namelist())
+    except (zipfile.BadZipfile, ValueError):
+      return self._reply(400, "Invalid bundle", 'text/plain')
+    directory = "/"
+    for (name, content) in files.items():
+      if name.endswith('.pom'):
+        coordinates = _pom_coordinates(content)
+        if coordinates != None:
+          directory = "/" + coordinates[0].replace('.', '/') + "/" + coordinates[1] + "/" + coordinates[2] + "/"
+    with nexus.lock:
+      profileId = nexus._profile_for_path(directory)
+      if profileId == None:
+        profileId = sorted(nexus.profiles)[0]
+      repo = nexus.create_repository(profileId, userAgent, "Bundle upload")
+      for (name, content) in files.items():
+        repo.files[directory + name] = content
+    return self._reply(201, json.dumps({ 'repositoryUris': [ repo.fields['repositoryURI'] ] }), 'application/json')
+
+def _pom_coordinates(pom):
+  """Returns the (groupId, artifactId, version) of a pom, or None if it can't be parsed"""
+  try:
+    root = lxml.etree.fromstring(pom)
+  except lxml.etree.XMLSyntaxError:
+    return None
+  values = [ ]
+  for tag in ('groupId', 'artifactId', 'version'):
+    node = root.find('{*}' + tag)
+    if node == None:
+      node = root.find('{*}parent/{*}' + tag)
+    if node == None:
+      return None
+    values.append(node.text)
+  return tuple(values)
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="Serves a fake OSSRH staging API on localhost")
+  parser.add_argument('--latency', type=float, default=0)
+  parser.add_argument('--bandwidth', type=int, default=None)
+  parser.add_argument('--error-rate', type=float, default=0)
+  parser.add_argument('--throttle-rate', type=float, default=0)
+  parser.add_argument('--transition-seconds', type=float, default=0)
+  options = parser.parse_args()
+  nexus = FakeNexus(latency=options.latency, bandwidth=options.bandwidth, errorRate=options.error_rate,
+    throttleRate=options.throttle_rate, transitionSeconds=options.transition_seconds)
+  print("Serving on " + nexus.start())
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    nexus.stop()
@@ -12,12 +12,264 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+"""
+Output of the tool. `log` is the hook everything goes through, and may be replaced (tests record output this way).
+
+By default, records are handed to a background thread writing them to stdout, such that a slow terminal or a full
+CI pipe never stalls the threads logging. Each record is written once and whole: in text mode, fragments logged with
+`no_NL=True` (progress dots) are shown as they come while no other thread is writing, and else kept until their line
+is complete, while records of other threads wait for an open line to be complete, so lines from concurrent threads
+never interleave. Records are either plain text or, with `configure(json=True)`, JSON lines with their time, level
+and thread.
+"""
+
 import sys
+import json
+import time
+import atexit
+import threading
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = { DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error' }
+
+# How long, in seconds, records of other threads may wait for a line left open, before it is broken
+HOLD_SECONDS = 1
+
+_local = threading.local()
+_settings = { 'level': INFO, 'json': False, 'stream': None }
+# Guards _settings, which the writer thread reads
+_settingsLock = threading.Lock()
+
+def configure(level=None, json=None, stream=None):
+    """Sets the minimum level of records written, whether they are written as JSON lines, and the stream they are
+    written to (stdout by default). Records already logged are written first."""
+    flush()
+    with _settingsLock:
+        if level != None:
+            _settings['level'] = level
+        if json != None:
+            _settings['json'] = json
+        if stream != None:
+            _settings['stream'] = stream
+
+def _get_settings():
+    with _settingsLock:
+        return dict(_settings)
+
+def parse_level(name):
+    for (level, levelName) in LEVEL_NAMES.items():
+        if levelName == name.lower():
+            return level
+    raise ValueError("Unknown log level '" + name + "'. Expected one of: " + ", ".join(sorted(LEVEL_NAMES.values())))
 
-def default_log(txt, no_NL=False):
+def default_log(txt, no_NL=False, level=INFO):
+    settings = _thread_settings()
+    if level < settings['level']:
+        return
+    sink = getattr(_local, 'sink', None)
+    fragments = getattr(_local, 'fragments', None)
     if no_NL:
-        sys.stdout.write(txt)
+        if fragments == None:
+            fragments = _local.fragments = [ ]
+        fragments.append(txt)
+        # Fragments may be shown as they come in text mode, such as progress dots, but only complete lines are records
+        if not settings['json']:
+            if sink != None:
+                sink(txt)
+            else:
+                _writer.put(_FRAGMENT, txt, level)
+        return
+    line = txt
+    if fragments != None:
+        _local.fragments = None
+        line = "".join(fragments) + txt
+    if sink == None:
+        _writer.put(_RECORD, line, level, txt, settings['json'])
+    elif settings['json']:
+        sink(_json_record(time.time(), level, threading.current_thread().name, line))
     else:
-        print(txt)
+        sink(txt + "\n")
+
+def set_thread_sink(sink):
+    """Sends what the calling thread logs to `sink`, a function taking text, instead of stdout. None restores stdout."""
+    _local.sink = sink
+
+def set_thread_options(level=None, json=None):
+    """Overrides the configured minimum level and format of what the calling thread logs. None keeps the configured
+    one."""
+    _local.level = level
+    _local.json = json
+
+def carry(function):
+    """Returns a function running `function` with the sink and options of the calling thread, such that work handed
+    to other threads is logged the same way as the work of the thread handing it out (for instance, to the client of
+    a `serve` job)"""
+    context = _get_context()
+    def run(*args, **kwargs):
+        previous = _get_context()
+        _set_context(context)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _set_context(previous)
+    return run
+
+def _get_context():
+    return (getattr(_local, 'sink', None), getattr(_local, 'level', None), getattr(_local, 'json', None))
+
+def _set_context(context):
+    _local.sink, _local.level, _local.json = context
+
+def _thread_settings():
+    """The configured settings, overridden by those of the calling thread"""
+    settings = _get_settings()
+    for name in ('level', 'json'):
+        value = getattr(_local, name, None)
+        if value != None:
+            settings[name] = value
+    return settings
+
+def _json_record(timestamp, level, threadName, txt):
+    return json.dumps({
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp)) + ".%03dZ" % (timestamp % 1 * 1000),
+        'level': LEVEL_NAMES.get(level, str(level)),
+        'thread': threadName,
+        'message': txt }, sort_keys=True) + "\n"
+
+def flush():
+    """Waits until every record logged so far is written"""
+    _writer.join()
+
+def debug(txt):
+    _log_at(DEBUG, txt)
+
+def info(txt):
+    _log_at(INFO, txt)
+
+def warning(txt):
+    _log_at(WARNING, txt)
+
+def error(txt):
+    _log_at(ERROR, txt)
+
+def _log_at(level, txt):
+    if log == default_log:
+        default_log(txt, level=level)
+    elif level >= _thread_settings()['level']:
+        log(txt)
+
+_FRAGMENT = 0
+_RECORD = 1
+_FLUSH = 2
+
+class _Writer(object):
+    """Writes records from a queue on a thread of its own, started on first use"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # The following are only used by the writer thread.
+        # Thread whose fragments make the last line written, which is not terminated yet
+        self._openLine = None
+        # Fragments not written yet, by thread, since another thread's line was open
+        self._pending = collections.OrderedDict()
+        # (time queued, text) of the records waiting for the open line to be terminated
+        self._held = collections.deque()
+
+    def put(self, kind, txt, level, tail=None, json=False):
+        """Queues a fragment or a whole record. `tail` is the part of a record not already queued as fragments, and
+        `json` tells whether the record is written as a JSON line."""
+        self._start()
+        thread = threading.current_thread()
+        self._queue.put((kind, thread.ident, thread.name, time.time(), txt, level, tail, json))
+
+    def _start(self):
+        if self._thread == None:
+            with self._lock:
+                if self._thread == None:
+                    thread = threading.Thread(target=self._run, name='logger')
+                    thread.daemon = True
+                    thread.start()
+                    self._thread = thread
+
+    def join(self):
+        if self._thread != None:
+            self._queue.put((_FLUSH, None, None, time.time(), None, None, None, False))
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if len(self._held) > 0:
+                timeout = max(0, self._held[0][0] + HOLD_SECONDS - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._release(_get_settings()['stream'] or sys.stdout)
+                continue
+            try:
+                self._write(*item)
+            except Exception:
+                pass # Losing a record beats killing the writer
+            finally:
+                self._queue.task_done()
+
+    def _write(self, kind, threadKey, threadName, timestamp, txt, level, tail, json):
+        stream = _get_settings()['stream'] or sys.stdout
+        if kind == _FLUSH:
+            if len(self._held) > 0:
+                self._release(stream)
+            return
+        if kind == _FRAGMENT:
+            if self._openLine not in (None, threadKey):
+                self._pending[threadKey] = self._pending.get(threadKey, "") + txt
+                return
+            self._openLine = threadKey
+            stream.write(self._pending.pop(threadKey, "") + txt)
+            stream.flush()
+            return
+        if json:
+            stream.write(_json_record(timestamp, level, threadName, txt))
+            stream.flush()
+            return
+        # What was shown of the line, fragment by fragment, is not written again
+        text = self._pending.pop(threadKey, "") + tail + "\n"
+        if self._openLine not in (None, threadKey):
+            self._held.append((timestamp, text))
+            return
+        self._openLine = None
+        stream.write(text)
+        self._write_held(stream)
+        stream.flush()
+
+    def _release(self, stream):
+        """Terminates a line left open for too long, such that the records waiting for it can be written"""
+        if self._openLine != None:
+            self._openLine = None
+            stream.write("\n")
+        self._write_held(stream)
+        stream.flush()
+
+    def _write_held(self, stream):
+        while len(self._held) > 0:
+            stream.write(self._held.popleft()[1])
+        # The first thread whose fragments had to wait gets to show them
+        if len(self._pending) > 0:
+            threadKey, text = self._pending.popitem(last=False)
+            self._openLine = threadKey
+            stream.write(text)
+
+_writer = _Writer()
+atexit.register(flush)
 
 log = default_log
@@ -0,0 +1,177 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Per-request metrics. Every request a job sends, retries included, is reported to the hooks of its
+`client.JobClient` as a `RequestRecord`. `Recorder` is such a hook, forwarding records to sinks: a
+JSON-lines file, a Prometheus textfile and a summary table.
+"""
+
+import os
+import json
+import math
+import threading
+import logger
+
+# Upper bounds, in seconds, of the latency histogram buckets of the Prometheus textfile
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class RequestRecord(object):
+  """A request sent to ossrh. `endpoint` is the templated path it was sent to, such as `api.UPLOADS_PATH`. `status` is
+  None, and `error` the name of the exception, when no response was received. Byte counts are None when unknown."""
+  __slots__ = ('method', 'endpoint', 'status', 'error', 'requestBytes', 'responseBytes', 'seconds', 'timestamp')
+
+  def __init__(self, method, endpoint, status, error, requestBytes, responseBytes, seconds, timestamp):
+    self.method = method
+    self.endpoint = endpoint
+    self.status = status
+    self.error = error
+    self.requestBytes = requestBytes
+    self.responseBytes = responseBytes
+    self.seconds = seconds
+    self.timestamp = timestamp
+
+  def to_dict(self):
+    return dict((name, getattr(self, name)) for name in self.__slots__)
+
+class Recorder(object):
+  """A request hook forwarding records to sinks, which are closed along with it"""
+
+  def __init__(self, sinks):
+    self.sinks = sinks
+
+  def __call__(self, record):
+    for sink in self.sinks:
+      sink.record(record)
+
+  def close(self):
+    for sink in self.sinks:
+      sink.close()
+
+class JSONLinesSink(object):
+  """Appends every record to a file, as a line of JSON, as soon as it is received"""
+
+  def __init__(self, path):
+    self._file = open(path, 'a')
+    self._lock = threading.Lock()
+
+  def record(self, record):
+    line = json.dumps(record.to_dict(), sort_keys=True) + "\n"
+    with self._lock:
+      self._file.write(line)
+      self._file.flush()
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+
+class EndpointStats(object):
+  """Aggregated records of one method and endpoint"""
+
+  def __init__(self):
+    self.statuses = { }
+    self.requestBytes = 0
+    self.responseBytes = 0
+    self.latencies = [ ]
+
+  def add(self, record):
+    status = str(record.status) if record.status != None else record.error
+    self.statuses[status] = self.statuses.get(status, 0) + 1
+    self.requestBytes += record.requestBytes or 0
+    self.responseBytes += record.responseBytes or 0
+    self.latencies.append(record.seconds)
+
+  def count(self):
+    return len(self.latencies)
+
+  def errors(self):
+    return sum(count for (status, count) in self.statuses.items() if not status.isdigit() or int(status) >= 400)
+
+  def percentile(self, p):
+    """Nearest-rank percentile of the latencies, in seconds"""
+    latencies = sorted(self.latencies)
+    return latencies[max(0, int(math.ceil(p * len(latencies) / 100.0)) - 1)]
+
+class _AggregatingSink(object):
+
+  def __init__(self):
+    self._stats = { }
+    self._lock = threading.Lock()
+
+  def record(self, record):
+    with self._lock:
+      key = (record.method, record.endpoint)
+      if key not in self._stats:
+        self._stats[key] = EndpointStats()
+      self._stats[key].add(record)
+
+  def stats(self):
+    """Returns the aggregated records as a sorted list of ((method, endpoint), EndpointStats)"""
+    with self._lock:
+      return sorted(self._stats.items())
+
+class PrometheusSink(_AggregatingSink):
+  """Writes request counts, bytes and a latency histogram, per method and endpoint, to a file in the format of the
+  node exporter's textfile collector once closed. The file is replaced atomically."""
+
+  def __init__(self, path):
+    _AggregatingSink.__init__(self)
+    self.path = path
+
+  def close(self):
+    lines = [
+      "# HELP ossrh_requests_total Requests sent to ossrh, by response status",
+      "# TYPE ossrh_requests_total counter" ]
+    stats = self.stats()
+    for ((method, endpoint), endpointStats) in stats:
+      for status in sorted(endpointStats.statuses):
+        lines.append("ossrh_requests_total" + _labels(method, endpoint, status=status) + " " +
+          str(endpointStats.statuses[status]))
+    for (name, attribute, text) in [ ('ossrh_request_bytes_total', 'requestBytes', "Bytes sent to ossrh"),
+        ('ossrh_response_bytes_total', 'responseBytes', "Bytes received from ossrh") ]:
+      lines += [ "# HELP " + name + " " + text, "# TYPE " + name + " counter" ]
+      for ((method, endpoint), endpointStats) in stats:
+        lines.append(name + _labels(method, endpoint) + " " + str(getattr(endpointStats, attribute)))
+    lines += [
+      "# HELP ossrh_request_duration_seconds Latency of requests sent to ossrh",
+      "# TYPE ossrh_request_duration_seconds histogram" ]
+    for ((method, endpoint), endpointStats) in stats:
+      for bound in LATENCY_BUCKETS + ('+Inf', ):
+        count = len([ l for l in endpointStats.latencies if bound == '+Inf' or l <= bound ])
+        lines.append("ossrh_request_duration_seconds_bucket" + _labels(method, endpoint, le=str(bound)) + " " + str(count))
+      lines.append("ossrh_request_duration_seconds_sum" + _labels(method, endpoint) + " " + repr(sum(endpointStats.latencies)))
+      lines.append("ossrh_request_duration_seconds_count" + _labels(method, endpoint) + " " + str(endpointStats.count()))
+    temporary = self.path + ".tmp"
+    with open(temporary, 'w') as f:
+      f.write("\n".join(lines) + "\n")
+    os.rename(temporary, self.path)
+
+def _labels(method, endpoint, **extra):
+  labels = [ ('method', method), ('endpoint', endpoint) ] + sorted(extra.items())
+  return "{" + ",".join(name + '="' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for (name, value) in labels) + "}"
+
+class SummarySink(_AggregatingSink):
+  """Logs a table of requests, errors, latency percentiles and bytes per method and endpoint once closed"""
+
+  def close(self):
+    stats = self.stats()
+    if len(stats) == 0:
+      return
+    logger.log("{:<6s} {:<36s} {:>8s} {:>6s} {:>8s} {:>8s} {:>8s} {:>8s} {:>10s} {:>10s}".format("method", "endpoint",
+      "requests", "errors", "p50", "p90", "p99", "max", "sent", "received"))
+    for ((method, endpoint), endpointStats) in stats:
+      logger.log("{:<6s} {:<36s} {:>8d} {:>6d} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>10d} {:>10d}".format(method,
+        endpoint, endpointStats.count(), endpointStats.errors(), endpointStats.percentile(50),
+        endpointStats.percentile(90), endpointStats.percentile(99), max(endpointStats.latencies),
+        endpointStats.requestBytes, endpointStats.responseBytes))
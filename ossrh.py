@@ -13,89 +13,404 @@
 #   limitations under the License.
 
 from time import sleep
+import os
 import sys
-import config
+import concurrent.futures
+import time
+import random
 import datetime
 import logger
 
-from utils import hash_file_sha1, hash_file_md5
+from utils import hash_file, hash_bytes, CHECKSUM_ALGORITHMS
 import api
+import uploader
+import planner
+import bundle
+import cache
+
+class TransitionTimeoutError(IOError):
+  """Raised when a repository is still transitioning once the polling deadline is reached"""
+
+class Poller:
+  """Paces status polls: starts with a short interval which grows exponentially, with some jitter, up to a maximum.
+  Gives up with TransitionTimeoutError once the overall deadline is reached."""
+
+  def __init__(self, client, subject):
+    self.client = client
+    self.subject = subject
+    self.interval = client.pollInitialInterval
+    self.start = time.time()
+    self.deadline = self.start + client.pollTimeout
+    self.polls = 0
+
+  def polled(self):
+    self.polls += 1
+    self.client.count_poll()
+
+  def elapsed(self):
+    return time.time() - self.start
+
+  def sleep(self):
+    """Sleeps until the next poll is due"""
+    delay = self.next_delay()
+    sleep(delay)
+    self.client.count_poll(delay)
+
+  def next_delay(self):
+    """Returns how long to wait before the next poll, or raises TransitionTimeoutError past the deadline"""
+    remaining = self.deadline - time.time()
+    if remaining <= 0:
+      raise TransitionTimeoutError("Error: " + self.subject + " is still transitioning after " +
+        str(self.client.pollTimeout) + " seconds")
+    jitter = random.uniform(1 - self.client.pollJitter, 1 + self.client.pollJitter)
+    delay = min(self.interval * jitter, remaining)
+    self.interval = min(self.interval * self.client.pollBackoff, self.client.pollMaxInterval)
+    return delay
 
 class StagingRepository:
-  """Represents a staging repository in ossrh"""
+  """Represents a staging repository in ossrh, acted upon through `client`"""
 
-  def __init__(self, name):
+  def __init__(self, client, name):
+    self.client = client
     self.name = name
+    # Number of status polls and time spent waiting on transitions, across all operations on this repository
+    self.polls = 0
+    self.waitedSeconds = 0
 
   def close(self):
-    api.close_repository(self.name)
-    repoNode = self.wait_not_transitioning()
-    if repoNode == None or not repoNode.isClosed: # Expect the repo to still be here and to be closed
-      raise ValueError("Error: Failed to close repository. For more details, log into oss.sonatype.org and look at repository '" + self.name +
-      "'.\n node=" + str(repoNode))
-    logger.log("Success.")
+    with self.client.tracer.span("close", repository=self.name):
+      api.close_repository(self.client, self.name)
+      repoNode = self.wait_not_transitioning()
+      if repoNode == None or not repoNode.isClosed: # Expect the repo to still be here and to be closed
+        raise ValueError("Error: Failed to close repository. For more details, log into oss.sonatype.org and look at repository '" + self.name +
+        "'.\n node=" + str(repoNode))
+      logger.log("Success.")
     
   
   def drop(self):
-    api.drop_repository(self.name)
-    repoNode = self.wait_not_transitioning()
-    if repoNode != None: # Expect the repo to be gone
-      raise ValueError("Error: Failed to drop repository '" + self.name +
-      "'.\n node=" + str(repoNode))
-    logger.log("Success.")
+    with self.client.tracer.span("drop", repository=self.name):
+      api.drop_repository(self.client, self.name)
+      repoNode = self.wait_not_transitioning()
+      if repoNode != None: # Expect the repo to be gone
+        raise ValueError("Error: Failed to drop repository '" + self.name +
+        "'.\n node=" + str(repoNode))
+      logger.log("Success.")
   
   def release(self):
-    api.release_repository(self.name)
-    repoNode = self.wait_not_transitioning()
-    if repoNode != None: # Expect the repo to be gone
-      raise ValueError("Error: Failed to promote repository. For more details, log into oss.sonatype.org and look at repository '" + self.name +
-      "'.\n node=" + str(repoNode))
-    logger.log("Success.")
+    with self.client.tracer.span("release", repository=self.name):
+      api.release_repository(self.client, self.name)
+      repoNode = self.wait_not_transitioning()
+      if repoNode != None: # Expect the repo to be gone
+        raise ValueError("Error: Failed to promote repository. For more details, log into oss.sonatype.org and look at repository '" + self.name +
+        "'.\n node=" + str(repoNode))
+      logger.log("Success.")
 
   # Waits until the repository is not transitioning anymore, and returns the repository's XML descriptor
   def wait_not_transitioning(self):
     logger.log("Waiting for repo '" + self.name + "' to stop transitioning...", no_NL=True)
-    while True:
-      repoNodes = repoNodes = api.get_staging_repository_descriptors("repositoryId='" + self.name + "'")
-      logger.log('.', no_NL=True) # Show some activity in the console
-      if len(repoNodes) == 0 or not repoNodes[0].isTransitioning:
-        logger.log("") # Line break after the waiting line
-        return repoNodes[0] if len(repoNodes) > 0 else None
-      sleep(2)
-
-  def inspect(self):
+    poller = Poller(self.client, "repo '" + self.name + "'")
+    tracer = self.client.tracer
+    try:
+      while True:
+        with tracer.span("poll", repository=self.name):
+          repoNodes = api.get_staging_repository_descriptors(self.client, "repositoryId='" + self.name + "'", fresh=True)
+        poller.polled()
+        logger.log('.', no_NL=True) # Show some activity in the console
+        if len(repoNodes) == 0 or not repoNodes[0].isTransitioning:
+          logger.log("") # Line break after the waiting line
+          return repoNodes[0] if len(repoNodes) > 0 else None
+        with tracer.span("sleep"):
+          poller.sleep()
+    except TransitionTimeoutError:
+      logger.log("")
+      raise
+    finally:
+      self.polls += poller.polls
+      self.waitedSeconds += poller.elapsed()
+
+  def inspect(self, max_depth=None):
     """Prints the contents of this repository to stdout"""
-    api.inspect(self.name)
+    api.inspect(self.client, self.name, max_depth)
+
 
+def wait_all_not_transitioning(client, names):
+  """Waits until none of the given repositories are transitioning, fetching the status of all of them at once on
+  each poll. Returns a dict of name -> descriptor, where the descriptor is None if the repository is gone."""
+  logger.log("Waiting for " + str(len(names)) + " repos to stop transitioning...", no_NL=True)
+  repoFilter = ' or '.join("repositoryId='" + name + "'" for name in names)
+  poller = Poller(client, str(len(names)) + " repos")
+  try:
+    while True:
+      with client.tracer.span("poll", repositories=len(names)):
+        repoNodes = api.get_staging_repository_descriptors(client, repoFilter, fresh=True)
+      poller.polled()
+      logger.log('.', no_NL=True)
+      if not any(node.isTransitioning for node in repoNodes):
+        logger.log("")
+        byName = dict((node.name, node) for node in repoNodes)
+        return dict((name, byName.get(name)) for name in names)
+      with client.tracer.span("sleep"):
+        poller.sleep()
+  except TransitionTimeoutError:
+    logger.log("")
+    raise
+
+def _bulk_action(client, names, action, verb, succeeded):
+  with client.tracer.span(verb, repositories=len(names)):
+    action(client, names)
+    repoNodes = wait_all_not_transitioning(client, names)
+  failed = [ ]
+  for name in names:
+    if succeeded(repoNodes[name]):
+      logger.log("  " + name + ": success")
+    else:
+      logger.log("  " + name + ": failed, node=" + str(repoNodes[name]))
+      failed.append(name)
+  if len(failed) > 0:
+    raise ValueError("Error: Failed to " + verb + " repositories " + ', '.join(failed) +
+      ". For more details, log into oss.sonatype.org and look at these repositories.")
+
+def close_repositories(client, names):
+  """Closes all given repositories with a single request and waits for all of them at once"""
+  _bulk_action(client, names, api.close_repositories, "close", lambda node: node != None and node.isClosed)
+
+def drop_repositories(client, names):
+  """Drops all given repositories with a single request and waits for all of them at once"""
+  _bulk_action(client, names, api.drop_repositories, "drop", lambda node: node == None)
+
+def release_repositories(client, names):
+  """Releases all given repositories with a single request and waits for all of them at once"""
+  _bulk_action(client, names, api.release_repositories, "release", lambda node: node == None)
 
-def find_all_staging_repositories():
-  agentFilter = ("userAgent='" + config.agent + "'") if config.agent != None else ""
-  profileFilter = ("profileName='" + config.group + "'") if config.group != None else ""
+def find_all_staging_repositories(client, fresh=False):
+  """Returns the repositories of the client's agent and group. Unless `fresh` is set, they may come from a cache
+  a few seconds old."""
+  agentFilter = ("userAgent='" + client.agent + "'") if client.agent != None else ""
+  profileFilter = ("profileName='" + client.group + "'") if client.group != None else ""
   filters = list(filter(None, [agentFilter, profileFilter]))
   if len(filters) == 0:
     logger.log("Please specify at least one of '--agent' or '--group'")
     raise ValueError("Not enough parameters")
-  return api.get_staging_repository_descriptors(' and '.join(filters))
+  with client.tracer.span("find repositories", fresh=fresh):
+    return api.get_staging_repository_descriptors(client, ' and '.join(filters), fresh)
 
-def upload_artifact(project_dir, project_name, project_version, type, hash):
+def find_profile_id(client, group):
+  """Returns the id of the staging profile a group is deployed through: the profile named after the group, or else the
+  one named after its closest parent group. The result is cached."""
+  profileCache = cache.get_profile_cache(client)
+  profileId = profileCache.get(group) if profileCache != None else None
+  if profileId != None:
+    return profileId
+  best = None
+  for profile in api.get_staging_profiles(client):
+    if profile.name == group or group.startswith(profile.name + "."):
+      if best == None or len(profile.name) > len(best.name):
+        best = profile
+  if best == None:
+    raise ValueError("Error: No staging profile found for group '" + group + "'")
+  if profileCache != None:
+    profileCache.put(group, best.id)
+  return best.id
+
+def start_repository(client, description=None):
+  """Explicitly creates a new open staging repository for the client's group, such that uploads from several hosts
+  can target it with the `repositoryId` setting"""
+  group = client.getGroupOrFail()
+  if description == None:
+    description = "started from cli" + ((" by " + client.agent) if client.agent != None else "")
+  name = api.start_staging_repository(client, find_profile_id(client, group), description)
+  if name == None:
+    # The cached profile is gone, look it up again
+    profileCache = cache.get_profile_cache(client)
+    if profileCache != None:
+      profileCache.forget(group)
+    name = api.start_staging_repository(client, find_profile_id(client, group), description)
+    if name == None:
+      raise ValueError("Error: No staging profile found for group '" + group + "'")
+  return StagingRepository(client, name)
+
+def artifact_upload_jobs(client, project_dir, project_name, project_version, type, hash, hashLater=False):
+  """Returns the upload jobs for one artifact, along with its checksums if `hash` is set. Unless the client hashes while
+  uploading or `hashLater` is set, the file is hashed right away."""
   artefact = "{}-{}{}".format(project_name, project_version, type)
   local_file = "{}/{}".format(project_dir, artefact)
-  group = config.getGroupOrFail()
+  group = client.getGroupOrFail()
   remote_file = "/{}/{}/{}/{}".format(group.replace('.', '/'), project_name, project_version, artefact)
-  api.upload_file(local_file, remote_file)
+  if hash == True and (client.hashWhileUploading or hashLater):
+    return [ uploader.UploadJob(local_file, remote_file, checksums=True) ]
+  jobs = [ uploader.UploadJob(local_file, remote_file) ]
   if hash == True:
-    hash_file_md5(local_file)
-    hash_file_sha1(local_file)
-    api.upload_file(local_file + ".md5", remote_file + ".md5")
-    api.upload_file(local_file + ".sha1", remote_file + ".sha1")
-
-# Creates and uploads `maven-metadata.xml`. I am not sure whether this is required, but in doubt, let's keep it.
-def upload_metadata(project_dir, project_name, project_version):
-  group = config.getGroupOrFail()
-  local_file = "{}/maven-metadata.xml".format(project_dir)
-  with open(local_file, "w") as outFile:
-    now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    outFile.write("""<metadata>
+    jobs += uploader.checksum_jobs(local_file, remote_file, _hash_file(client, local_file))
+  return jobs
+
+def _hash_file(client, local_file):
+  with client.tracer.span("hash", file=local_file):
+    return hash_file(local_file)
+
+def project_upload_jobs(client, plan, resume=False, hashLater=False):
+  """Returns the jobs uploading the artifacts of a planned project along with the project's `maven-metadata.xml`.
+  With `resume`, artifacts already present in the open staging repository are left out. With `hashLater`, artifacts
+  are hashed by their jobs instead, see `uploader.UploadJob`."""
+  jobs = _artifacts_upload_jobs(client, plan.project_dir, plan.project_name, plan.project_version, plan.types(),
+    hashLater)
+  if resume:
+    jobs = skip_uploaded(client, jobs, plan.project_name, plan.project_version)
+  return jobs + metadata_upload_jobs(client, plan.project_name, plan.project_version)
+
+def upload_project(client, plan, resume=False):
+  """Uploads the artifacts of a planned project along with the project's `maven-metadata.xml`, all at once."""
+  with client.tracer.span("upload project", project=plan.project_name):
+    uploader.run_uploads(client, project_upload_jobs(client, plan, resume))
+
+def upload_bundle(client, plan):
+  """Uploads all artifacts and signatures of a planned project as a single bundle, built while it is being sent"""
+  files = [ ]
+  for (type, _) in plan.types():
+    name = "{}-{}{}".format(plan.project_name, plan.project_version, type)
+    files.append((name, os.path.join(plan.project_dir, name)))
+  bundleName = "{}-{}-bundle.jar".format(plan.project_name, plan.project_version)
+  logger.log("Uploading " + str(len(files)) + " files as " + bundleName + "...", no_NL=True)
+  with client.tracer.span("upload bundle", file=bundleName):
+    repositoryUris = api.upload_bundle(client, bundleName, bundle.stream_zip(files))
+  logger.log(" [done]")
+  for uri in repositoryUris:
+    logger.log("Staged into " + uri)
+
+class Module:
+  """A project to upload as part of a batch"""
+
+  def __init__(self, project_dir, project_name, project_version):
+    self.project_dir = project_dir
+    self.project_name = project_name
+    self.project_version = project_version
+
+  def __repr__(self):
+    return "(dir={}, name={}, version={})".format(self.project_dir, self.project_name, self.project_version)
+
+def read_batch_manifest(path):
+  """Reads a manifest listing one module per line as `<sourceDir> <projectName> <projectVersion>`.
+  Empty lines and lines starting with '#' are ignored. Relative source directories are relative to the manifest."""
+  modules = [ ]
+  base = os.path.dirname(os.path.abspath(path))
+  with open(path, 'r') as f:
+    for lineNr, line in enumerate(f, 1):
+      line = line.strip()
+      if line == "" or line.startswith('#'):
+        continue
+      parts = line.split()
+      if len(parts) != 3:
+        raise ValueError("Error: " + path + ":" + str(lineNr) + ": expected '<sourceDir> <projectName> <projectVersion>'")
+      modules.append(Module(os.path.join(base, parts[0]), parts[1], parts[2]))
+  return modules
+
+def scan_batch_tree(root, project_version):
+  """Treats every sub-directory of root holding a `<name>-<version>.pom` as the module `name`"""
+  modules = [ ]
+  for name in sorted(os.listdir(root)):
+    project_dir = os.path.join(root, name)
+    if os.path.isdir(project_dir) and os.path.isfile(os.path.join(project_dir, "{}-{}.pom".format(name, project_version))):
+      modules.append(Module(project_dir, name, project_version))
+  return modules
+
+def plan_batch(modules):
+  return [ planner.plan_project(module.project_dir, module.project_name, module.project_version) for module in modules ]
+
+def upload_batch(client, modules, resume=False):
+  """Uploads many modules at once: the files of all modules share the same pool of workers and connections"""
+  jobs = [ ]
+  for (module, plan) in zip(modules, plan_batch(modules)):
+    # Jobs are tagged with their module, since two versions of a module share their maven-metadata.xml path
+    for job in project_upload_jobs(client, plan, resume):
+      job.tag = module
+      jobs.append(job)
+  completed = uploader.run_uploads(client, jobs)
+  _log_batch_report(modules, completed)
+
+def _log_batch_report(modules, completed):
+  logger.log("=== Batch upload report ===")
+  for module in modules:
+    files = [ job for job in completed if job.tag == module ]
+    logger.log("  {} {}: {} files, {} bytes".format(module.project_name, module.project_version,
+      len(files), sum(job.size() for job in files)))
+  logger.log("Total: {} modules, {} files, {} bytes".format(len(modules), len(completed), sum(job.size() for job in completed)))
+
+def find_open_repository(client):
+  """Returns the name of the single open staging repository in scope, or None if there is none"""
+  repos = [ repo for repo in find_all_staging_repositories(client, fresh=True) if not repo.isClosed ]
+  if len(repos) > 1:
+    raise ValueError("Error: There are more than one repos currently open. Use `python ossrh_tool.py drop --all` to erase previous repos.")
+  return repos[0].name if len(repos) > 0 else None
+
+def skip_uploaded(client, jobs, project_name, project_version):
+  """Filters out the artifacts (along with their checksums) which are already in the open staging repository with
+  the same size and sha1. Files without checksums, such as signatures, can't be verified and are always kept."""
+  repoId = client.repositoryId if client.repositoryId != None else find_open_repository(client)
+  if repoId == None:
+    logger.log("Resume: no open staging repository, uploading everything.")
+    return jobs
+  group = client.getGroupOrFail()
+  remoteDir = "/{}/{}/{}/".format(group.replace('.', '/'), project_name, project_version)
+  remote = dict((item.relativePath, item) for item in api.list_repository_directory(client, repoId, remoteDir))
+  checkRequests = 1
+
+  byRemotePath = dict((job.remote_path, job) for job in jobs)
+  candidates = [ ]
+  for job in jobs:
+    if job.data != None or not (job.checksums or job.remote_path + ".sha1" in byRemotePath):
+      continue
+    remoteItem = remote.get(job.remote_path)
+    if remoteItem == None or remoteItem.size != job.size():
+      continue
+    if not all(job.remote_path + "." + algorithm in remote for algorithm in CHECKSUM_ALGORITHMS):
+      continue
+    candidates.append(job)
+
+  def is_uploaded(job):
+    remoteSha1 = api.read_repository_file(client, repoId, job.remote_path + ".sha1")
+    if remoteSha1 == None:
+      return False
+    sha1Job = byRemotePath.get(job.remote_path + ".sha1")
+    localSha1 = sha1Job.data.decode('ascii') if sha1Job != None else _hash_file(client, job.local_path)['sha1']
+    return remoteSha1.decode('ascii', 'replace').strip().split(' ')[0].lower() == localSha1
+
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, client.uploadWorkers))
+  try:
+    uploaded = list(executor.map(logger.carry(is_uploaded), candidates))
+  finally:
+    executor.shutdown(wait=True)
+  checkRequests += len(candidates)
+
+  skipped = set()
+  savedBytes = 0
+  savedRequests = 0
+  for job, isUploaded in zip(candidates, uploaded):
+    if not isUploaded:
+      continue
+    for path in [ job.remote_path ] + [ job.remote_path + "." + algorithm for algorithm in CHECKSUM_ALGORITHMS ]:
+      skipped.add(path)
+      savedRequests += 1
+      savedBytes += max(0, remote[path].size)
+  kept = [ ]
+  for job in jobs:
+    if job.remote_path in skipped:
+      logger.log("Skipping " + job.local_path + " (already uploaded)")
+      for algorithm in CHECKSUM_ALGORITHMS if job.checksums else [ ]:
+        logger.log("Skipping " + job.local_path + "." + algorithm + " (already uploaded)")
+    else:
+      kept.append(job)
+  logger.log("Resume: {} files already uploaded. Saved {} bytes and {} requests, at the cost of {} requests to check.".format(
+    savedRequests, savedBytes, savedRequests, checkRequests))
+  return kept
+
+def _artifacts_upload_jobs(client, project_dir, project_name, project_version, types, hashLater=False):
+  jobs = [ ]
+  for (type, hash) in types:
+    jobs += artifact_upload_jobs(client, project_dir, project_name, project_version, type, hash, hashLater)
+  return jobs
+
+def generate_metadata(group, project_name, project_version):
+  now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+  return """<metadata>
       <groupId>{}</groupId>
       <artifactId>{}</artifactId>
       <versioning>
@@ -105,10 +420,13 @@ def upload_metadata(project_dir, project_name, project_version):
       </versions>
       <lastUpdated>{}</lastUpdated>
       </versioning>
-      </metadata>""".format(group, project_name, project_version, project_version, now))
+      </metadata>""".format(group, project_name, project_version, project_version, now).encode('utf-8')
+
+def metadata_upload_jobs(client, project_name, project_version):
+  """Returns jobs uploading a generated `maven-metadata.xml` and its checksums, without writing anything to disk"""
+  group = client.getGroupOrFail()
+  body = generate_metadata(group, project_name, project_version)
   remote_file = "/{}/{}/maven-metadata.xml".format(group.replace('.', '/'), project_name)
-  if hash == True:
-    hash_file_md5(local_file)
-    hash_file_sha1(local_file)
-    api.upload_file(local_file + ".md5", remote_file + ".md5")
-    api.upload_file(local_file + ".sha1", remote_file + ".sha1")
+  jobs = [ uploader.UploadJob("maven-metadata.xml", remote_file, data=body) ]
+  jobs += uploader.checksum_jobs("maven-metadata.xml", remote_file, hash_bytes(body))
+  return jobs
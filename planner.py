@@ -0,0 +1,154 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Works out what to upload for a project by scanning its directory once, instead of guessing file names.
+"""
+
+import os
+import re
+import logger
+from utils import CHECKSUM_ALGORITHMS
+
+try:
+  from os import scandir
+except ImportError: # Python 2
+  scandir = None
+
+SIGNATURE_EXTENSION = ".asc"
+# Checksums are generated by this tool, such files lying around in the project directory are ignored
+IGNORED_EXTENSIONS = tuple("." + algorithm for algorithm in CHECKSUM_ALGORITHMS) + (".sha256", ".sha512")
+# Size of the generated `maven-metadata.xml`, for estimation purposes
+METADATA_SIZE_ESTIMATE = 300
+
+class PlannedFile:
+  """A file of the project directory matching `{project}-{version}{-classifier?}.{ext}`"""
+
+  def __init__(self, name, size, classifier, extension):
+    self.name = name
+    self.size = size
+    self.classifier = classifier
+    self.extension = extension
+
+  def __repr__(self):
+    return "(name={}, size={})".format(self.name, self.size)
+
+class PlannedArtifact:
+  """An artifact along with its signature, if any"""
+
+  def __init__(self, artifact, signature):
+    self.artifact = artifact
+    self.signature = signature
+
+class UploadPlan:
+  """Everything an upload of one project will send"""
+
+  def __init__(self, project_dir, project_name, project_version, artifacts):
+    self.project_dir = project_dir
+    self.project_name = project_name
+    self.project_version = project_version
+    self.artifacts = artifacts
+
+  def types(self):
+    """The (suffix, hash) tuples of all files to upload, in upload order"""
+    prefix = len("{}-{}".format(self.project_name, self.project_version))
+    types = [ ]
+    for planned in self.artifacts:
+      types.append((planned.artifact.name[prefix:], True))
+      if planned.signature != None:
+        types.append((planned.signature.name[prefix:], False))
+    return types
+
+  def request_count(self):
+    """Artifacts and the generated `maven-metadata.xml` come with their checksums, signatures come alone"""
+    perChecksummedFile = 1 + len(CHECKSUM_ALGORITHMS)
+    signatures = len([ planned for planned in self.artifacts if planned.signature != None ])
+    return perChecksummedFile * (len(self.artifacts) + 1) + signatures
+
+  def byte_count(self):
+    total = METADATA_SIZE_ESTIMATE
+    for planned in self.artifacts:
+      total += planned.artifact.size
+      if planned.signature != None:
+        total += planned.signature.size
+    return total
+
+  def unsigned(self):
+    return [ planned.artifact.name for planned in self.artifacts if planned.signature == None ]
+
+def _list_files(project_dir):
+  """Returns (name, size) of every regular file in project_dir, with a single pass over the directory"""
+  if scandir != None:
+    return [ (entry.name, entry.stat().st_size) for entry in scandir(project_dir) if entry.is_file() ]
+  files = [ ]
+  for name in os.listdir(project_dir):
+    path = os.path.join(project_dir, name)
+    if os.path.isfile(path):
+      files.append((name, os.path.getsize(path)))
+  return files
+
+def _sort_key(planned):
+  """The pom comes first, then the main artifacts, then the classified ones"""
+  artifact = planned.artifact
+  return (artifact.classifier != None, artifact.classifier or "", artifact.extension != "pom", artifact.extension)
+
+def plan_project(project_dir, project_name, project_version):
+  # Classifiers and extensions never start with a digit, which keeps the files of other versions lying in the same
+  # directory, such as `{project}-1.0.1.jar` or `{project}-1.0-1.jar`, out of the plan of version 1.0
+  pattern = re.compile("^" + re.escape("{}-{}".format(project_name, project_version)) +
+    r"(?:-(?P<classifier>[^0-9.][^.]*))?\.(?P<extension>[^0-9].*)$")
+  artifacts = { }
+  signatures = { }
+  for (name, size) in _list_files(project_dir):
+    match = pattern.match(name)
+    if match == None or name.endswith(IGNORED_EXTENSIONS):
+      continue
+    planned = PlannedFile(name, size, match.group('classifier'), match.group('extension'))
+    if name.endswith(SIGNATURE_EXTENSION):
+      signatures[name[:-len(SIGNATURE_EXTENSION)]] = planned
+    else:
+      artifacts[name] = planned
+  if len(artifacts) == 0:
+    raise ValueError("Error: No artifact named '{}-{}*' found in {}".format(project_name, project_version, project_dir))
+  for name in signatures:
+    if name not in artifacts:
+      logger.log("Warning: ignoring signature " + name + SIGNATURE_EXTENSION + " which has no matching artifact")
+  planned = [ PlannedArtifact(artifact, signatures.get(name)) for (name, artifact) in artifacts.items() ]
+  planned.sort(key=_sort_key)
+  return UploadPlan(project_dir, project_name, project_version, planned)
+
+def estimate_round_trips(requests, workers, hashWhileUploading=False):
+  """Uploads go out in waves of `workers` concurrent requests"""
+  workers = max(1, workers)
+  waves = (requests + workers - 1) // workers
+  # Checksums wait for their artifact when they are computed during the upload
+  return waves + 1 if hashWhileUploading else waves
+
+def log_plan(client, plans):
+  """Logs the files of each plan, followed by the number of requests and round-trips they would take with the
+  upload settings of `client`"""
+  checksums = ", ".join(CHECKSUM_ALGORITHMS)
+  for plan in plans:
+    logger.log("Upload plan for {} {}:".format(plan.project_name, plan.project_version))
+    for planned in plan.artifacts:
+      logger.log("  {:60s} {:>12d} bytes  + {}".format(planned.artifact.name, planned.artifact.size, checksums))
+      if planned.signature != None:
+        logger.log("  {:60s} {:>12d} bytes".format(planned.signature.name, planned.signature.size))
+    logger.log("  {:60s} {:>12s}        + {}".format("maven-metadata.xml (generated)", "", checksums))
+    for name in plan.unsigned():
+      logger.log("  Warning: " + name + " is not signed")
+  requests = sum(plan.request_count() for plan in plans)
+  byteCount = sum(plan.byte_count() for plan in plans)
+  logger.log("Total: {} requests, {} bytes, about {} round-trips with {} concurrent uploads".format(
+    requests, byteCount, estimate_round_trips(requests, client.uploadWorkers, client.hashWhileUploading), client.uploadWorkers))
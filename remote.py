@@ -0,0 +1,66 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Thin client sending a command to a server started with `serve`, and printing its output as it arrives.
+Only imports the standard library, so that it starts quickly.
+"""
+
+import os
+import sys
+import json
+import socket
+
+# Options whose value is a file written by the command, which may not exist yet
+OUTPUT_OPTIONS = ('--metrics-jsonl', '--metrics-prom', '--trace')
+
+def run(socketPath, args, out=None, err=None):
+  """Runs a command line on the server listening on socketPath. Returns the exit code of the command."""
+  out = out or _write_stdout
+  err = err or _write_stderr
+  job = {
+    'args': _absolute_paths(args),
+    'env': dict((name, os.environ[name]) for name in ('OSSRH_USERNAME', 'OSSRH_PASSWORD') if name in os.environ)
+  }
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socketPath)
+    sock.sendall((json.dumps(job) + "\n").encode('utf-8'))
+    for line in sock.makefile('rb'):
+      message = json.loads(line.decode('utf-8'))
+      if 'out' in message:
+        out(message['out'])
+      elif 'exit' in message:
+        if message.get('error') != None:
+          err(message['error'] + "\n")
+        return message['exit']
+  finally:
+    sock.close()
+  err("Error: the server closed the connection before the command completed\n")
+  return 1
+
+def _write_stdout(text):
+  sys.stdout.write(text)
+  sys.stdout.flush()
+
+def _write_stderr(text):
+  sys.stderr.write(text)
+
+def _absolute_paths(args):
+  """The server runs in its own directory: paths are sent as absolute ones"""
+  result = [ ]
+  for (index, arg) in enumerate(args):
+    isPath = os.path.exists(arg) or (index > 0 and args[index - 1] in OUTPUT_OPTIONS)
+    result.append(os.path.abspath(arg) if not arg.startswith('-') and isPath else arg)
+  return result
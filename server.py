@@ -0,0 +1,165 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Long-running mode: listens on a Unix socket and runs commands sent by `remote`, such that consecutive jobs share warm
+connections, caches and already imported modules.
+
+Each connection carries one job: a json line holding the command line and the credentials of the caller. The job's
+output is streamed back as json lines `{"out": text}`, followed by `{"exit": code, "error": message}` once it is done.
+"""
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import threading
+import traceback
+import collections
+import config
+import logger
+import client
+import cli
+
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+class ClientPool:
+  """Keeps one client per distinct set of settings and credentials, dropping the least recently used ones"""
+
+  def __init__(self, maxClients):
+    self.maxClients = maxClients
+    self._clients = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, settings):
+    key = tuple(sorted(settings.items()))
+    with self._lock:
+      ossrhClient = self._clients.pop(key, None)
+      if ossrhClient == None:
+        ossrhClient = client.Client(**settings)
+      self._clients[key] = ossrhClient
+      while len(self._clients) > self.maxClients:
+        _, evicted = self._clients.popitem(last=False)
+        evicted.close()
+      return ossrhClient
+
+  def close(self):
+    with self._lock:
+      for ossrhClient in self._clients.values():
+        ossrhClient.close()
+      self._clients.clear()
+
+def run_job(pool, job):
+  """Runs a job, logging from the calling thread with the job's log level and format. Returns its exit code."""
+  args = job.get('args', [ ])
+  env = job.get('env', { })
+  if len(args) < 1:
+    cli.bad_usage_error("Not enough arguments")
+  settings, report, args = cli.parse_options(args)
+  logger.set_thread_options(level=logger.parse_level(report['logLevel']), json=report['logJSON'])
+  if args[0] == 'serve':
+    raise ValueError("Error: 'serve' can't be sent to a server")
+  if 'OSSRH_USERNAME' not in env or 'OSSRH_PASSWORD' not in env:
+    cli.bad_usage_error("OSSRH credentials not set!")
+  settings['creds'] = (env['OSSRH_USERNAME'], env['OSSRH_PASSWORD'])
+  cli.run_command(pool.get(settings), args[0], args[1:], report)
+  return 0
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    lock = threading.Lock()
+    def send(message):
+      with lock:
+        self.wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+    try:
+      job = json.loads(self.rfile.readline().decode('utf-8'))
+    except ValueError:
+      send({ 'exit': 2, 'error': "Error: malformed job" })
+      return
+    logger.set_thread_sink(lambda text: send({ 'out': text }))
+    error = None
+    try:
+      code = run_job(self.server.pool, job)
+    except SystemExit as e:
+      code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+      code = 1
+      error = str(e) or e.__class__.__name__
+      if not isinstance(e, (ValueError, IOError)):
+        error = traceback.format_exc()
+    finally:
+      logger.set_thread_sink(None)
+      logger.set_thread_options()
+    send({ 'exit': code, 'error': error })
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socketPath, maxClients=None):
+    self.pool = ClientPool(maxClients if maxClients != None else config.serverClients)
+    _prepare_socket_path(socketPath)
+    # The socket is only accessible to the current user, since jobs carry credentials
+    umask = os.umask(0o177)
+    try:
+      socketserver.UnixStreamServer.__init__(self, socketPath, _JobHandler)
+    finally:
+      os.umask(umask)
+    os.chmod(socketPath, 0o600)
+
+  def server_close(self):
+    socketserver.UnixStreamServer.server_close(self)
+    self.pool.close()
+    try:
+      os.remove(self.server_address)
+    except OSError:
+      pass
+
+def _prepare_socket_path(socketPath):
+  """Creates the socket's directory, and removes a socket left behind by a server which is gone"""
+  directory = os.path.dirname(socketPath)
+  if directory != "" and not os.path.isdir(directory):
+    os.makedirs(directory, 0o700)
+  if not os.path.exists(socketPath):
+    return
+  probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    probe.connect(socketPath)
+  except socket.error as e:
+    if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+      raise
+    os.remove(socketPath)
+    return
+  finally:
+    probe.close()
+  raise ValueError("Error: a server is already listening on " + socketPath)
+
+def serve(socketPath):
+  """Serves jobs until interrupted"""
+  server = Server(socketPath)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  logger.log("Listening on " + socketPath)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
@@ -0,0 +1,251 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Keep-alive HTTP sessions, so that TCP and TLS handshakes are paid once per host instead of once per request, along
+with the retry policy applied to every request sent to ossrh. Each attempt is counted in the statistics and reported
+to the hooks given with the request, such that jobs sharing a session only see their own requests.
+"""
+
+import time
+import random
+import threading
+import email.utils
+import requests
+import requests.adapters
+import urllib3.connectionpool
+import logger
+import metrics
+
+# Methods which may safely be sent again
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+# Statuses denoting a transient failure
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class RequestStats(object):
+  """Requests sent, connections opened to send them, and retries, of a session or of a job. Safe to update from several
+  threads at once."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counts = { 'requests': 0, 'connections': 0, 'retries': 0, 'seconds': 0.0 }
+
+  def count_request(self, connections):
+    """Records a request, which opened `connections` new connections"""
+    with self._lock:
+      self._counts['requests'] += 1
+      self._counts['connections'] += connections
+
+  def count_retry(self, delay):
+    with self._lock:
+      self._counts['retries'] += 1
+      self._counts['seconds'] += delay
+
+  def connection_stats(self):
+    """Returns how many connections were opened, how many requests were sent and how many of those requests reused an
+    already open connection."""
+    with self._lock:
+      requestCount = self._counts['requests']
+      connections = self._counts['connections']
+    return { 'connections': connections, 'requests': requestCount, 'reused': max(0, requestCount - connections) }
+
+  def retry_stats(self):
+    """Returns how many requests were retried, and how much time was spent waiting before retrying them"""
+    with self._lock:
+      return { 'retries': self._counts['retries'], 'seconds': self._counts['seconds'] }
+
+class HTTPSession(object):
+  """A keep-alive session configured from a client's credentials, agent, pool and retry settings. It is safe to share
+  across threads."""
+
+  def __init__(self, settings):
+    self.settings = settings
+    self.session = requests.Session()
+    adapter = _CountingAdapter(
+      pool_connections=settings.poolHosts,
+      pool_maxsize=settings.poolMaxPerHost,
+      pool_block=True)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+    self.session.auth = settings.creds
+    if settings.agent != None:
+      self.session.headers['User-Agent'] = settings.agent
+    # Statistics of all requests sent through the session, whichever job they belong to
+    self.stats = RequestStats()
+
+  def close(self):
+    """Closes all pooled connections"""
+    self.session.close()
+
+  def connection_stats(self):
+    return self.stats.connection_stats()
+
+  def retry_stats(self):
+    return self.stats.retry_stats()
+
+  def request(self, method, url, endpoint=None, hooks=(), stats=None, **kwargs):
+    """Sends a request through the session. Transient failures (connection errors, 5xx and 429) are retried with
+    exponential backoff, honouring Retry-After, as long as sending the request again is safe: idempotent requests are
+    retried on any transient failure, other ones only when the connection could not even be opened, since a 429 or 503
+    from a proxy doesn't prove that Nexus did not act on them (starting a repository twice, or closing it twice).
+    Bodies read from a stream are rewound before each new attempt; streams which can't be rewound are never retried.
+    Each attempt is counted in the session's statistics and in `stats`, a `RequestStats`, and reported as a
+    `metrics.RequestRecord` to `hooks` under `endpoint`, the templated path of the url, or else the url itself."""
+    idempotent = method in IDEMPOTENT_METHODS
+    endpoint = endpoint or url
+    allStats = (self.stats, stats) if stats != None else (self.stats, )
+    body = kwargs.get('data')
+    if len(hooks) > 0 and _is_iterator(body):
+      body = kwargs['data'] = _CountingIterator(body)
+    start = _body_position(body)
+    attempts = self.settings.retryAttempts
+    attempt = 0
+    while True:
+      sent = time.time()
+      opened = _opened_connections()
+      try:
+        response = self.session.request(method, url, **kwargs)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        _count_request(allStats, _opened_connections() - opened)
+        _report(hooks, method, endpoint, None, e, body, kwargs.get('stream', False), sent)
+        safe = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+        if not safe or attempt >= attempts or not _can_resend(body, start):
+          raise
+        delay = self._backoff(attempt)
+      else:
+        _count_request(allStats, _opened_connections() - opened)
+        _report(hooks, method, endpoint, response, None, body, kwargs.get('stream', False), sent)
+        retryable = idempotent and response.status_code in RETRYABLE_STATUSES
+        if not retryable or attempt >= attempts or not _can_resend(body, start):
+          return response
+        delay = self._retry_after(response)
+        if delay == None:
+          delay = self._backoff(attempt)
+        response.close()
+      logger.debug("Retrying {} {} in {:.2f}s ({}/{})".format(method, url, delay, attempt + 1, attempts))
+      time.sleep(delay)
+      for requestStats in allStats:
+        requestStats.count_retry(delay)
+      if start != None:
+        body.seek(start)
+      attempt += 1
+
+  def _backoff(self, attempt):
+    return backoff_delay(self.settings, attempt)
+
+  def _retry_after(self, response):
+    return retry_after_delay(self.settings, response.headers)
+
+def _count_request(allStats, connections):
+  for requestStats in allStats:
+    requestStats.count_request(connections)
+
+def _report(hooks, method, endpoint, response, error, body, stream, sent):
+  if len(hooks) == 0:
+    return
+  seconds = time.time() - sent
+  if response == None:
+    record = metrics.RequestRecord(method, endpoint, None, error.__class__.__name__, _known_size(body), None,
+      seconds, sent)
+  else:
+    requestLength = response.request.headers.get('Content-Length')
+    responseLength = response.headers.get('Content-Length')
+    if responseLength == None and not stream:
+      responseLength = len(response.content)
+    record = metrics.RequestRecord(method, endpoint, response.status_code, None,
+      int(requestLength) if requestLength != None else _known_size(body),
+      int(responseLength) if responseLength != None else None, seconds, sent)
+  for hook in hooks:
+    hook(record)
+
+# Number of connections opened by each thread. Requests are sent from the calling thread, such that the difference
+# before and after sending one tells whether it had to open a connection.
+_connections = threading.local()
+
+def _opened_connections():
+  return getattr(_connections, 'opened', 0)
+
+class _CountingPool(object):
+  def _new_conn(self):
+    _connections.opened = _opened_connections() + 1
+    return super(_CountingPool, self)._new_conn()
+
+class _CountingHTTPConnectionPool(_CountingPool, urllib3.connectionpool.HTTPConnectionPool):
+  pass
+
+class _CountingHTTPSConnectionPool(_CountingPool, urllib3.connectionpool.HTTPSConnectionPool):
+  pass
+
+class _CountingAdapter(requests.adapters.HTTPAdapter):
+  """Pools connections in pools which count the connections they open, see `_opened_connections`"""
+
+  def init_poolmanager(self, *args, **kwargs):
+    requests.adapters.HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+      'http': _CountingHTTPConnectionPool,
+      'https': _CountingHTTPSConnectionPool
+    }
+
+def backoff_delay(settings, attempt):
+  """Delay before retrying for the `attempt`th time, growing exponentially with some jitter"""
+  delay = min(settings.retryInitialDelay * (2 ** attempt), settings.retryMaxDelay)
+  return delay * random.uniform(1 - settings.retryJitter, 1 + settings.retryJitter)
+
+def retry_after_delay(settings, headers):
+  """Parses the Retry-After header, either in seconds or as a date. Returns None if it is absent or invalid."""
+  value = headers.get('Retry-After')
+  if value == None:
+    return None
+  try:
+    delay = float(value)
+  except ValueError:
+    date = email.utils.parsedate_tz(value)
+    if date == None:
+      return None
+    delay = email.utils.mktime_tz(date) - time.time()
+  return min(max(0, delay), settings.retryMaxDelay)
+
+def _body_position(body):
+  if body == None or isinstance(body, (bytes, str)) or not hasattr(body, 'seek') or not hasattr(body, 'tell'):
+    return None
+  try:
+    return body.tell()
+  except (IOError, OSError):
+    return None
+
+def _can_resend(body, start):
+  return body == None or isinstance(body, (bytes, str, dict)) or start != None
+
+def _is_iterator(body):
+  return body != None and hasattr(body, '__iter__') and not hasattr(body, 'read') and \
+    not isinstance(body, (bytes, str, list, tuple, dict))
+
+class _CountingIterator(object):
+  """Counts the bytes of a body sent in chunks, whose size is only known once sent"""
+
+  def __init__(self, chunks):
+    self.chunks = iter(chunks)
+    self.size = 0
+
+  def __iter__(self):
+    for chunk in self.chunks:
+      self.size += len(chunk)
+      yield chunk
+
+def _known_size(body):
+  if isinstance(body, _CountingIterator):
+    return body.size
+  if isinstance(body, bytes):
+    return len(body)
+  return None
@@ -14,13 +14,42 @@
 # 
 
 import os
+import sys
+import shutil
+import tempfile
 import unittest
 import requests_mock
 import requests
 import logger
+import cli
 from cli import main
 import re
 import config
+import client
+import server
+import remote
+import planner
+import ossrh
+import threading
+import hashlib
+import utils
+import api
+import cache
+import time
+import io
+import zipfile
+import fakenexus
+import tracing
+import json
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+if sys.version_info >= (3, 5):
+    import asyncio
+    import aio
+else:
+    aio = None
 
 BASE_URL="https://oss.sonatype.org/service/local"
 UPLOADS_URL=BASE_URL + "/staging/deploy/maven2/"
@@ -29,9 +58,38 @@ ACTION_CLOSE_URL=BASE_URL + "/staging/bulk/close"
 ACTION_DROP_URL=BASE_URL + "/staging/bulk/drop"
 ACTION_PROMOTE_URL=BASE_URL + "/staging/bulk/promote"
 INSPECT_URL=BASE_URL + "/repositories/"
+BUNDLE_UPLOAD_URL=BASE_URL + "/staging/bundle_upload"
+PROFILES_URL=BASE_URL + "/staging/profiles"
+DEPLOY_BY_REPOSITORY_ID_URL=BASE_URL + "/staging/deployByRepositoryId/"
 
 here=os.path.dirname(os.path.realpath(__file__))
 
+CONFIG_DEFAULTS=dict((name, value) for (name, value) in vars(config).items() if not name.startswith('_') and value is not os)
+
+def reset_config(**settings):
+    """Restores every config global to its default, then applies `settings`, such that no test depends on the ones run
+    before it"""
+    for (name, value) in CONFIG_DEFAULTS.items():
+        setattr(config, name, value)
+    for (name, value) in settings.items():
+        setattr(config, name, value)
+
+class SharedAdapterMocker(requests_mock.Mocker):
+    """requests_mock swaps requests.Session.get_adapter at class level around each request, so concurrent requests
+    (uploads, crawls) restore the real adapter under each other's feet. This mocker routes every session to its
+    adapter for as long as it is started instead."""
+
+    def start(self):
+        adapter = self._adapter
+        self._real_get_adapter = requests.Session.get_adapter
+        requests.Session.get_adapter = lambda session, url: adapter
+
+    def stop(self):
+        requests.Session.get_adapter = self._real_get_adapter
+
+    def copy(self):
+        return SharedAdapterMocker(case_sensitive=self.case_sensitive)
+
 # Output capture boilerplate
 capturedOutput=""
 def recorder(txt, no_NL=False):
@@ -71,14 +129,44 @@ def sequence_matcher(m, seq):
     return matcher
 
 
+ARTIFACT_SUFFIXES=['.pom', '.pom.asc', '.jar', '.jar.asc', '-javadoc.jar', '-javadoc.jar.asc', '-sources.jar', '-sources.jar.asc']
+
+def make_project(name, version, project_dir=None):
+    if project_dir == None:
+        project_dir = tempfile.mkdtemp()
+    elif not os.path.isdir(project_dir):
+        os.makedirs(project_dir)
+    for suffix in ARTIFACT_SUFFIXES:
+        with open(os.path.join(project_dir, name + '-' + version + suffix), 'wb') as f:
+            f.write((name + suffix).encode('utf-8'))
+    return project_dir
+
+def expected_upload_lines(project_dir, name, version, group_path, failing=None):
+    lines = ""
+    for suffix in ARTIFACT_SUFFIXES:
+        artifact = name + '-' + version + suffix
+        files = [ artifact ] if suffix.endswith('.asc') else [ artifact, artifact + '.md5', artifact + '.sha1' ]
+        for f in files:
+            status = 'failed' if f == failing else 'done'
+            lines += "Uploading " + project_dir + "/" + f + " -> /" + group_path + "/" + name + "/" + version + "/" + f + "... [" + status + "]\n"
+            if f == failing:
+                return lines
+    for f in [ 'maven-metadata.xml', 'maven-metadata.xml.md5', 'maven-metadata.xml.sha1' ]:
+        lines += "Uploading " + f + " -> /" + group_path + "/" + name + "/" + f + "... [done]\n"
+    return lines
+
+
 class MainTest(unittest.TestCase):
 
     def setUp(self):
-        config.creds = None
-        config.agent = None
-        config.group = None
+        reset_config(baseURL=BASE_URL, pollInitialInterval=0.01, pollTimeout=60, cacheDir=tempfile.mkdtemp(),
+            retryInitialDelay=0.001)
 
-    @requests_mock.mock()
+    def tearDown(self):
+        shutil.rmtree(config.cacheDir)
+        reset_config()
+
+    @SharedAdapterMocker()
     def test_list_repos_no_params(self, m):
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -92,7 +180,7 @@ class MainTest(unittest.TestCase):
 """Please specify at least one of '--agent' or '--group'
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_list_repos_happy(self, m):
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -110,7 +198,7 @@ zFM2DfDs1ciDgfDHB2VR0uILjsYTQUzq        | comexample-1099               | ['tran
 lGRwQVjh1UQlUUZ5pPLuaFMHqNORlIC3        | comexample-1100               | ['closed']
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_list_repos_agent(self, m):
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -123,7 +211,7 @@ lGRwQVjh1UQlUUZ5pPLuaFMHqNORlIC3        | comexample-1100               | ['clos
 GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA        | comexample-1098               | []
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_list_repos_empty(self, m):
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -134,7 +222,7 @@ GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA        | comexample-1098               | []
 """No repository found
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_close_repo(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
@@ -154,7 +242,7 @@ Waiting for repo 'comexample-1098' to stop transitioning.....
 Success.
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_close_repo_fail(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
@@ -176,7 +264,29 @@ Success.
 Waiting for repo 'comexample-1098' to stop transitioning.....
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
+    def test_close_repo_timeout(self, m):
+        global capturedOutput
+        with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
+            with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning_again:
+
+                m.add_matcher(sequence_matcher(m, [
+                    {"method": 'POST', "url": ACTION_CLOSE_URL},
+                    {"method": 'GET', "url": STAGING_REPOS_URL, "body": resp_transitioning},
+                    {"method": 'GET', "url": STAGING_REPOS_URL, "body": resp_transitioning_again}
+                ]))
+
+                config.pollInitialInterval = 1
+                config.pollTimeout = 0.3
+                capturedOutput=""
+                with self.assertRaises(ossrh.TransitionTimeoutError):
+                    main(['close', 'comexample-1098'])
+                self.assertEquals(
+"""Closing 'comexample-1098'
+Waiting for repo 'comexample-1098' to stop transitioning.....
+""", capturedOutput)
+
+    @SharedAdapterMocker()
     def test_close_repo_server_error(self, m):
         global capturedOutput
         m.register_uri('POST', ACTION_CLOSE_URL, status_code=500)
@@ -192,7 +302,7 @@ Error: 500
 
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_drop_repo(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
@@ -212,7 +322,7 @@ Waiting for repo 'comexample-1098' to stop transitioning.....
 Success.
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_drop_repo_fail(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
@@ -233,7 +343,47 @@ Success.
 Waiting for repo 'comexample-1098' to stop transitioning.....
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
+    def test_drop_many_repos(self, m):
+        global capturedOutput
+        with open(here + '/test-fixtures/staging/profile_repositories.transitioning.xml', 'r') as resp_transitioning:
+            with open(here + '/test-fixtures/staging/profile_repositories.gone.xml', 'r') as resp_gone:
+                m.add_matcher(sequence_matcher(m, [
+                    {"method": 'POST', "url": ACTION_DROP_URL},
+                    {"method": 'GET', "url": STAGING_REPOS_URL, "body": resp_transitioning},
+                    {"method": 'GET', "url": STAGING_REPOS_URL, "body": resp_gone}
+                ]))
+
+                capturedOutput=""
+                main(['drop', 'comexample-1093', 'comexample-1098'])
+                self.assertEquals(['comexample-1093', 'comexample-1098'], m.request_history[0].json()['data']['stagedRepositoryIds'])
+                self.assertEquals(
+"""Dropping 'comexample-1093', 'comexample-1098'
+Waiting for 2 repos to stop transitioning.....
+  comexample-1093: success
+  comexample-1098: success
+""", capturedOutput)
+
+    @SharedAdapterMocker()
+    def test_close_many_repos_partial_failure(self, m):
+        global capturedOutput
+        with open(here + '/test-fixtures/staging/profile_repositories.closed.xml', 'r') as resp_closed:
+            m.add_matcher(sequence_matcher(m, [
+                {"method": 'POST', "url": ACTION_CLOSE_URL},
+                {"method": 'GET', "url": STAGING_REPOS_URL, "body": resp_closed}
+            ]))
+
+            capturedOutput=""
+            with self.assertRaises(ValueError):
+                main(['close', 'comexample-1093', 'comexample-1098'])
+            self.assertEquals(
+"""Closing 'comexample-1093', 'comexample-1098'
+Waiting for 2 repos to stop transitioning....
+  comexample-1093: failed, node=None
+  comexample-1098: success
+""", capturedOutput)
+
+    @SharedAdapterMocker()
     def test_publish_no_group(self, m): # The program should fail if we attempt to publish while there are multiple candidates to release
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -249,7 +399,7 @@ Looking for staging repositories...
 Please specify at least one of '--agent' or '--group'
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_publish_multiple_candidates(self, m): # The program should fail if we attempt to publish while there are multiple candidates to release
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -264,7 +414,7 @@ Please specify at least one of '--agent' or '--group'
 Looking for staging repositories...
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_publish_dry_run(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.xml', 'r') as resp_open:
@@ -292,7 +442,7 @@ Waiting for repo 'comexample-1098' to stop transitioning....
 Success.
 """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_publish_success(self, m):
         global capturedOutput
         with open(here + '/test-fixtures/staging/profile_repositories.xml', 'r') as resp_open:
@@ -319,7 +469,7 @@ Waiting for repo 'comexample-1098' to stop transitioning....
 Success.
 """, capturedOutput)
 
-#     @requests_mock.mock()
+#     @SharedAdapterMocker()
 #     def test_release_repo_fail(self, m):
 #         global capturedOutput
 #         global request_nr
@@ -342,7 +492,7 @@ Success.
 # Waiting for repo 'comexample-1098' to stop transitioning.....
 # """, capturedOutput)
 
-    @requests_mock.mock()
+    @SharedAdapterMocker()
     def test_inspect(self, m):
         global capturedOutput
         m.add_matcher(static_matcher)
@@ -350,57 +500,1135 @@ Success.
         capturedOutput=""
         main(['inspect', 'comexample-1098'])
         self.assertEquals(
-"""https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar.md5
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar.asc
+"""https://oss.sonatype.org/service/local/repositories/comexample-1098/content/archetype-catalog.xml
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar.asc
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar.asc
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar.asc
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar.md5
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.pom
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-sources.jar.sha1
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.pom.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.pom.sha1
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.pom.md5
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068-javadoc.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.md5
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/4.5.0.1068/example-gradle-plugin-4.5.0.1068.pom.sha1
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-javadoc.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-javadoc.jar.asc
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-javadoc.jar.md5
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-javadoc.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-javadoc.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068-sources.jar.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar.asc
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.jar.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.asc
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/4.5.0.1068/example-injector-4.5.0.1068.pom.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar.md5
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar.md5
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar.asc
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar.md5
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar.asc
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar.md5
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar.sha1
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom.asc
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom.md5
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-sources.jar.asc
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068-javadoc.jar.md5
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.jar
 https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom.sha1
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/4.5.0.1068/example-runtime-4.5.0.1068.pom
-https://oss.sonatype.org/service/local/repositories/comexample-1098/content/archetype-catalog.xml
+8 directories, 49 files, 1345066 bytes
 """, capturedOutput)
 
+    @SharedAdapterMocker()
+    def test_inspect_max_depth(self, m):
+        global capturedOutput
+        m.add_matcher(static_matcher)
+
+        capturedOutput=""
+        main(['inspect', '--max-depth', '2', 'comexample-1098'])
+        self.assertEquals(
+"""https://oss.sonatype.org/service/local/repositories/comexample-1098/content/archetype-catalog.xml
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-gradle-plugin/
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-injector/
+https://oss.sonatype.org/service/local/repositories/comexample-1098/content/com/example/example-runtime/
+5 directories, 1 files, 25 bytes, 3 directories not explored
+""", capturedOutput)
+        self.assertEquals(4, len(m.request_history))
+
+    @SharedAdapterMocker()
+    def test_inspect_closed_repo_from_cache(self, m):
+        global capturedOutput
+        def closed_matcher(request):
+            if request.url == STAGING_REPOS_URL:
+                resp = requests.Response()
+                resp.raw = open(here + '/test-fixtures/staging/profile_repositories.closed.xml')
+                return resp
+            return static_matcher(request)
+        m.add_matcher(closed_matcher)
+
+        capturedOutput=""
+        main(['inspect', 'comexample-1098'])
+        firstOutput = capturedOutput
+        requestCount = len(m.request_history)
+        self.assertEquals(10, requestCount)
+
+        # Only the repository is looked up again, to check that it is still closed
+        capturedOutput=""
+        main(['inspect', 'comexample-1098'])
+        self.assertEquals(firstOutput, capturedOutput)
+        self.assertEquals(requestCount + 1, len(m.request_history))
+        self.assertEquals(STAGING_REPOS_URL, m.request_history[-1].url)
+
+        capturedOutput=""
+        main(['--no-cache', 'inspect', 'comexample-1098'])
+        self.assertEquals(firstOutput, capturedOutput)
+        self.assertEquals(requestCount + 1 + 9, len(m.request_history))
+
+    @SharedAdapterMocker()
+    def test_inspect_released_repo_is_revalidated(self, m):
+        global capturedOutput
+        fixture = [ 'closed' ]
+        def repos_matcher(request):
+            if request.url == STAGING_REPOS_URL:
+                resp = requests.Response()
+                resp.raw = open(here + '/test-fixtures/staging/profile_repositories.' + fixture[0] + '.xml')
+                return resp
+            return static_matcher(request)
+        m.add_matcher(repos_matcher)
+        main(['inspect', 'comexample-1098'])
+        requestCount = len(m.request_history)
+        listingCache = cache.get_listing_cache(client.Client(creds=('hello', 'notapassword')))
+        self.assertTrue(listingCache.is_sealed('comexample-1098'))
+
+        fixture[0] = 'gone'
+        capturedOutput=""
+        main(['inspect', 'comexample-1098'])
+        self.assertEquals(requestCount + 1 + 9, len(m.request_history))
+        self.assertFalse(listingCache.is_sealed('comexample-1098'))
+
+    @SharedAdapterMocker()
+    def test_list_repos_shared_for_ttl(self, m):
+        global capturedOutput
+        m.add_matcher(static_matcher)
+        main(['--listing-ttl', '60', '--group', 'com.example', 'list'])
+        capturedOutput=""
+        main(['--listing-ttl', '60', '--group', 'com.example', '--agent', 'GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA', 'list'])
+        self.assertEquals(1, len(m.request_history))
+        self.assertEquals(
+"""  agent                                 |   repository ID               |   state
+--------------------                    | --------------------          | --------------------
+GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA        | comexample-1098               | []
+""", capturedOutput)
+        # Waits on state changes fetch the current list, and drop the cached one
+        ossrhClient = client.Client(creds=('hello', 'notapassword'), group='com.example', listingTTL=60)
+        api.get_staging_repository_descriptors(ossrhClient, "repositoryId='comexample-1098'", fresh=True)
+        main(['--listing-ttl', '60', '--group', 'com.example', 'list'])
+        self.assertEquals(3, len(m.request_history))
+
+    @SharedAdapterMocker()
+    def test_session_carries_agent(self, m):
+        global capturedOutput
+        m.add_matcher(static_matcher)
+
+        capturedOutput=""
+        main(['--agent', 'GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA', 'list'])
+        self.assertEquals('GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA', m.last_request.headers['User-Agent'])
+        self.assertEquals(requests.auth._basic_auth_str('hello', 'notapassword'), m.last_request.headers['Authorization'])
+
+    @SharedAdapterMocker()
+    def test_upload(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            main(['--group', 'com.example', 'upload', project_dir, 'myproject', '1.2.3'])
+            self.assertEquals(expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example'), capturedOutput)
+            uploaded = dict((r.url[len(UPLOADS_URL):], r.body) for r in m.request_history)
+            self.assertEquals(19, len(uploaded))
+            self.assertEquals(hashlib.sha1(b'myproject-javadoc.jar').hexdigest().encode('ascii'),
+                uploaded["/com/example/myproject/1.2.3/myproject-1.2.3-javadoc.jar.sha1"])
+            self.assertTrue(b"<artifactId>myproject</artifactId>" in uploaded["/com/example/myproject/maven-metadata.xml"])
+            self.assertEquals(sorted(os.path.basename(project_dir + "/myproject-1.2.3" + suffix) for suffix in ARTIFACT_SUFFIXES),
+                sorted(os.listdir(project_dir)))
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_upload_hash_while_uploading(self, m):
+        global capturedOutput
+        uploaded = { }
+        def consume(request, context):
+            body = request.body
+            uploaded[request.url[len(UPLOADS_URL):]] = body.read() if hasattr(body, 'read') else body
+            return ''
+        m.register_uri('PUT', requests_mock.ANY, text=consume)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            main(['--group', 'com.example', '--hash-while-uploading', 'upload', project_dir, 'myproject', '1.2.3'])
+            self.assertEquals(expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example'), capturedOutput)
+            self.assertEquals(19, len(uploaded))
+            self.assertEquals(b'myproject.jar', uploaded["/com/example/myproject/1.2.3/myproject-1.2.3.jar"])
+            self.assertEquals(hashlib.md5(b'myproject.jar').hexdigest().encode('ascii'),
+                uploaded["/com/example/myproject/1.2.3/myproject-1.2.3.jar.md5"])
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_upload_resume(self, m):
+        global capturedOutput
+        m.add_matcher(static_matcher)
+        m.register_uri('PUT', requests_mock.ANY)
+        remote_dir = "/com/example/myproject/1.2.3/"
+        def item(name, size):
+            return """<content-item><resourceURI>{0}</resourceURI><relativePath>{1}</relativePath><leaf>true</leaf>
+                <sizeOnDisk>{2}</sizeOnDisk></content-item>""".format(INSPECT_URL + "comexample-1098/content" + remote_dir + name, remote_dir + name, size)
+        pom_sha1 = hashlib.sha1(b'myproject.pom').hexdigest()
+        m.register_uri('GET', INSPECT_URL + "comexample-1098/content" + remote_dir, text="<content><data>" +
+            item("myproject-1.2.3.pom", len('myproject.pom')) + item("myproject-1.2.3.pom.md5", 32) + item("myproject-1.2.3.pom.sha1", 40) +
+            item("myproject-1.2.3.jar", 1) + item("myproject-1.2.3.jar.md5", 32) + item("myproject-1.2.3.jar.sha1", 40) +
+            "</data></content>")
+        m.register_uri('GET', INSPECT_URL + "comexample-1098/content" + remote_dir + "myproject-1.2.3.pom.sha1", text=pom_sha1)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            main(['--group', 'com.example', '--agent', 'GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA', 'upload', '--resume', project_dir, 'myproject', '1.2.3'])
+            skipped = "".join("Skipping " + project_dir + "/myproject-1.2.3.pom" + ext + " (already uploaded)\n" for ext in [ '', '.md5', '.sha1' ])
+            summary = "Resume: 3 files already uploaded. Saved 85 bytes and 3 requests, at the cost of 2 requests to check.\n"
+            uploads = "".join(line + "\n" for line in expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example').splitlines()[3:])
+            self.assertEquals(skipped + summary + uploads, capturedOutput)
+            self.assertEquals(16, len([ r for r in m.request_history if r.method == 'PUT' ]))
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_upload_retries_transient_errors(self, m):
+        global capturedOutput
+        bodies = [ ]
+        def flaky(request, context):
+            body = request.body.read()
+            bodies.append(body)
+            if len(bodies) == 1:
+                context.status_code = 502
+            elif len(bodies) == 2:
+                context.status_code = 429
+                context.headers['Retry-After'] = '0'
+            return ''
+        def consume(request, context):
+            if hasattr(request.body, 'read'):
+                request.body.read()
+            return ''
+        m.register_uri('PUT', requests_mock.ANY, text=consume)
+        m.register_uri('PUT', UPLOADS_URL + "/com/example/myproject/1.2.3/myproject-1.2.3.jar", text=flaky)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            ossrhClient = client.Client(creds=('hello', 'notapassword'), group='com.example', hashWhileUploading=True)
+            cli.run_command(ossrhClient, 'upload', [ project_dir, 'myproject', '1.2.3' ])
+            self.assertEquals(expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example'), capturedOutput)
+            self.assertEquals([ b'myproject.jar' ] * 3, bodies)
+            self.assertEquals(2, ossrhClient.retry_stats()['retries'])
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_close_repo_is_not_retried_after_server_error(self, m):
+        m.register_uri('POST', ACTION_CLOSE_URL, [ { 'status_code': 502 }, { 'status_code': 201 } ])
+        with self.assertRaises(IOError):
+            main(['close', 'comexample-000'])
+        self.assertEquals(1, len(m.request_history))
+
+    @SharedAdapterMocker()
+    def test_posts_are_not_retried_when_rejected(self, m):
+        m.register_uri('POST', PROFILES_URL + "/123/start", [ { 'status_code': 503 }, { 'status_code': 201 } ])
+        m.register_uri('POST', ACTION_CLOSE_URL, [ { 'status_code': 429, 'headers': { 'Retry-After': '0' } },
+            { 'status_code': 201 } ])
+        ossrhClient = client.Client(creds=('hello', 'notapassword'), group='com.example')
+        with self.assertRaises(IOError):
+            api.start_staging_repository(ossrhClient, '123', 'test')
+        with self.assertRaises(IOError):
+            main(['close', 'comexample-000'])
+        self.assertEquals([ 'POST', 'POST' ], [ request.method for request in m.request_history ])
+        self.assertEquals(0, ossrhClient.retry_stats()['retries'])
+
+    @SharedAdapterMocker()
+    def test_upload_batch_tree(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        root = tempfile.mkdtemp()
+        try:
+            make_project('example-runtime', '4.5.0', os.path.join(root, 'example-runtime'))
+            make_project('example-injector', '4.5.0', os.path.join(root, 'example-injector'))
+            os.makedirs(os.path.join(root, 'not-a-module'))
+            capturedOutput=""
+            main(['--group', 'com.example', 'upload-batch', '--tree', root, '4.5.0'])
+            self.assertEquals(38, len(m.request_history))
+            self.assertTrue(capturedOutput.startswith(expected_upload_lines(os.path.join(root, 'example-injector'), 'example-injector', '4.5.0', 'com/example')))
+            self.assertTrue(capturedOutput.endswith("""=== Batch upload report ===
+  example-injector 4.5.0: 19 files, 865 bytes
+  example-runtime 4.5.0: 19 files, 856 bytes
+Total: 2 modules, 38 files, 1721 bytes
+"""))
+        finally:
+            shutil.rmtree(root)
+
+    @SharedAdapterMocker()
+    def test_upload_batch_manifest(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        root = tempfile.mkdtemp()
+        try:
+            make_project('example-runtime', '4.5.0', os.path.join(root, 'runtime'))
+            make_project('example-gradle-plugin', '1.0', os.path.join(root, 'plugin'))
+            with open(os.path.join(root, 'modules.txt'), 'w') as f:
+                f.write("# Modules of the release\nruntime example-runtime 4.5.0\n\nplugin example-gradle-plugin 1.0\n")
+            capturedOutput=""
+            main(['--group', 'com.example', 'upload-batch', os.path.join(root, 'modules.txt')])
+            uploaded = set(r.url[len(UPLOADS_URL):] for r in m.request_history)
+            self.assertEquals(38, len(uploaded))
+            self.assertTrue("/com/example/example-gradle-plugin/1.0/example-gradle-plugin-1.0-sources.jar" in uploaded)
+            self.assertTrue("/com/example/example-runtime/maven-metadata.xml" in uploaded)
+            self.assertTrue("Total: 2 modules, 38 files, " in capturedOutput)
+        finally:
+            shutil.rmtree(root)
+
+    @SharedAdapterMocker()
+    def test_upload_batch_two_versions(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        root = tempfile.mkdtemp()
+        try:
+            make_project('example-runtime', '4.5.0', os.path.join(root, 'old'))
+            make_project('example-runtime', '4.6.0', os.path.join(root, 'new'))
+            with open(os.path.join(root, 'modules.txt'), 'w') as f:
+                f.write("old example-runtime 4.5.0\nnew example-runtime 4.6.0\n")
+            capturedOutput=""
+            main(['--group', 'com.example', 'upload-batch', os.path.join(root, 'modules.txt')])
+            self.assertEquals(38, len(m.request_history))
+            self.assertTrue(capturedOutput.endswith("""=== Batch upload report ===
+  example-runtime 4.5.0: 19 files, 856 bytes
+  example-runtime 4.6.0: 19 files, 856 bytes
+Total: 2 modules, 38 files, 1712 bytes
+"""), capturedOutput)
+        finally:
+            shutil.rmtree(root)
+
+    @SharedAdapterMocker()
+    def test_upload_plan(self, m):
+        global capturedOutput
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            for extra in [ '-tests.jar', '-tests.jar.asc', '.aar', '.jar.md5', '.zip.asc' ]:
+                with open(os.path.join(project_dir, 'myproject-1.2.3' + extra), 'wb') as f:
+                    f.write(b'x' * 10)
+            with open(os.path.join(project_dir, 'otherproject-1.2.3.jar'), 'wb') as f:
+                f.write(b'x')
+            capturedOutput=""
+            main(['--group', 'com.example', '--jobs', '4', 'upload', '--plan', project_dir, 'myproject', '1.2.3'])
+            self.assertEquals(0, len(m.request_history))
+            self.assertEquals(
+"""Warning: ignoring signature myproject-1.2.3.zip.asc which has no matching artifact
+Upload plan for myproject 1.2.3:
+  myproject-1.2.3.pom                                                    13 bytes  + md5, sha1
+  myproject-1.2.3.pom.asc                                                17 bytes
+  myproject-1.2.3.aar                                                    10 bytes  + md5, sha1
+  myproject-1.2.3.jar                                                    13 bytes  + md5, sha1
+  myproject-1.2.3.jar.asc                                                17 bytes
+  myproject-1.2.3-javadoc.jar                                            21 bytes  + md5, sha1
+  myproject-1.2.3-javadoc.jar.asc                                        25 bytes
+  myproject-1.2.3-sources.jar                                            21 bytes  + md5, sha1
+  myproject-1.2.3-sources.jar.asc                                        25 bytes
+  myproject-1.2.3-tests.jar                                              10 bytes  + md5, sha1
+  myproject-1.2.3-tests.jar.asc                                          10 bytes
+  maven-metadata.xml (generated)                                                   + md5, sha1
+  Warning: myproject-1.2.3.aar is not signed
+Total: 26 requests, 482 bytes, about 7 round-trips with 4 concurrent uploads
+""", capturedOutput)
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_upload_fails_fast(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        m.register_uri('PUT', UPLOADS_URL + "/com/example/myproject/1.2.3/myproject-1.2.3-sources.jar", status_code=502)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            with self.assertRaises(IOError):
+                main(['--group', 'com.example', '--jobs', '1', 'upload', project_dir, 'myproject', '1.2.3'])
+            self.assertEquals(expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example', failing='myproject-1.2.3-sources.jar'), capturedOutput)
+            self.assertEquals(17, len(m.request_history)) # The failing upload was tried 5 times
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_upload_bundle(self, m):
+        global capturedOutput
+        received = [ ]
+        def consume(request, context):
+            received.append(b"".join(request.body))
+            return '{"repositoryUris":["https://oss.sonatype.org/content/repositories/comexample-1101"]}'
+        m.register_uri('POST', BUNDLE_UPLOAD_URL, text=consume)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            capturedOutput=""
+            main(['--group', 'com.example', 'upload', '--bundle', project_dir, 'myproject', '1.2.3'])
+            self.assertEquals(
+"""Uploading 8 files as myproject-1.2.3-bundle.jar... [done]
+Staged into https://oss.sonatype.org/content/repositories/comexample-1101
+""", capturedOutput)
+            self.assertEquals(1, len(m.request_history))
+            boundary = m.request_history[0].headers['Content-Type'].split('boundary=')[1].encode('ascii')
+            body = received[0]
+            self.assertTrue(body.startswith(b"--" + boundary + b"\r\n"))
+            self.assertTrue(body.endswith(b"\r\n--" + boundary + b"--\r\n"))
+            archive = zipfile.ZipFile(io.BytesIO(body[body.index(b"\r\n\r\n") + 4:body.rindex(b"\r\n--" + boundary)]))
+            self.assertEquals(None, archive.testzip())
+            self.assertEquals(['myproject-1.2.3' + suffix for suffix in ARTIFACT_SUFFIXES], archive.namelist())
+            self.assertEquals(b'myproject-sources.jar.asc', archive.read('myproject-1.2.3-sources.jar.asc'))
+        finally:
+            shutil.rmtree(project_dir)
+
+    @SharedAdapterMocker()
+    def test_start_repository(self, m):
+        global capturedOutput
+        m.get(PROFILES_URL, text="""<stagingProfiles><data>
+  <stagingProfile><id>1a2b3c</id><name>com.example</name></stagingProfile>
+  <stagingProfile><id>4d5e6f</id><name>com.example.sub</name></stagingProfile>
+  <stagingProfile><id>7a8b9c</id><name>com.other</name></stagingProfile>
+</data></stagingProfiles>""")
+        m.post(PROFILES_URL + "/1a2b3c/start", [
+            { 'text': '{"data":{"stagedRepositoryId":"comexample-1042","description":"started from cli"}}' },
+            { 'text': '{"data":{"stagedRepositoryId":"comexample-1043","description":"release"}}' } ])
+        capturedOutput=""
+        main(['--group', 'com.example.tools', 'start'])
+        main(['--group', 'com.example.tools', 'start', '--description', 'release'])
+        self.assertEquals("comexample-1042\ncomexample-1043\n", capturedOutput)
+        self.assertEquals(['GET', 'POST', 'POST'], [ r.method for r in m.request_history ]) # The profile id was cached
+        self.assertEquals({ 'data': { 'description': 'release' } }, m.request_history[2].json())
+
+    @SharedAdapterMocker()
+    def test_upload_by_repository_id(self, m):
+        global capturedOutput
+        m.register_uri('PUT', requests_mock.ANY)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            main(['--group', 'com.example', '--repository', 'comexample-1042', 'upload', project_dir, 'myproject', '1.2.3'])
+            urls = [ r.url for r in m.request_history ]
+            self.assertEquals(19, len(urls))
+            self.assertTrue(DEPLOY_BY_REPOSITORY_ID_URL + "comexample-1042/com/example/myproject/1.2.3/myproject-1.2.3.jar" in urls)
+            self.assertTrue(all(url.startswith(DEPLOY_BY_REPOSITORY_ID_URL + "comexample-1042/") for url in urls))
+        finally:
+            shutil.rmtree(project_dir)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with open(here + '/test-fixtures/staging/profile_repositories.xml', 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        reset_config(baseURL="http://127.0.0.1:" + str(self.server.server_address[1]), useCache=False)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        reset_config()
+
+    def test_connections_are_reused(self):
+        global capturedOutput
+        capturedOutput=""
+        ossrhClient = client.Client(group='com.example')
+        try:
+            cli.run_command(ossrhClient, 'list', [ ], { 'stats': True })
+            cli.run_command(ossrhClient, 'list', [ ], { 'stats': True })
+            stats = ossrhClient.connection_stats()
+        finally:
+            ossrhClient.close()
+        self.assertEquals(1, stats['connections'])
+        self.assertEquals(2, stats['requests'])
+        # Each job reports its own requests only
+        self.assertTrue("Connections opened: 1, requests sent: 1, connections reused: 0\n" in capturedOutput)
+        self.assertTrue("Connections opened: 0, requests sent: 1, connections reused: 1\n" in capturedOutput)
+
+
+class ClientTest(unittest.TestCase):
+
+    def test_clients_are_independent(self):
+        reset_config()
+        projects = [ ]
+        errors = [ ]
+        def upload(ossrhClient, project_dir):
+            try:
+                ossrh.upload_project(ossrhClient, planner.plan_project(project_dir, 'myproject', '1.2.3'))
+            except Exception as e:
+                errors.append(e)
+        clients = [ ]
+        nexus = fakenexus.FakeNexus(latency=0.001)
+        nexus.add_profile('2', 'org.sample')
+        try:
+            nexus.start()
+            threads = [ ]
+            for group in [ 'com.example', 'org.sample' ]:
+                project_dir = make_project('myproject', '1.2.3')
+                projects.append(project_dir)
+                ossrhClient = client.Client(creds=('hello', 'notapassword'), agent=group + '-agent', group=group,
+                    baseURL=nexus.url, uploadWorkers=4, useCache=False)
+                clients.append(ossrhClient)
+                threads.append(threading.Thread(target=upload, args=(ossrhClient, project_dir)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEquals([ ], errors)
+            self.assertEquals(38, nexus.request_count('PUT'))
+            repos = [ repo for repo in nexus.repositories.values() if repo.fields.get('userAgent', '').endswith('-agent') ]
+            self.assertEquals(2, len(repos))
+            for repo in repos:
+                group = repo.fields['userAgent'][:-len('-agent')]
+                self.assertEquals(group, repo.fields['profileName'])
+                self.assertEquals(19, len(repo.files))
+                for path in repo.files:
+                    self.assertTrue(path.startswith("/" + group.replace('.', '/') + "/myproject/"))
+            self.assertEquals(None, config.group)
+        finally:
+            for ossrhClient in clients:
+                ossrhClient.close()
+            nexus.stop()
+            for project_dir in projects:
+                shutil.rmtree(project_dir)
+
+    def test_unknown_setting(self):
+        with self.assertRaises(ValueError):
+            client.Client(groupId='com.example')
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.directory, 'sock')
+        reset_config(useCache=False)
+        self.server = server.Server(self.socketPath)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.log = logger.default_log # Output must be routed to the remote client
+
+    def tearDown(self):
+        logger.log = recorder
+        self.server.shutdown()
+        self.server.server_close()
+        reset_config()
+        shutil.rmtree(self.directory)
+
+    @SharedAdapterMocker()
+    def test_jobs_share_clients(self, m):
+        m.add_matcher(static_matcher)
+        output = [ ]
+        self.assertEquals(0, remote.run(self.socketPath, ['--group', 'com.example', 'list'], out=output.append, err=output.append))
+        self.assertEquals(0, remote.run(self.socketPath, ['--group', 'com.example', '--agent', 'GHgvBjb7fCZYfTtVEJ3n5Hf2IfYJbNQA', 'list'],
+            out=output.append, err=output.append))
+        self.assertEquals(0, remote.run(self.socketPath, ['--group', 'com.example', 'list'], out=output.append, err=output.append))
+        lines = "".join(output).split("\n")
+        self.assertEquals(2 + 6 + 2 + 1 + 2 + 6 + 1, len(lines))
+        self.assertTrue(lines[2].startswith("BC72ZFoAEIbbM2p5aDcWgZeOgCLnvfgm        | comexample-1093"))
+        self.assertEquals(2, len(self.server.pool._clients))
+        self.assertEquals(0o600, os.stat(self.socketPath).st_mode & 0o777)
+
+    @SharedAdapterMocker()
+    def test_worker_output_reaches_client(self, m):
+        attempts = [ ]
+        def flaky(request, context):
+            request.body.read()
+            attempts.append(request)
+            if len(attempts) == 1:
+                context.status_code = 502
+            return ''
+        def consume(request, context):
+            if hasattr(request.body, 'read'):
+                request.body.read()
+            return ''
+        m.register_uri('PUT', requests_mock.ANY, text=consume)
+        m.register_uri('PUT', UPLOADS_URL + "/com/example/myproject/1.2.3/myproject-1.2.3.jar", text=flaky)
+        project_dir = make_project('myproject', '1.2.3')
+        try:
+            output = [ ]
+            self.assertEquals(0, remote.run(self.socketPath, ['--log-level', 'debug', '--log-json', '--group', 'com.example',
+                'upload', project_dir, 'myproject', '1.2.3'], out=output.append, err=output.append))
+            records = [ json.loads(line) for line in "".join(output).splitlines() ]
+            retries = [ r for r in records if r['level'] == 'debug' and r['message'].startswith("Retrying PUT") ]
+            self.assertEquals(1, len(retries))
+            self.assertNotEquals('MainThread', retries[0]['thread'])
+            uploads = [ r['message'] for r in records if r['level'] == 'info' ]
+            self.assertEquals(expected_upload_lines(project_dir, 'myproject', '1.2.3', 'com/example').splitlines(), uploads)
+        finally:
+            shutil.rmtree(project_dir)
+
+    def test_failed_job(self):
+        output = [ ]
+        self.assertEquals(1, remote.run(self.socketPath, ['list', 'extra'], out=output.append, err=output.append))
+        self.assertTrue("".join(output).startswith("Error: Too many parameters. Expected no parameter.\n"))
+        self.assertEquals("Too many parameters. Expected no parameter.\n", output[-1])
+
+
+class EndToEndTest(unittest.TestCase):
+    """Runs commands against a fake Nexus instead of mocked requests"""
+
+    def setUp(self):
+        self.nexus = fakenexus.FakeNexus(transitionSeconds=0.05)
+        self.nexus.start()
+        reset_config(creds=('hello', 'notapassword'), agent='e2e-agent', group='com.example', baseURL=self.nexus.url,
+            pollInitialInterval=0.01, pollTimeout=60, useCache=False, retryInitialDelay=0.001)
+        self.project_dir = make_project('myproject', '1.2.3')
+
+    def tearDown(self):
+        self.nexus.stop()
+        shutil.rmtree(self.project_dir)
+        reset_config()
+
+    def staged_files(self):
+        repos = [ repo for repo in self.nexus.repositories.values() if repo.fields.get('userAgent') == 'e2e-agent' ]
+        self.assertEquals(1, len(repos))
+        return repos[0]
+
+    def test_upload_and_publish(self):
+        global capturedOutput
+        capturedOutput=""
+        main(['upload', self.project_dir, 'myproject', '1.2.3'])
+        repo = self.staged_files()
+        self.assertEquals(19, len(repo.files))
+        self.assertEquals(b"myproject.jar", repo.files['/com/example/myproject/1.2.3/myproject-1.2.3.jar'])
+
+        capturedOutput=""
+        main(['inspect', repo.id])
+        self.assertTrue(self.nexus.url + "/repositories/" + repo.id + "/content/com/example/myproject/1.2.3/myproject-1.2.3.pom\n" in capturedOutput)
+
+        main(['publish'])
+        self.assertFalse(repo.id in self.nexus.repositories)
+        self.assertTrue(self.nexus.request_count('GET', 'profile_repositories') > 2)
+
+    def test_transient_errors_are_retried(self):
+        self.nexus.errorRate = 0.2
+        self.nexus.throttleRate = 0.1
+        main(['upload', self.project_dir, 'myproject', '1.2.3'])
+        self.assertEquals(19, len(self.staged_files().files))
+        self.assertTrue(self.nexus.request_count('PUT') > 19)
+
+    def test_start_and_upload_to_repository(self):
+        global capturedOutput
+        capturedOutput=""
+        main(['start'])
+        repoId = capturedOutput.strip().split("\n")[-1]
+        self.assertEquals('open', self.nexus.repositories[repoId].fields['type'])
+        jsonl = os.path.join(self.project_dir, 'requests.jsonl')
+        main(['--repository', repoId, '--metrics-jsonl', jsonl, 'upload', self.project_dir, 'myproject', '1.2.3'])
+        self.assertEquals(19, len(self.nexus.repositories[repoId].files))
+        self.assertEquals(19, self.nexus.request_count('PUT', '/deployByRepositoryId/' + repoId + '/'))
+        with open(jsonl) as f:
+            endpoints = set(json.loads(line)['endpoint'] for line in f)
+        self.assertEquals(set([ "/staging/deployByRepositoryId/{repositoryId}/" ]), endpoints)
+
+    def test_request_metrics(self):
+        global capturedOutput
+        self.nexus.throttleRate = 0.2
+        directory = tempfile.mkdtemp()
+        try:
+            jsonl = os.path.join(directory, 'requests.jsonl')
+            prom = os.path.join(directory, 'ossrh.prom')
+            capturedOutput=""
+            main(['--stats', '--metrics-jsonl', jsonl, '--metrics-prom', prom, 'upload', self.project_dir, 'myproject', '1.2.3'])
+            with open(jsonl) as f:
+                records = [ json.loads(line) for line in f ]
+            puts = [ r for r in records if r['method'] == 'PUT' ]
+            self.assertEquals(self.nexus.request_count('PUT'), len(puts))
+            self.assertEquals(set([ api.UPLOADS_PATH ]), set(r['endpoint'] for r in puts))
+            self.assertEquals(19, len([ r for r in puts if r['status'] == 201 ]))
+            self.assertEquals(self.nexus.bytesIn, sum(r['requestBytes'] for r in records))
+            with open(prom) as f:
+                exposition = f.read()
+            self.assertTrue('ossrh_requests_total{method="PUT",endpoint="/staging/deploy/maven2/",status="201"} 19\n' in exposition)
+            self.assertTrue('ossrh_request_duration_seconds_count{method="PUT",endpoint="/staging/deploy/maven2/"} ' +
+                str(len(puts)) + '\n' in exposition)
+            self.assertTrue(re.search(r'\nPUT +/staging/deploy/maven2/ +' + str(len(puts)) + ' +' + str(len(puts) - 19) + ' ', capturedOutput))
+        finally:
+            shutil.rmtree(directory)
+
+    def run_jobs(self, ossrhClient, jobs):
+        """Runs (command, arguments, report) jobs concurrently with the same client. Returns the output of each."""
+        outputs = [ [ ] for _ in jobs ]
+        errors = [ ]
+        def run(output, cmd, cmd_args, report):
+            logger.set_thread_sink(output.append)
+            try:
+                cli.run_command(ossrhClient, cmd, cmd_args, report)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                logger.set_thread_sink(None)
+        logger.log = logger.default_log
+        try:
+            threads = [ threading.Thread(target=run, args=(output, ) + job) for (output, job) in zip(outputs, jobs) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            logger.log = recorder
+        self.assertEquals([ ], errors)
+        return [ "".join(output) for output in outputs ]
+
+    def test_concurrent_jobs_record_their_own_requests(self):
+        self.nexus.latency = 0.005
+        directory = tempfile.mkdtemp()
+        ossrhClient = client.Client()
+        try:
+            uploadJSONL = os.path.join(directory, 'upload.jsonl')
+            listJSONL = os.path.join(directory, 'list.jsonl')
+            outputs = self.run_jobs(ossrhClient, [
+                ('upload', [ self.project_dir, 'myproject', '1.2.3' ], { 'stats': True, 'metricsJSONL': uploadJSONL }),
+                ('list', [ ], { 'stats': True, 'metricsJSONL': listJSONL }) ])
+            with open(uploadJSONL) as f:
+                uploads = [ json.loads(line) for line in f ]
+            with open(listJSONL) as f:
+                lists = [ json.loads(line) for line in f ]
+            self.assertEquals(self.nexus.request_count('PUT'), len(uploads))
+            self.assertEquals(set([ 'PUT' ]), set(r['method'] for r in uploads))
+            self.assertEquals([ ('GET', api.STAGING_REPOS_PATH) ], [ (r['method'], r['endpoint']) for r in lists ])
+            self.assertTrue("requests sent: {}, ".format(len(uploads)) in outputs[0])
+            self.assertTrue("requests sent: 1, " in outputs[1])
+            self.assertEquals(len(uploads) + 1, ossrhClient.connection_stats()['requests'])
+        finally:
+            ossrhClient.close()
+            shutil.rmtree(directory)
+
+    def test_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            uploadTrace = os.path.join(directory, 'upload.json')
+            publishTrace = os.path.join(directory, 'publish.json')
+            main(['--trace', uploadTrace, 'upload', self.project_dir, 'myproject', '1.2.3'])
+            main(['--trace', publishTrace, 'publish'])
+            with open(uploadTrace) as f:
+                events = json.load(f)['traceEvents']
+            spans = [ e for e in events if e['ph'] == 'X' ]
+            self.assertEquals(1, len([ e for e in spans if e['name'] == 'upload' and e['cat'] == 'command' ]))
+            self.assertEquals(4, len([ e for e in spans if e['name'] == 'hash' ]))
+            self.assertEquals(19, len([ e for e in spans if e['name'] == 'upload' and e['cat'] == 'ossrh' ]))
+            puts = [ e for e in spans if e['name'] == 'PUT ' + api.UPLOADS_PATH ]
+            self.assertEquals(19, len(puts))
+            self.assertTrue(all(e['args']['status'] == 201 for e in puts))
+            threads = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+            self.assertTrue(all(e['tid'] in threads for e in spans))
+            self.assertTrue(len(set(e['tid'] for e in puts)) > 1)
+
+            with open(publishTrace) as f:
+                spans = [ e for e in json.load(f)['traceEvents'] if e['ph'] == 'X' ]
+            close = [ e for e in spans if e['name'] == 'close' ][0]
+            release = [ e for e in spans if e['name'] == 'release' ][0]
+            polls = [ e for e in spans if e['name'] == 'poll' ]
+            self.assertTrue(len(polls) >= 2)
+            for poll in polls:
+                parent = close if poll['ts'] < release['ts'] else release
+                self.assertTrue(parent['ts'] <= poll['ts'] and poll['ts'] + poll['dur'] <= parent['ts'] + parent['dur'])
+            self.assertEquals(1, len([ e for e in spans if e['name'] == 'POST ' + api.ACTION_CLOSE_PATH ]))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_concurrent_jobs_trace_their_own_spans(self):
+        self.nexus.latency = 0.005
+        directory = tempfile.mkdtemp()
+        ossrhClient = client.Client()
+        try:
+            uploadTrace = os.path.join(directory, 'upload.json')
+            listTrace = os.path.join(directory, 'list.json')
+            self.run_jobs(ossrhClient, [
+                ('upload', [ self.project_dir, 'myproject', '1.2.3' ], { 'trace': uploadTrace }),
+                ('list', [ ], { 'trace': listTrace }) ])
+            with open(uploadTrace) as f:
+                uploadSpans = [ e['name'] for e in json.load(f)['traceEvents'] if e['ph'] == 'X' ]
+            with open(listTrace) as f:
+                listSpans = [ e['name'] for e in json.load(f)['traceEvents'] if e['ph'] == 'X' ]
+            # The list job is over long before the upload, whose spans are still all traced
+            self.assertEquals(self.nexus.request_count('PUT'), uploadSpans.count('PUT ' + api.UPLOADS_PATH))
+            self.assertEquals(19, uploadSpans.count('upload') - 1)
+            self.assertFalse('GET ' + api.STAGING_REPOS_PATH in uploadSpans)
+            self.assertEquals(sorted([ 'list', 'find repositories', 'GET ' + api.STAGING_REPOS_PATH ]), sorted(listSpans))
+            self.assertTrue(ossrhClient.tracer is tracing.DISABLED)
+        finally:
+            ossrhClient.close()
+            shutil.rmtree(directory)
+
+    def test_bundle_upload(self):
+        main(['upload', '--bundle', self.project_dir, 'myproject', '1.2.3'])
+        self.assertEquals(1, self.nexus.request_count('POST', 'bundle_upload'))
+        self.assertEquals(8, len(self.staged_files().files))
+
+
+class ScriptedDraws(object):
+    """Stands in for the random draws of a FakeNexus, such that the requests which fail are known in advance"""
+
+    def __init__(self, draws):
+        self.draws = list(draws)
+
+    def random(self):
+        return self.draws.pop(0) if len(self.draws) > 0 else 1.0
+
+    def choice(self, values):
+        return values[0]
+
+
+@unittest.skipIf(aio == None or aio.aiohttp == None, "the asyncio API requires Python 3 and aiohttp")
+class AsyncTest(unittest.TestCase):
+    """Runs the coroutines of `aio` against a fake Nexus"""
+
+    def setUp(self):
+        self.nexus = fakenexus.FakeNexus(transitionSeconds=0.05, errorRate=0.5, throttleRate=0.5)
+        self.nexus.random = ScriptedDraws([ ])
+        self.nexus.start()
+        self.loop = asyncio.new_event_loop()
+        self.client = client.Client(creds=('hello', 'notapassword'), agent='aio-agent', group='com.example',
+            baseURL=self.nexus.url, useCache=False, pollInitialInterval=0.01, retryInitialDelay=0.001)
+        self.records = [ ]
+        self.aclient = aio.AsyncClient(self.client, hooks=[ self.records.append ])
+        self.project_dir = make_project('myproject', '1.2.3')
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.aclient.close())
+        self.loop.close()
+        self.client.close()
+        self.nexus.stop()
+        shutil.rmtree(self.project_dir)
+
+    def upload(self):
+        self.loop.run_until_complete(aio.upload_project(self.aclient, planner.plan_project(self.project_dir, 'myproject', '1.2.3')))
+        repos = [ repo for repo in self.nexus.repositories.values() if repo.fields.get('userAgent') == 'aio-agent' ]
+        self.assertEquals(1, len(repos))
+        return repos[0]
+
+    def test_failed_puts_are_retried(self):
+        global capturedOutput
+        capturedOutput=""
+        # The first request fails with a 500, the second is throttled
+        self.nexus.random = ScriptedDraws([ 0.1, 0.6 ])
+        repo = self.upload()
+        self.assertEquals(19, len(repo.files))
+        self.assertEquals(21, self.nexus.request_count('PUT'))
+        self.assertEquals(2, self.aclient.retry_stats()['retries'])
+        puts = [ record for record in self.records if record.method == 'PUT' ]
+        self.assertEquals(21, len(puts))
+        self.assertEquals([ ], [ record for record in puts if record.requestBytes == None ])
+        jar = '/com/example/myproject/1.2.3/myproject-1.2.3.jar'
+        self.assertEquals(hashlib.sha1(b'myproject.jar').hexdigest().encode('ascii'), repo.files[jar + '.sha1'])
+        self.assertEquals(expected_upload_lines(self.project_dir, 'myproject', '1.2.3', 'com/example'), capturedOutput)
+
+    def test_close_is_polled_until_done(self):
+        global capturedOutput
+        profileId = [ profileId for (profileId, name) in self.nexus.profiles.items() if name == 'com.example' ][0]
+        repoId = self.nexus.create_repository(profileId, 'aio-agent').id
+        capturedOutput=""
+        self.loop.run_until_complete(aio.close_repositories(self.aclient, [ repoId ]))
+        self.assertEquals('closed', self.nexus.repositories[repoId].fields['type'])
+        self.assertEquals("  " + repoId + ": success\n", capturedOutput)
+        self.assertTrue(self.client.poll_stats()['polls'] >= 2)
+        self.assertEquals(1, self.nexus.request_count('POST', 'bulk/close'))
+
+    def test_crawl_lists_every_directory(self):
+        repo = self.upload()
+        url = self.nexus.url + api.INSPECT_PATH + repo.id + "/content/"
+        result = self.loop.run_until_complete(aio.crawl(self.aclient, url))
+        self.assertEquals(sorted(repo.files), [ item.uri[len(url) - 1:] for item in result.leaves ])
+        self.assertEquals(0, len(result.unexplored))
+        self.assertEquals(result.directories + 1, self.nexus.request_count('GET', '/content/'))
+        result = self.loop.run_until_complete(aio.crawl(self.aclient, url, max_depth=1))
+        self.assertEquals([ url + 'com/example/' ], [ item.uri for item in result.unexplored ])
+
+    def test_crawl_revalidates_cached_listings(self):
+        repo = self.upload()
+        url = self.nexus.url + api.INSPECT_PATH + repo.id + "/content/"
+        cacheDir = tempfile.mkdtemp()
+        try:
+            listingCache = cache.ListingCache(cacheDir, 1000000, 'aio user')
+            first = self.loop.run_until_complete(aio.crawl(self.aclient, url, listingCache=listingCache))
+            self.assertEquals(first.directories + 1, len(listingCache._entries()))
+            del self.records[:]
+            second = self.loop.run_until_complete(aio.crawl(self.aclient, url, listingCache=listingCache))
+            self.assertEquals([ item.uri for item in first.leaves ], [ item.uri for item in second.leaves ])
+            self.assertEquals(set([ 304 ]), set(record.status for record in self.records))
+        finally:
+            shutil.rmtree(cacheDir)
+
+
+class CollectingStream(object):
+    def __init__(self):
+        self.writes = [ ]
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+class LoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = CollectingStream()
+        logger.configure(stream=self.stream)
+        logger.log = logger.default_log
+
+    def tearDown(self):
+        logger.log = recorder
+        logger.configure(level=logger.INFO, json=False, stream=sys.stdout)
+
+    def test_lines_of_concurrent_threads_are_written_whole(self):
+        logger.configure(json=True)
+        def work(n):
+            for i in range(50):
+                logger.log("thread " + str(n) + " line " + str(i) + "...", no_NL=True)
+                logger.log(" [done]")
+        threads = [ threading.Thread(target=work, args=(n, )) for n in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.flush()
+        records = [ json.loads(text) for text in self.stream.writes ]
+        self.assertEquals(200, len(records))
+        for record in records:
+            self.assertTrue(re.match(r'^thread \d line \d+\.\.\. \[done\]$', record['message']))
+            self.assertEquals('info', record['level'])
+
+    def test_fragments_are_shown_as_they_come(self):
+        logger.log("Waiting...", no_NL=True)
+        logger.log(".", no_NL=True)
+        logger.flush()
+        self.assertEquals([ "Waiting...", "." ], self.stream.writes)
+        logger.log("")
+        logger.log("Success.")
+        logger.flush()
+        self.assertEquals("Waiting....\nSuccess.\n", "".join(self.stream.writes))
+
+    def test_interrupted_lines_are_written_once(self):
+        started = threading.Event()
+        interrupted = threading.Event()
+        def upload():
+            logger.log("Uploading a...", no_NL=True)
+            started.set()
+            interrupted.wait()
+            logger.log(".", no_NL=True)
+            logger.log(" [done]")
+        thread = threading.Thread(target=upload)
+        thread.start()
+        started.wait()
+        logger.log("Uploading b...", no_NL=True)
+        logger.log(" [done]")
+        logger.log("Waiting...", no_NL=True)
+        interrupted.set()
+        thread.join()
+        logger.log(" done")
+        logger.flush()
+        self.assertEquals("Uploading a.... [done]\nUploading b... [done]\nWaiting... done\n", "".join(self.stream.writes))
+        self.assertEquals("Uploading a...", self.stream.writes[0])
+
+    def test_lines_left_open_are_broken_to_write_other_records(self):
+        started = threading.Event()
+        done = threading.Event()
+        def wait():
+            logger.log("Waiting...", no_NL=True)
+            started.set()
+            done.wait()
+            logger.log(".", no_NL=True)
+            logger.log("")
+        thread = threading.Thread(target=wait)
+        thread.start()
+        started.wait()
+        logger.log("Other record")
+        logger.flush()
+        self.assertEquals("Waiting...\nOther record\n", "".join(self.stream.writes))
+        done.set()
+        thread.join()
+        logger.flush()
+        self.assertEquals("Waiting...\nOther record\n.\n", "".join(self.stream.writes))
+
+    def test_records_wait_for_open_lines_for_a_while_only(self):
+        holdSeconds = logger.HOLD_SECONDS
+        logger.HOLD_SECONDS = 0.05
+        try:
+            logger.log("Waiting...", no_NL=True)
+            thread = threading.Thread(target=logger.log, args=("Other record", ))
+            thread.start()
+            thread.join()
+            deadline = time.time() + 5
+            while len(self.stream.writes) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEquals("Waiting...\nOther record\n", "".join(self.stream.writes))
+            logger.log("")
+            logger.flush()
+            self.assertEquals("Waiting...\nOther record\n\n", "".join(self.stream.writes))
+        finally:
+            logger.HOLD_SECONDS = holdSeconds
+
+    def test_levels(self):
+        logger.configure(level=logger.WARNING)
+        logger.info("hidden")
+        logger.debug("hidden")
+        logger.warning("shown")
+        logger.log = recorder
+        global capturedOutput
+        capturedOutput=""
+        logger.info("hidden")
+        logger.error("recorded")
+        logger.flush()
+        self.assertEquals([ "shown\n" ], self.stream.writes)
+        self.assertEquals("recorded\n", capturedOutput)
+        self.assertRaises(ValueError, logger.parse_level, 'verbose')
+
+
+class ListingTest(unittest.TestCase):
+
+    def test_streaming_parse_keeps_matching_repositories(self):
+        with open(here + '/test-fixtures/staging/profile_repositories.xml', 'rb') as f:
+            payload = f.read()
+        chunks = [ payload[i:i + 100] for i in range(0, len(payload), 100) ]
+        repos = api.parse_repository_descriptors(chunks, "userAgent='4J5c83HM5216KgSa5Hjzp9B4NA2U8bd1'")
+        self.assertEquals(1, len(repos))
+        self.assertEquals('comexample-1095', repos[0].name)
+        self.assertEquals('123d30a6798c66', repos[0].profileId)
+        self.assertEquals('com.example', repos[0].profileName)
+        self.assertTrue(repos[0].isClosed)
+        self.assertFalse(repos[0].isTransitioning)
+        self.assertTrue(repos[0].created.startswith('2018-'))
+        self.assertEquals(9, len(api.parse_repository_descriptors(chunks)))
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.project_dir = make_project('myproject', '1.0')
+
+    def tearDown(self):
+        shutil.rmtree(self.project_dir)
+
+    def test_other_versions_are_not_planned(self):
+        make_project('myproject', '1.0.1', self.project_dir)
+        make_project('myproject', '1.0-1', self.project_dir)
+        plan = planner.plan_project(self.project_dir, 'myproject', '1.0')
+        self.assertEquals(sorted([ 'myproject-1.0' + suffix for suffix in ARTIFACT_SUFFIXES if not suffix.endswith('.asc') ]),
+            sorted(planned.artifact.name for planned in plan.artifacts))
+        plan = planner.plan_project(self.project_dir, 'myproject', '1.0.1')
+        self.assertEquals(4, len(plan.artifacts))
+        self.assertEquals('jar', plan.artifacts[1].artifact.extension)
+
+
+class ListingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        listingCache = cache.ListingCache(self.directory, 450, 'https://example.com user')
+        listingCache.put('http://a/', cache.CacheEntry(b'a' * 100, etag='"a"'))
+        listingCache.put('http://b/', cache.CacheEntry(b'b' * 100))
+        past = time.time() - 60
+        os.utime(listingCache._path('http://b/'), (past, past))
+        listingCache.put('http://c/', cache.CacheEntry(b'c' * 100))
+        self.assertEquals(None, listingCache.get('http://b/'))
+        self.assertEquals(b'a' * 100, listingCache.get('http://a/').body)
+        self.assertEquals({ 'If-None-Match': '"a"' }, listingCache.get('http://a/').validators())
+        self.assertEquals(b'c' * 100, listingCache.get('http://c/').body)
+
+    def test_puts_under_the_limit_do_not_scan_the_cache(self):
+        listingCache = cache.ListingCache(self.directory, 10000, 'https://example.com user')
+        scans = [ ]
+        entries = listingCache._entries
+        listingCache._entries = lambda: scans.append(1) or entries()
+        for i in range(20):
+            listingCache.put('http://%d/' % i, cache.CacheEntry(b'x' * 100))
+        listingCache.put('http://0/', cache.CacheEntry(b'y' * 100))
+        self.assertEquals(1, len(scans))
+        self.assertEquals(sum(size for (_, size, _) in entries()), listingCache._total)
+        for i in range(50):
+            listingCache.put('http://%d/' % i, cache.CacheEntry(b'x' * 100))
+        self.assertTrue(listingCache._total <= 10000)
+        self.assertEquals(sum(size for (_, size, _) in entries()), listingCache._total)
+        self.assertTrue(len(scans) < 10)
+
+    def test_profiles_and_seals_are_kept_per_server_and_user(self):
+        cache.ProfileCache(self.directory, 'https://example.com user').put('com.example', '123')
+        cache.ListingCache(self.directory, 450, 'https://example.com user').seal('comexample-1001')
+        for key in [ 'https://example.com user', 'https://example.com other', 'http://localhost:8081 user' ]:
+            mine = key == 'https://example.com user'
+            self.assertEquals('123' if mine else None, cache.ProfileCache(self.directory, key).get('com.example'))
+            self.assertEquals(mine, cache.ListingCache(self.directory, 450, key).is_sealed('comexample-1001'))
+
+
+    def test_concurrent_listing_fetches_are_coalesced(self):
+        descriptorCache = cache.DescriptorCache(self.directory, 'https://example.com user', 60)
+        fetches = [ ]
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.05)
+            return [ { 'repositoryId': 'comexample-1001' } ]
+        results = [ ]
+        threads = [ threading.Thread(target=lambda: results.append(descriptorCache.get(fetch))) for _ in range(5) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, len(fetches))
+        self.assertEquals([ [ { 'repositoryId': 'comexample-1001' } ] ] * 5, results)
+
+
+class HashTest(unittest.TestCase):
+
+    def test_single_pass_digests(self):
+        content = os.urandom(10000)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            digests = utils.hash_file(path, ('md5', 'sha1', 'sha256'), chunk_size=1024)
+            self.assertEquals(hashlib.md5(content).hexdigest(), digests['md5'])
+            self.assertEquals(hashlib.sha1(content).hexdigest(), digests['sha1'])
+            self.assertEquals(hashlib.sha256(content).hexdigest(), digests['sha256'])
+        finally:
+            os.remove(path)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Spans showing the shape of a command: which lookups, hashes, uploads and polls ran on which thread, when, and for how
+long. Written in the Chrome trace event format, which chrome://tracing and https://ui.perfetto.dev display.
+
+Operations open spans on the tracer of their job (see `client.JobClient`), which does nothing unless tracing was asked
+for:
+
+  with client.tracer.span("close", repository=name):
+    ...
+"""
+
+import os
+import json
+import time
+import threading
+
+class _NullSpan(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+_NULL_SPAN = _NullSpan()
+
+class NullTracer(object):
+  """Records nothing, at the cost of a method call per span"""
+  enabled = False
+
+  def span(self, name, category='ossrh', **args):
+    return _NULL_SPAN
+
+  def __call__(self, record):
+    pass
+
+DISABLED = NullTracer()
+
+class _Span(object):
+  __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+  def __init__(self, tracer, name, category, args):
+    self.tracer = tracer
+    self.name = name
+    self.category = category
+    self.args = args
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, excType, exc, traceback):
+    if excType != None:
+      self.args['error'] = excType.__name__
+    self.tracer.add(self.name, self.category, self.start, time.time() - self.start, self.args)
+    return False
+
+class Tracer(object):
+  """Collects spans from any thread. Also a request hook (see `client.JobClient`), turning every request
+  into a span of its own."""
+  enabled = True
+
+  def __init__(self):
+    self.pid = os.getpid()
+    self._events = [ ]
+    self._threads = { }
+    self._lock = threading.Lock()
+
+  def span(self, name, category='ossrh', **args):
+    """Returns a context manager recording a span around its block, with `args` attached to it"""
+    return _Span(self, name, category, args)
+
+  def __call__(self, record):
+    args = { 'status': record.status if record.status != None else record.error }
+    if record.requestBytes:
+      args['sent'] = record.requestBytes
+    if record.responseBytes:
+      args['received'] = record.responseBytes
+    self.add(record.method + " " + record.endpoint, 'http', record.timestamp, record.seconds, args)
+
+  def add(self, name, category, start, seconds, args):
+    """Records a span which started at `start` (seconds since the epoch) and lasted `seconds`, on the current thread"""
+    tid = self._thread_id()
+    # Appending to a list is atomic
+    self._events.append((name, category, start, seconds, tid, args))
+
+  def _thread_id(self):
+    ident = threading.current_thread().ident
+    tid = self._threads.get(ident)
+    if tid == None:
+      with self._lock:
+        tid = self._threads.get(ident)
+        if tid == None:
+          tid = self._threads[ident] = (len(self._threads) + 1, threading.current_thread().name)
+    return tid[0]
+
+  def events(self):
+    """Returns the spans as Chrome trace events, timestamps being in microseconds since the first span"""
+    spans = list(self._events)
+    origin = min(span[2] for span in spans) if len(spans) > 0 else 0
+    events = [ { 'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': { 'name': name } }
+      for (tid, name) in sorted(self._threads.values()) ]
+    for (name, category, start, seconds, tid, args) in spans:
+      events.append({ 'name': name, 'cat': category, 'ph': 'X', 'ts': round((start - origin) * 1e6, 1),
+        'dur': round(seconds * 1e6, 1), 'pid': self.pid, 'tid': tid, 'args': args })
+    return events
+
+  def write(self, path):
+    with open(path, 'w') as f:
+      json.dump({ 'traceEvents': self.events(), 'displayTimeUnit': 'ms' }, f)
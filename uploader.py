@@ -0,0 +1,132 @@
+# Copyright 2019 AppDynamics, Inc., and its affiliates
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Runs many uploads at once through a bounded pool of workers.
+"""
+
+import os
+import threading
+import concurrent.futures
+import logger
+import api
+from utils import HashingReader, CHECKSUM_ALGORITHMS
+
+class UploadJob:
+  """A single file to upload to ossrh. When `data` is set, it is uploaded instead of the file at local_path.
+  When `checksums` is set, the file is hashed while it is being uploaded and its checksums are uploaded right after.
+  `tag` tells what the job is part of, such as a module of a batch, and is passed on to the jobs it spawns."""
+
+  def __init__(self, local_path, remote_path, data=None, checksums=False, tag=None):
+    self.local_path = local_path
+    self.remote_path = remote_path
+    self.data = data
+    self.checksums = checksums
+    self.tag = tag
+
+  def __repr__(self):
+    return "(local={}, remote={})".format(self.local_path, self.remote_path)
+
+  def size(self):
+    if self.data != None:
+      return len(self.data)
+    return os.path.getsize(self.local_path)
+
+  def run(self, client):
+    """Uploads this file and returns the jobs which must follow it"""
+    if not self.checksums:
+      api.put_file(client, self.local_path, self.remote_path, self.data)
+      return [ ]
+    with open(self.local_path, 'rb') as f:
+      reader = HashingReader(f)
+      api.put_file(client, self.local_path, self.remote_path, reader)
+    return checksum_jobs(self.local_path, self.remote_path, reader.hexdigests(), self.tag)
+
+def checksum_jobs(local_file, remote_file, digests, tag=None):
+  """Returns jobs uploading the checksums of a file straight from memory"""
+  return [ UploadJob(local_file + "." + algorithm, remote_file + "." + algorithm, data=digests[algorithm].encode('ascii'),
+    tag=tag) for algorithm in CHECKSUM_ALGORITHMS ]
+
+class UploadCancelled(Exception):
+  """Raised by jobs which were not started because another upload failed"""
+
+class _Scheduled:
+  def __init__(self, job, future):
+    self.job = job
+    self.future = future
+    self.followups = [ ]
+
+def _run_job(client, job, abort):
+  if abort.is_set():
+    raise UploadCancelled()
+  try:
+    with client.tracer.span("upload", file=job.remote_path):
+      return job.run(client)
+  except:
+    abort.set()
+    raise
+
+def run_uploads(client, jobs, workers=None):
+  """Uploads all jobs concurrently. Stops scheduling new uploads as soon as one fails, and raises that failure
+  once the uploads in flight have settled. Results are logged in the order of `jobs`, each job followed by the
+  jobs it spawned, regardless of completion order. Returns the completed jobs, in that same order."""
+  if workers == None:
+    workers = client.uploadWorkers
+  abort = threading.Event()
+  # Workers log like the calling thread, to the same sink and with the same options
+  runJob = logger.carry(_run_job)
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+  scheduled = [ ]
+  try:
+    inFlight = { }
+    for job in jobs:
+      entry = _Scheduled(job, executor.submit(runJob, client, job, abort))
+      scheduled.append(entry)
+      inFlight[entry.future] = entry
+    while len(inFlight) > 0:
+      done, _ = concurrent.futures.wait(list(inFlight), return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        entry = inFlight.pop(future)
+        if future.cancelled() or future.exception() != None:
+          continue
+        for followup in future.result():
+          child = _Scheduled(followup, executor.submit(runJob, client, followup, abort))
+          entry.followups.append(child)
+          inFlight[child.future] = child
+      if abort.is_set():
+        for future in inFlight:
+          future.cancel()
+  finally:
+    executor.shutdown(wait=True)
+
+  errors = [ ]
+  completed = [ ]
+  _log_results(scheduled, errors, completed)
+  if len(errors) > 0:
+    raise errors[0]
+  return completed
+
+def _log_results(scheduled, errors, completed):
+  for entry in scheduled:
+    future = entry.future
+    if future.cancelled() or isinstance(future.exception(), UploadCancelled):
+      continue
+    logger.log("Uploading " + entry.job.local_path + " -> " + entry.job.remote_path + "...", no_NL=True)
+    if future.exception() != None:
+      logger.log(" [failed]")
+      errors.append(future.exception())
+    else:
+      logger.log(" [done]")
+      completed.append(entry.job)
+      _log_results(entry.followups, errors, completed)
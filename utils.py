@@ -12,20 +12,77 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import os
 import hashlib
 
-def hash_file_md5(local_file):
-  hasher = hashlib.md5()
-  with open(local_file, "rb") as inFile:
-    buf = inFile.read()
-    hasher.update(buf)
-  with open(local_file + ".md5", "w") as outFile:
-    outFile.write(hasher.hexdigest())
-
-def hash_file_sha1(local_file):
-  hasher = hashlib.sha1()
-  with open(local_file, "rb") as inFile:
-    buf = inFile.read()
-    hasher.update(buf)
-  with open(local_file + ".sha1", "w") as outFile:
-    outFile.write(hasher.hexdigest())
+# Size of the blocks read from disk while hashing. Memory usage stays bounded by this, whatever the size of the file.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Checksums uploaded alongside every artifact
+CHECKSUM_ALGORITHMS = ('md5', 'sha1')
+
+def hash_file(local_file, algorithms=CHECKSUM_ALGORITHMS, chunk_size=HASH_CHUNK_SIZE):
+  """Computes several digests of a file in a single pass over its contents. Returns a dict of algorithm -> hex digest."""
+  hashers = [ (algorithm, hashlib.new(algorithm)) for algorithm in algorithms ]
+  buf = bytearray(chunk_size)
+  view = memoryview(buf)
+  with open(local_file, "rb", buffering=0) as inFile:
+    while True:
+      n = inFile.readinto(buf)
+      if not n:
+        break
+      for (_, hasher) in hashers:
+        hasher.update(view[:n])
+  return dict((algorithm, hasher.hexdigest()) for (algorithm, hasher) in hashers)
+
+def hash_bytes(data, algorithms=CHECKSUM_ALGORITHMS):
+  """Same as hash_file, for content which is already in memory"""
+  return dict((algorithm, hashlib.new(algorithm, data).hexdigest()) for algorithm in algorithms)
+
+class HashingReader:
+  """Wraps a binary file such that everything read from it also feeds a set of digests.
+  Used as an upload body, it lets the file be hashed while it is sent, reading it from disk only once."""
+
+  def __init__(self, f, algorithms=CHECKSUM_ALGORITHMS):
+    self._file = f
+    self._algorithms = algorithms
+    self._start = f.tell()
+    self._size = os.fstat(f.fileno()).st_size - self._start
+    self._rewind()
+
+  def _rewind(self):
+    self._file.seek(self._start)
+    self._position = 0
+    self._hashers = [ (algorithm, hashlib.new(algorithm)) for algorithm in self._algorithms ]
+
+  def read(self, size=-1):
+    chunk = self._file.read(size)
+    self._position += len(chunk)
+    for (_, hasher) in self._hashers:
+      hasher.update(chunk)
+    return chunk
+
+  def __iter__(self):
+    while True:
+      chunk = self.read(HASH_CHUNK_SIZE)
+      if not chunk:
+        break
+      yield chunk
+
+  def __len__(self):
+    return self._size
+
+  def tell(self):
+    return self._position
+
+  def seek(self, offset, whence=0):
+    """Only rewinding to the start is supported, since digests cannot be rolled back"""
+    if offset != 0 or whence != 0:
+      raise IOError("HashingReader can only be rewound to its start")
+    self._rewind()
+
+  def hexdigests(self):
+    """Returns a dict of algorithm -> hex digest. Only meaningful once the whole file was read."""
+    if self._position != self._size:
+      raise IOError("File was not fully read: " + str(self._position) + " out of " + str(self._size) + " bytes")
+    return dict((algorithm, hasher.hexdigest()) for (algorithm, hasher) in self._hashers)